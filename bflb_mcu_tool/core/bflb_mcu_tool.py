@@ -23,9 +23,12 @@ from libs import bflb_efuse_boothd_create
 from libs import bflb_img_create
 from libs import bflb_img_loader
 from libs import bflb_flash_select
+from libs import bflb_build_cache
+from libs import bflb_gang_loader
 from libs import bflb_utils
 from libs.bflb_utils import verify_hex_num, get_eflash_loader, get_serial_ports, convert_path
 from libs.bflb_configobj import BFConfigParser
+from libs.bflb_flash_layout import FlashLayout
 import libs.bflb_ro_params_device_tree as bl_ro_device_tree
 
 parser_eflash = bflb_utils.eflash_loader_parser_init()
@@ -141,14 +144,10 @@ class BflbMcuTool(object):
         self.hash_ignore = gol.hash_ignore[chiptype]
         self.img_type = gol.img_type[chiptype]
         self.boot_src = gol.boot_src[chiptype]
+        # program these ports in parallel when more than one is given
+        self.gang_ports = []
         self.eflash_loader_t = bflb_eflash_loader.BflbEflashLoader(chipname, chiptype)
 
-    def bl_create_flash_default_data(self, length):
-        datas = bytearray(length)
-        for i in range(length):
-            datas[i] = 0xff
-        return datas
-
     def bl_get_file_data(self, files):
         datas = []
         for file in files:
@@ -208,6 +207,11 @@ class BflbMcuTool(object):
         ret = None
         try:
             bflb_utils.set_error_code("FFFF")
+            if len(self.gang_ports) > 1:
+                return bflb_gang_loader.gang_program(self.chipname, self.chiptype, args,
+                                                     eflash_loader_bin, self.gang_ports,
+                                                     self.eflash_loader_cfg_tmp,
+                                                     create_img_callback)
             ret = self.eflash_loader_t.efuse_flash_loader(args, None, eflash_loader_bin, callback,
                                                           None, create_img_callback)
             self.eflash_loader_t.object_status_clear()
@@ -426,23 +430,21 @@ class BflbMcuTool(object):
                     img_file = self.img_create_path + "/img_cpu1.bin"
                     img_output_file = self.img_create_path + "/whole_img_cpu1.bin"
                 if values["img_type"] == "SingleCPU":
-                    dummy_data = bytearray(8192)
-                else:
-                    dummy_data = bytearray(4096)
-                for i in range(len(dummy_data)):
-                    dummy_data[i] = 0xff
-                fp = open(bootinfo_file, 'rb')
-                data0 = fp.read() + bytearray(0)
-                fp.close()
-                fp = open(img_file, 'rb')
-                data1 = fp.read() + bytearray(0)
-                fp.close()
-                fp = open(img_output_file, 'wb+')
-                if data0[0:4] == data1[0:4]:
-                    fp.write(data1)
+                    img_offset = 8192
                 else:
-                    fp.write(data0 + dummy_data[0:len(dummy_data) - len(data0)] + data1)
-                fp.close()
+                    img_offset = 4096
+                whole_img = FlashLayout()
+                try:
+                    data0 = whole_img.map_file(bootinfo_file)
+                    data1 = whole_img.map_file(img_file)
+                    if data0[0:4] == data1[0:4]:
+                        whole_img.add(0, data1, "img")
+                    else:
+                        whole_img.add(0, data0, "bootinfo")
+                        whole_img.add(max(img_offset, len(data0)), data1, "img")
+                    whole_img.save(img_output_file)
+                finally:
+                    whole_img.close()
                 bflb_utils.printf("Output:", img_output_file)
             else:
                 group0_bootinfo_file = self.img_create_path + "/bootinfo_group0.bin"
@@ -450,46 +452,44 @@ class BflbMcuTool(object):
                 group1_bootinfo_file = self.img_create_path + "/bootinfo_group1.bin"
                 group1_img_output_file = self.img_create_path + "/img_group1.bin"
                 whole_img_output_file = self.img_create_path + "/whole_img.bin"
-                read_data = self.bl_get_file_data([group0_bootinfo_file])[0]
-                group0_img_offset = bflb_utils.bytearray_to_int(
-                    bflb_utils.bytearray_reverse(read_data[132:136]))
-                group0_img_len = bflb_utils.bytearray_to_int(
-                    bflb_utils.bytearray_reverse(read_data[140:144]))
-                read_data = self.bl_get_file_data([group1_bootinfo_file])[0]
-                group1_img_offset = bflb_utils.bytearray_to_int(
-                    bflb_utils.bytearray_reverse(read_data[132:136]))
-                group1_img_len = bflb_utils.bytearray_to_int(
-                    bflb_utils.bytearray_reverse(read_data[140:144]))
-                whole_img_len = 0
-                if group0_img_offset + group0_img_len > group1_img_offset + group1_img_len:
-                    whole_img_len = group0_img_offset + group0_img_len
-                else:
-                    whole_img_len = group1_img_offset + group1_img_len
-                whole_img_data = self.bl_create_flash_default_data(whole_img_len)
-                group0_bootinfo_filedata = self.bl_get_file_data([group0_bootinfo_file])[0]
-                whole_img_data[0:len(group0_bootinfo_filedata)] = group0_bootinfo_filedata
-
-                group1_bootinfo_filedata = self.bl_get_file_data([group1_bootinfo_file])[0]
-                whole_img_data[0x1000:len(group1_bootinfo_filedata)] = group1_bootinfo_filedata
-                filedata = self.bl_get_file_data([group0_img_output_file])[0]
-                if group0_img_len != len(filedata):
-                    bflb_utils.printf("group0 img len error, get %d except %d" %
-                                      (group0_img_len, len(filedata)))
-                if group0_bootinfo_filedata[0:4] == filedata[0:4]:
-                    whole_img_data = filedata
-                else:
-                    whole_img_data[group0_img_offset:group0_img_offset + len(filedata)] = filedata
-                filedata = self.bl_get_file_data([group1_img_output_file])[0]
-                if group1_img_len != len(filedata):
-                    bflb_utils.printf("group1 img len error, get %d except %d" %
-                                      (group1_img_len, len(filedata)))
-                if group1_bootinfo_filedata[0:4] == filedata[0:4]:
-                    whole_img_data = filedata
-                else:
-                    whole_img_data[group1_img_offset:group1_img_offset + len(filedata)] = filedata
-                fp = open(whole_img_output_file, 'wb+')
-                fp.write(whole_img_data)
-                fp.close()
+                # inputs are mapped and streamed to the output, whole image is never in memory
+                whole_img = FlashLayout()
+                try:
+                    group0_bootinfo_filedata = whole_img.map_file(group0_bootinfo_file)
+                    group0_img_offset = bflb_utils.bytearray_to_int(
+                        bflb_utils.bytearray_reverse(group0_bootinfo_filedata[132:136]))
+                    group0_img_len = bflb_utils.bytearray_to_int(
+                        bflb_utils.bytearray_reverse(group0_bootinfo_filedata[140:144]))
+                    group1_bootinfo_filedata = whole_img.map_file(group1_bootinfo_file)
+                    group1_img_offset = bflb_utils.bytearray_to_int(
+                        bflb_utils.bytearray_reverse(group1_bootinfo_filedata[132:136]))
+                    group1_img_len = bflb_utils.bytearray_to_int(
+                        bflb_utils.bytearray_reverse(group1_bootinfo_filedata[140:144]))
+                    whole_img.length = max(group0_img_offset + group0_img_len,
+                                           group1_img_offset + group1_img_len)
+                    whole_img.add(0, group0_bootinfo_filedata, "group0 bootinfo")
+                    whole_img.add(0x1000, group1_bootinfo_filedata, "group1 bootinfo")
+                    filedata = whole_img.map_file(group0_img_output_file)
+                    if group0_img_len != len(filedata):
+                        bflb_utils.printf("group0 img len error, get %d except %d" %
+                                          (group0_img_len, len(filedata)))
+                    if group0_bootinfo_filedata[0:4] == filedata[0:4]:
+                        whole_img.clear()
+                        whole_img.add(0, filedata, "group0 img")
+                    else:
+                        whole_img.add(group0_img_offset, filedata, "group0 img")
+                    filedata = whole_img.map_file(group1_img_output_file)
+                    if group1_img_len != len(filedata):
+                        bflb_utils.printf("group1 img len error, get %d except %d" %
+                                          (group1_img_len, len(filedata)))
+                    if group1_bootinfo_filedata[0:4] == filedata[0:4]:
+                        whole_img.clear()
+                        whole_img.add(0, filedata, "group1 img")
+                    else:
+                        whole_img.add(group1_img_offset, filedata, "group1 img")
+                    whole_img.save(whole_img_output_file)
+                finally:
+                    whole_img.close()
                 bflb_utils.printf("Output:", whole_img_output_file)
         except Exception as e:
             bflb_utils.printf("烧写执行出错:", e)
@@ -1797,9 +1797,12 @@ class BflbMcuTool(object):
                 bflb_utils.update_cfg(cfg, "LOAD_CFG", "xtal_type",
                                       self.xtal_type_.index(values["xtal_type"]))
             if values["img_type"] == "RAW":
-                img_raw_tmp = os.path.join(self.img_create_path, 'img_raw_tmp.bin')
-                shutil.copyfile(values["img_file"], img_raw_tmp)
-                bflb_utils.update_cfg(cfg, "FLASH_CFG", "file", img_raw_tmp)
+                # file list in cfg is split by whitespace, copy only such paths
+                img_raw_file = os.path.abspath(values["img_file"])
+                if re.search(r"[\s,]", img_raw_file):
+                    img_raw_file = os.path.join(self.img_create_path, 'img_raw_tmp.bin')
+                    shutil.copyfile(values["img_file"], img_raw_file)
+                bflb_utils.update_cfg(cfg, "FLASH_CFG", "file", img_raw_file)
                 bflb_utils.update_cfg(cfg, "FLASH_CFG", "address",
                                       values["img_addr"].replace("0x", ""))
             else:
@@ -1809,21 +1812,15 @@ class BflbMcuTool(object):
                     img_addr = int(values["img_addr"].replace("0x", ""), 16)
                     bootinfo_filedata = self.bl_get_file_data([bootinfo_file])[0]
                     filedata = self.bl_get_file_data([img_output_file])[0]
+                    whole_img = FlashLayout()
                     if bootinfo_filedata[0:4] == filedata[0:4]:
-                        whole_img_len = os.path.getsize(os.path.join(app_path, img_output_file))
-                        whole_img_data = self.bl_create_flash_default_data(whole_img_len)
-                        whole_img_data = filedata
+                        whole_img.add(0, filedata, "img")
                         fw_with_bootinfo = True
                     else:
-                        whole_img_len = img_addr + os.path.getsize(
-                            os.path.join(app_path, img_output_file))
-                        whole_img_data = self.bl_create_flash_default_data(whole_img_len)
-                        whole_img_data[0:len(bootinfo_filedata)] = bootinfo_filedata
-                        whole_img_data[img_addr:img_addr + len(filedata)] = filedata
+                        whole_img.add(0, bootinfo_filedata, "bootinfo")
+                        whole_img.add(img_addr, filedata, "img")
                         fw_with_bootinfo = False
-                    fp = open(os.path.join(app_path, whole_img_output_file), 'wb+')
-                    fp.write(whole_img_data)
-                    fp.close()
+                    whole_img.save(os.path.join(app_path, whole_img_output_file))
                     # bflb_utils.update_cfg(cfg, "FLASH_CFG", "file", convert_path(whole_img_output_file))
                     # bflb_utils.update_cfg(cfg, "FLASH_CFG", "address", values["bootinfo_addr"].replace("0x", ""))
                 if fw_with_bootinfo is True:
@@ -2020,7 +2017,7 @@ class BflbMcuTool(object):
                     whole_img_len = group1_img_offset + group1_img_len + group1_img_start
                 else:
                     whole_img_len = group0_img_offset + group0_img_len + group0_img_start
-                whole_img_data = self.bl_create_flash_default_data(whole_img_len)
+                whole_img = FlashLayout(whole_img_len)
 
                 if group0_img_len > 0:
                     group0_bootinfo_filedata = self.bl_get_file_data([group0_bootinfo_file])[0]
@@ -2034,12 +2031,13 @@ class BflbMcuTool(object):
                         bflb_utils.printf("group0 img len error, get %d except %d" %
                                           (group0_img_len, len(group0_filedata)))
                     if group0_bootinfo_filedata[0:4] == group0_filedata[0:4]:
-                        whole_img_data = group0_filedata
+                        whole_img = FlashLayout()
+                        whole_img.add(0, group0_filedata, "group0 img")
                         group0_fw_with_bootinfo = True
                     else:
-                        whole_img_data[0:len(group0_bootinfo_filedata)] = group0_bootinfo_filedata
-                        whole_img_data[group0_img_offset+group0_img_start : \
-                                    group0_img_offset+len(group0_filedata)+group0_img_start] = group0_filedata
+                        whole_img.add(0, group0_bootinfo_filedata, "group0 bootinfo")
+                        whole_img.add(group0_img_offset + group0_img_start, group0_filedata,
+                                      "group0 img")
                         group0_fw_with_bootinfo = False
 
                 if group1_img_len > 0:
@@ -2048,18 +2046,16 @@ class BflbMcuTool(object):
                         bflb_utils.printf("group1 img len error, get %d except %d" %
                                           (group1_img_len, len(group1_filedata)))
                     if group1_bootinfo_filedata[0:4] == group1_filedata[0:4]:
-                        whole_img_data = group1_filedata
+                        whole_img = FlashLayout()
+                        whole_img.add(0, group1_filedata, "group1 img")
                         group1_fw_with_bootinfo = True
                     else:
-                        whole_img_data[0x1000:len(group1_bootinfo_filedata
-                                                 )] = group1_bootinfo_filedata
-                        whole_img_data[group1_img_offset+group1_img_start : \
-                                    group1_img_offset+len(group1_filedata)+group1_img_start] = group1_filedata
+                        whole_img.add(0x1000, group1_bootinfo_filedata, "group1 bootinfo")
+                        whole_img.add(group1_img_offset + group1_img_start, group1_filedata,
+                                      "group1 img")
                         group1_fw_with_bootinfo = False
 
-                fp = open(os.path.join(app_path, whole_img_output_file), 'wb+')
-                fp.write(whole_img_data)
-                fp.close()
+                whole_img.save(os.path.join(app_path, whole_img_output_file))
                 # bflb_utils.update_cfg(cfg, "FLASH_CFG", "file", convert_path(whole_img_output_file))
                 # bflb_utils.update_cfg(cfg, "FLASH_CFG", "address", "00000000")
             file_list = ""
@@ -2220,20 +2216,16 @@ class BflbMcuTool(object):
                     bflb_utils.printf("group0 img len error, get %d except %d" %
                                       (group0_img_len, len(filedata)))
                 if bootinfo_filedata[0:4] == filedata[0:4]:
-                    whole_img_len = group0_img_len
-                    whole_img_data = self.bl_create_flash_default_data(whole_img_len)
-                    whole_img_data = filedata
+                    whole_img = FlashLayout()
+                    whole_img.add(0, filedata, "img")
                     fw_with_bootinfo = True
                 else:
-                    whole_img_len = group0_img_offset + group0_img_len
-                    whole_img_data = self.bl_create_flash_default_data(whole_img_len)
-                    whole_img_data[0:len(bootinfo_filedata)] = bootinfo_filedata
-                    whole_img_data[group0_img_offset:group0_img_offset + len(filedata)] = filedata
+                    whole_img = FlashLayout(group0_img_offset + group0_img_len)
+                    whole_img.add(0, bootinfo_filedata, "bootinfo")
+                    whole_img.add(group0_img_offset, filedata, "img")
                     fw_with_bootinfo = False
 
-                fp = open(os.path.join(app_path, whole_img_output_file), 'wb+')
-                fp.write(whole_img_data)
-                fp.close()
+                whole_img.save(os.path.join(app_path, whole_img_output_file))
                 # bflb_utils.update_cfg(cfg, "FLASH_CFG", "file", convert_path(whole_img_output_file))
                 # bflb_utils.update_cfg(cfg, "FLASH_CFG", "address", "00000000")
             if fw_with_bootinfo is True:
@@ -2284,20 +2276,66 @@ class BflbMcuTool(object):
                                         self.create_img_callback)
         return ret
 
+    def create_img_do(self, chipname, chiptype, values):
+        if chiptype == "bl808" or chiptype == "bl628":
+            return self.create_bl808_bl628_img(chipname, chiptype, values)
+        elif chiptype == "bl616" or chiptype == "wb03":
+            return self.create_bl616_img(chipname, chiptype, values)
+        else:
+            return self.create_default_img(chipname, chiptype, values)
+
+    def create_img_inputs(self, chipname, chiptype, values):
+        # everything create_img reads besides values
+        settings = {"chipname": chipname, "chiptype": chiptype}
+        if os.path.exists(self.eflash_loader_cfg_tmp):
+            cfg = BFConfigParser()
+            cfg.read(self.eflash_loader_cfg_tmp)
+            for section, option in (("FLASH_CFG", "flash_id"), ("EFUSE_CFG", "security_save")):
+                if cfg.has_option(section, option):
+                    settings[option] = cfg.get(section, option)
+        if conf_sign:
+            flash_cfg_dir = os.path.join(app_path, "utils", "flash", chipname)
+        else:
+            flash_cfg_dir = os.path.join(app_path, "utils", "flash", gol.flash_dict[chipname])
+        if os.path.isdir(flash_cfg_dir):
+            settings["flash_cfg"] = bflb_flash_select.flash_conf_dir_stamp(flash_cfg_dir)
+        input_files = []
+        for value in values.values():
+            if isinstance(value, str) and value and os.path.isfile(value):
+                input_files.append(value)
+        for path in (self.img_create_path, self.efuse_bh_path):
+            if os.path.isdir(path):
+                for file in os.listdir(path):
+                    if file.endswith(".ini") or file.endswith(".conf"):
+                        input_files.append(os.path.join(path, file))
+        return settings, input_files
+
     def create_img(self, chipname, chiptype, values):
         # basic check
         self.config = values
         error = True
         try:
-            if chiptype == "bl808" or chiptype == "bl628":
-                error = self.create_bl808_bl628_img(chipname, chiptype, values)
-                return error
-            elif chiptype == "bl616" or chiptype == "wb03":
-                error = self.create_bl616_img(chipname, chiptype, values)
-                return error
-            else:
-                error = self.create_default_img(chipname, chiptype, values)
-                return error
+            # skipped when nothing it reads changed since the last successful build
+            settings, input_files = self.create_img_inputs(chipname, chiptype, values)
+            # efuse_load_en and, for default chips, efuse entries of eflash loader cfg are
+            # set by create_img too
+            cfg_items = []
+            if chiptype not in ("bl808", "bl628", "bl616", "wb03"):
+                cfg_items = [(self.eflash_loader_cfg_tmp, "EFUSE_CFG", "file"),
+                             (self.eflash_loader_cfg_tmp, "EFUSE_CFG", "maskfile")]
+            error = bflb_build_cache.build_stage_run(
+                os.path.join(self.img_create_path, bflb_build_cache.build_manifest_name),
+                "create_img",
+                values,
+                settings,
+                input_files, [self.img_create_path],
+                self.create_img_do,
+                chipname,
+                chiptype,
+                values,
+                cfg_items=cfg_items,
+                attrs=(self, ("efuse_load_en",)))
+            return error
         except Exception as e:
             error = str(e)
             bflb_utils.printf(error)
@@ -2588,7 +2626,13 @@ def run(argv):
     parser.add_argument('--chipname', required=True, help='chip name')
     parser.add_argument("--interface", dest="interface", default="uart", help="interface to use")
     parser.add_argument("--bootsrc", dest="bootsrc", default="Flash", help="boot source select")
-    parser.add_argument("--port", dest="port", default=port, help="serial port to use")
+    parser.add_argument("--port",
+                        dest="port",
+                        default=port,
+                        help="serial port to use, comma separated ports are programmed in parallel")
+    parser.add_argument("--gang-vidpid",
+                        dest="gang_vidpid",
+                        help="program all ports of this usb-serial vid:pid in parallel")
     parser.add_argument("--baudrate",
                         dest="baudrate",
                         default=115200,
@@ -2631,9 +2675,21 @@ def run(argv):
     bflb_utils.printf("Firmware is " + str(args.firmware))
     bflb_utils.printf("Firmware group1 is " + str(args.firmware_group1))
     bflb_utils.printf("Device Tree is " + str(args.dts))
+    gang_ports = []
+    if args.gang_vidpid:
+        gang_ports = bflb_gang_loader.gang_ports_match(args.gang_vidpid)
+        if not gang_ports:
+            bflb_utils.printf("No serial port matches " + args.gang_vidpid)
+            sys.exit(1)
+        bflb_utils.printf("Gang ports are " + " ".join(gang_ports))
+    elif args.port and "," in args.port:
+        gang_ports = [item.strip() for item in args.port.split(",") if item.strip()]
+    if gang_ports:
+        args.port = gang_ports[0]
     bflb_utils.printf("==================================================")
     config = get_value(args)
     obj_mcu = BflbMcuTool(args.chipname, gol.dict_chip_cmd.get(args.chipname, "unkown chip type"))
+    obj_mcu.gang_ports = gang_ports
     try:
         res = obj_mcu.create_img(args.chipname, gol.dict_chip_cmd[args.chipname], config)
         if res is not True:
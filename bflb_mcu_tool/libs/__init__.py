@@ -12,9 +12,16 @@ from . import bflb_interface_uart
 from . import bflb_interface_sdio
 from . import bflb_interface_openocd
 from . import bflb_ecdh
+from . import bflb_ecdsa_sign
 from . import bflb_eflash_loader
 from . import bflb_efuse_boothd_create
 from . import bflb_flash_select
+from . import bflb_cfg_layout
+from . import bflb_flash_image
+from . import bflb_flash_layout
+from . import bflb_flash_sparse
+from . import bflb_gang_loader
+from . import bflb_build_cache
 from . import bflb_img_create
 from . import bflb_img_loader
 from . import bflb_pt_creater
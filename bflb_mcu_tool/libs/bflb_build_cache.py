@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+#  Copyright (C) 2021- BOUFFALO LAB (NANJING) CO., LTD.
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+import os
+import json
+import time
+import hashlib
+
+from libs import bflb_utils
+from libs import bflb_version
+from libs.bflb_configobj import BFConfigParser
+
+build_manifest_name = "build_manifest.json"
+# download only options, they do not change what is built
+build_values_ignore = ("dl_comport", "dl_comspeed", "dl_jlinkspeed")
+# mtime resolution of coarse file systems (fat), in ns
+build_mtime_slack = 2000000000
+
+
+def build_path(path):
+    # paths are keyed absolute, a relative one depends on cwd
+    return os.path.normcase(os.path.abspath(path))
+
+
+def build_value_path(value):
+    if isinstance(value, str) and value and \
+       (os.path.exists(value) or "/" in value or os.sep in value):
+        return build_path(value)
+    return value
+
+
+def build_file_stat(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def build_file_sha256(path):
+    sh = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        while True:
+            data = fp.read(0x100000)
+            if not data:
+                break
+            sh.update(data)
+    return sh.hexdigest()
+
+
+def build_dir_stat(dirs):
+    stats = {}
+    for dir in dirs:
+        for home, subdirs, files in os.walk(dir):
+            for file in files:
+                if file == build_manifest_name:
+                    continue
+                path = build_path(os.path.join(home, file))
+                try:
+                    stats[path] = build_file_stat(path)
+                except OSError:
+                    pass
+    return stats
+
+
+def build_manifest_load(manifest_file):
+    try:
+        with open(manifest_file, 'r') as fp:
+            return json.load(fp)
+    except Exception:
+        return {}
+
+
+def build_manifest_save(manifest_file, manifest):
+    try:
+        tmp_file = manifest_file + "." + str(os.getpid()) + ".tmp"
+        with open(tmp_file, 'w') as fp:
+            json.dump(manifest, fp, indent=1, sort_keys=True)
+        os.replace(tmp_file, manifest_file)
+    except Exception as e:
+        bflb_utils.printf(e)
+
+
+def build_cfg_items_get(cfg_items):
+    items = []
+    for cfg_file, section, option in cfg_items:
+        if not os.path.isfile(cfg_file):
+            continue
+        cfg = BFConfigParser()
+        cfg.read(cfg_file)
+        if cfg.has_option(section, option):
+            items.append([build_path(cfg_file), section, option, cfg.get(section, option)])
+    return items
+
+
+def build_cfg_items_set(items):
+    cfg_files = {}
+    for cfg_file, section, option, value in items:
+        if not os.path.isfile(cfg_file):
+            continue
+        if cfg_file not in cfg_files:
+            cfg = BFConfigParser()
+            cfg.read(cfg_file)
+            cfg_files[cfg_file] = [cfg, False]
+        cfg = cfg_files[cfg_file][0]
+        if not cfg.has_option(section, option) or cfg.get(section, option) != value:
+            cfg.set(section, option, value)
+            cfg_files[cfg_file][1] = True
+    for cfg_file, (cfg, changed) in cfg_files.items():
+        if changed:
+            cfg.write(cfg_file, "w+")
+
+
+def build_stage_key(stage, values, settings, input_files, record):
+    # an input the last build rewrote itself is taken by the hash it had before that build
+    sh = hashlib.sha256()
+    sh.update((bflb_version.version_text + stage).encode("utf-8"))
+    values = dict((item, build_value_path(value)) for item, value in values.items()
+                  if item not in build_values_ignore)
+    sh.update(json.dumps([values, settings], sort_keys=True, default=str).encode("utf-8"))
+    inputs = {}
+    for path in sorted(set(build_path(file) for file in input_files)):
+        if not os.path.isfile(path):
+            sh.update((path + " missing").encode("utf-8"))
+            continue
+        if path in record.get("inputs", {}) and \
+           record.get("outputs", {}).get(path) == build_file_stat(path):
+            inputs[path] = record["inputs"][path]
+        else:
+            inputs[path] = build_file_sha256(path)
+        sh.update((path + " " + inputs[path]).encode("utf-8"))
+    return sh.hexdigest(), inputs
+
+
+def build_stage_run(manifest_file,
+                    stage,
+                    values,
+                    settings,
+                    input_files,
+                    output_dirs,
+                    func,
+                    *args,
+                    cfg_items=(),
+                    attrs=None):
+    # run func(*args) unless inputs are the same as the last successful run and its outputs
+    # are untouched, values changed by func are saved and applied again when skipped,
+    # so are the (cfg_file, section, option) entries of cfg_items and attributes of attrs,
+    # a (object, names) pair, which func sets outside output_dirs
+    manifest = build_manifest_load(manifest_file)
+    record = manifest.get(stage, {})
+    key, inputs = build_stage_key(stage, values, settings, input_files, record)
+    # a record without outputs proves nothing was built, run func
+    if record.get("key") == key and record.get("outputs"):
+        for path, stat in record["outputs"].items():
+            if not os.path.isfile(path) or build_file_stat(path) != stat:
+                break
+        else:
+            values.update(record.get("values", {}))
+            build_cfg_items_set(record.get("cfg_items", []))
+            if attrs is not None:
+                for name, value in record.get("attrs", {}).items():
+                    setattr(attrs[0], name, value)
+            bflb_utils.printf("%s is up to date, skip" % stage)
+            return True
+    values_org = json.loads(json.dumps(values, default=str))
+    start_time = int(time.time() * 1000000000) - build_mtime_slack
+    stats = build_dir_stat(output_dirs)
+    ret = func(*args)
+    manifest = build_manifest_load(manifest_file)
+    if ret is True:
+        # every file func wrote, a rewrite keeping size and a coarse mtime leaves stat as it was,
+        # so files modified since func started count too, output dirs may hold files of others
+        outputs = {}
+        for path, stat in build_dir_stat(output_dirs).items():
+            if stats.get(path) != stat or stat[1] >= start_time:
+                outputs[path] = stat
+        values_changed = {}
+        for item, value in values.items():
+            if values_org.get(item) != value:
+                values_changed[item] = value
+                if isinstance(value, str) and os.path.isfile(value):
+                    outputs[build_path(value)] = build_file_stat(value)
+        manifest[stage] = {
+            "key": key,
+            "inputs": inputs,
+            "outputs": outputs,
+            "values": values_changed,
+            "cfg_items": build_cfg_items_get(cfg_items),
+            "attrs": dict((name, getattr(attrs[0], name)) for name in attrs[1]) if attrs else {}
+        }
+    else:
+        manifest.pop(stage, None)
+    build_manifest_save(manifest_file, manifest)
+    return ret
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+#  Copyright (C) 2021- BOUFFALO LAB (NANJING) CO., LTD.
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+import struct
+
+from libs import bflb_utils
+
+# compiled layouts, keyed by id of the cfg keys dict
+cfg_layout_cache = {}
+
+
+class CfgLayout(object):
+    # bitfield layout of bootheader/efuse cfg keys with integer fields and precomputed masks
+
+    def __init__(self, config_keys):
+        self.fields = {}
+        self.length = 0
+        for key, field in config_keys.items():
+            offset = int(field["offset"], 10)
+            pos = int(field["pos"], 10)
+            bitlen = int(field["bitlen"], 10)
+            val_mask = (1 << bitlen) - 1
+            self.fields[key] = (offset, pos, ~(val_mask << pos) & 0xFFFFFFFF, val_mask)
+            if offset + 4 > self.length:
+                self.length = offset + 4
+        self._unpack_fields = [(key, offset * 8 + pos, val_mask)
+                               for key, (offset, pos, clear_mask,
+                                         val_mask) in self.fields.items()]
+
+    def cfg_values(self, cfg, section):
+        values = []
+        for key in cfg.options(section):
+            if key not in self.fields:
+                bflb_utils.printf(key + " not exist")
+                continue
+            val = cfg.get(section, key)
+            if val.startswith("0x"):
+                val = int(val, 16)
+            else:
+                val = int(val, 10)
+            values.append((key, val))
+        return values
+
+    def pack(self, values, length=None, base=0):
+        # values is a list of (key, val), later keys win; returns data and mask of set bits
+        words = {}
+        mask_words = {}
+        for key, val in values:
+            field = self.fields.get(key)
+            if field is None:
+                bflb_utils.printf(key + " not exist")
+                continue
+            offset, pos, clear_mask, val_mask = field
+            offset -= base
+            words[offset] = ((words.get(offset, 0) & clear_mask) + (val << pos)) & 0xFFFFFFFF
+            if val != 0:
+                mask_words[offset] = mask_words.get(offset, 0) | (~clear_mask & 0xFFFFFFFF)
+        if length is None:
+            length = self.length - base
+        data = bytearray(length)
+        data_mask = bytearray(length)
+        for offset, word in words.items():
+            struct.pack_into("<I", data, offset, word)
+        for offset, word in mask_words.items():
+            struct.pack_into("<I", data_mask, offset, word)
+        return data, data_mask
+
+    def unpack(self, data, base=0):
+        value = int.from_bytes(data, "little")
+        limit = len(data) * 8
+        shift_base = base * 8
+        fields = {}
+        for key, shift, val_mask in self._unpack_fields:
+            shift -= shift_base
+            if 0 <= shift < limit:
+                fields[key] = (value >> shift) & val_mask
+        return fields
+
+    def unpack_many(self, datas, base=0):
+        return [self.unpack(data, base) for data in datas]
+
+
+def get_cfg_layout(config_keys):
+    layout = cfg_layout_cache.get(id(config_keys))
+    if layout is None or layout[0] is not config_keys:
+        layout = (config_keys, CfgLayout(config_keys))
+        cfg_layout_cache[id(config_keys)] = layout
+    return layout[1]
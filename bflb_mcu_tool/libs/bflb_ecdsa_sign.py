@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+#  Copyright (C) 2021- BOUFFALO LAB (NANJING) CO., LTD.
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+import os
+import hashlib
+
+import ecdsa
+
+try:
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.hazmat.primitives.asymmetric.utils import decode_dss_signature
+    cryptography_support = True
+except ImportError:
+    cryptography_support = False
+
+from libs import bflb_utils
+
+# loaded signers, keyed by key file path and stat
+ecdsa_signer_cache = {}
+
+
+class BflbEcdsaSigner(object):
+
+    def __init__(self, privatekey_file, publickey_file):
+        with open(privatekey_file, 'rb') as fp:
+            privatekey_pem = fp.read()
+        with open(publickey_file, 'rb') as fp:
+            publickey_pem = fp.read()
+        self.sk = ecdsa.SigningKey.from_pem(privatekey_pem)
+        self.vk = ecdsa.VerifyingKey.from_pem(publickey_pem)
+        self.pk_data = self.vk.to_string()
+        self.pk_hash = bflb_utils.img_create_sha256_data(self.pk_data)
+        self.sig_len = self.sk.curve.baselen
+        if self.sk.get_verifying_key().to_string() != self.pk_data:
+            bflb_utils.printf("Warning: private key ", privatekey_file,
+                              " does not match public key ", publickey_file)
+        self.native_key = None
+        if cryptography_support:
+            try:
+                self.native_key = serialization.load_pem_private_key(privatekey_pem, password=None)
+            except Exception as e:
+                bflb_utils.printf("Load private key with cryptography fail, use ecdsa: ", e)
+        self.backend = "cryptography" if self.native_key is not None else "ecdsa"
+
+    def sign(self, data):
+        if self.native_key is not None:
+            r, s = decode_dss_signature(
+                self.native_key.sign(bytes(data), ec.ECDSA(hashes.SHA256())))
+            return r.to_bytes(self.sig_len, "big") + s.to_bytes(self.sig_len, "big")
+        return self.sk.sign(data, hashfunc=hashlib.sha256, sigencode=ecdsa.util.sigencode_string)
+
+    def sign_batch(self, data_list):
+        return [self.sign(data) for data in data_list]
+
+    def verify(self, data, signature):
+        try:
+            return self.vk.verify(signature,
+                                  data,
+                                  hashfunc=hashlib.sha256,
+                                  sigdecode=ecdsa.util.sigdecode_string)
+        except ecdsa.BadSignatureError:
+            return False
+
+
+def get_ecdsa_signer(privatekey_file, publickey_file):
+    key = []
+    for file in (privatekey_file, publickey_file):
+        st = os.stat(file)
+        key.append((os.path.abspath(file), st.st_size, st.st_mtime_ns))
+    key = tuple(key)
+    signer = ecdsa_signer_cache.get(key)
+    if signer is None:
+        signer = BflbEcdsaSigner(privatekey_file, publickey_file)
+        bflb_utils.printf("Sign backend: ", signer.backend)
+        ecdsa_signer_cache[key] = signer
+    return signer
+
+
+def ecdsa_sign_data(data, privatekey_file, publickey_file):
+    return get_ecdsa_signer(privatekey_file, publickey_file).sign(data)
+
+
+def ecdsa_sign_batch(data_list, privatekey_file, publickey_file):
+    return get_ecdsa_signer(privatekey_file, publickey_file).sign_batch(data_list)
@@ -24,6 +24,7 @@ import sys
 import re
 import time
 import hashlib
+import struct
 import binascii
 import subprocess
 import traceback
@@ -31,6 +32,8 @@ import shutil
 import lzma
 import csv
 import zipfile
+import threading
+from collections import deque
 from importlib import reload
 
 import portalocker
@@ -52,6 +55,8 @@ from libs import bflb_interface_openocd
 from libs import bflb_efuse_boothd_create
 from libs import bflb_img_loader
 from libs import bflb_flash_select
+from libs import bflb_flash_sparse
+from libs.bflb_flash_image import FlashImage
 from libs import bflb_utils
 from libs import bflb_ecdh
 from libs.bflb_utils import app_path, chip_path, open_file, eflash_loader_parser_init, convert_path
@@ -83,6 +88,114 @@ try:
 except ImportError:
     NUM_ERR = 5
 
+# image data preloaded by gang programming, keyed by absolute file path
+flash_file_preload = {}
+
+
+def flash_file_preload_key(file):
+    return os.path.normcase(os.path.abspath(os.path.join(app_path, file)))
+
+
+# xz payloads for decompress write, keyed by data sha256 and filter settings
+flash_xz_filters = [
+    {
+        "id": lzma.FILTER_LZMA2,
+        "dict_size": 32768
+    },
+]
+flash_xz_cache = {}
+flash_xz_cache_lock = threading.Lock()
+flash_xz_cache_dir = os.path.join(app_path, "xz_cache")
+flash_xz_cache_max = 32
+# smaller images are written plain, trial compress costs more than xz saves
+flash_xz_check_min = 64 * 1024
+
+
+def flash_xz_cache_key(data):
+    return hashlib.sha256(data).hexdigest() + "_lzma2_%d_crc32" % flash_xz_filters[0]["dict_size"]
+
+
+def flash_xz_cache_read(key):
+    cache_file = os.path.join(flash_xz_cache_dir, key + ".xz")
+    if not os.path.exists(cache_file):
+        return None
+    try:
+        with open(cache_file, 'rb') as fp:
+            flash_data = fp.read()
+        # drop broken cache file
+        if hashlib.sha256(lzma.decompress(flash_data)).hexdigest() == key[:64]:
+            os.utime(cache_file, None)
+            return flash_data
+        os.remove(cache_file)
+    except Exception as e:
+        bflb_utils.printf(e)
+    return None
+
+
+def flash_xz_cache_write(key, flash_data):
+    try:
+        if not os.path.exists(flash_xz_cache_dir):
+            os.makedirs(flash_xz_cache_dir)
+        # gang workers may write same file, rename is atomic
+        cache_file = os.path.join(flash_xz_cache_dir, key + ".xz")
+        tmp_file = cache_file + "." + str(os.getpid()) + ".tmp"
+        with open(tmp_file, 'wb') as fp:
+            fp.write(flash_data)
+        os.replace(tmp_file, cache_file)
+        cache_files = [
+            os.path.join(flash_xz_cache_dir, f)
+            for f in os.listdir(flash_xz_cache_dir)
+            if f.endswith(".xz")
+        ]
+        cache_files.sort(key=os.path.getmtime)
+        for f in cache_files[:-flash_xz_cache_max]:
+            os.remove(f)
+    except Exception as e:
+        bflb_utils.printf(e)
+
+
+# lock of cfg_file_update, gang workers replace it with one lock shared by all ports
+cfg_file_lock = threading.Lock()
+
+
+def cfg_file_update(cfg_file, update):
+    # read, update and write cfg file under cfg_file_lock, rename is atomic for readers
+    with cfg_file_lock:
+        cfg = BFConfigParser()
+        if os.path.isfile(cfg_file):
+            cfg.read(cfg_file)
+        if update(cfg) is not False:
+            tmp_file = cfg_file + "." + str(os.getpid()) + ".tmp"
+            cfg.write(tmp_file)
+            os.replace(tmp_file, cfg_file)
+
+
+def flash_xz_compress_worker(key, data, event, cache=True):
+    # pieces of an image are compressed for one write, only whole images go to xz cache dir
+    flash_data = None
+    if cache:
+        flash_data = flash_xz_cache_read(key)
+    if flash_data is None:
+        try:
+            flash_data = lzma.compress(data, check=lzma.CHECK_CRC32, filters=flash_xz_filters)
+            if cache:
+                flash_xz_cache_write(key, flash_data)
+        except Exception as e:
+            bflb_utils.printf(e)
+    with flash_xz_cache_lock:
+        if flash_data is None:
+            del flash_xz_cache[key]
+        else:
+            flash_xz_cache[key] = flash_data
+            # entries are dropped when consumed, limit the ones never written
+            done_keys = [
+                item for item in flash_xz_cache
+                if not isinstance(flash_xz_cache[item], threading.Event)
+            ]
+            for item in done_keys[:-flash_xz_cache_max]:
+                del flash_xz_cache[item]
+    event.set()
+
 
 class BflbEflashLoader(object):
 
@@ -108,6 +221,21 @@ class BflbEflashLoader(object):
         self._need_shake_hand = True
         # retry limit when checksum error occurred
         self._checksum_err_retry_limit = 2
+        # flash write frames in flight before waiting for ack
+        self._flash_write_window = 1
+        # only erase and write sectors which differ from flash
+        self._delta_write = False
+        # device xz decompress speed in bytes per second
+        self._decompress_speed = 2 * 1024 * 1024
+        # file data read for early xz compress and its decision, cache key or None for plain write,
+        # handed to the write once
+        self._flash_file_data = {}
+        self._flash_xz_keys = []
+        # rewrite bad sectors found by segment sha when verify fail
+        self._verify_repair = 0
+        # journal of confirmed flash read and write offsets, empty to disable
+        self._session_journal_file = ""
+        self._session_checkpoint = 0x10000
         self._csv_burn_en = False
         self._task_num = None
         self._cpu_reset = False
@@ -124,6 +252,8 @@ class BflbEflashLoader(object):
         self._csv_file = ""
         self._skip_addr = 0
         self._skip_len = 0
+        # all (addr, len) ranges not to write
+        self._skip_ranges = []
         self._loader_checksum_err_str = "FL0103"
         self._bootinfo = None
         self._isp_shakehand_timeout = 0
@@ -297,6 +427,13 @@ class BflbEflashLoader(object):
             "flash_xip_readSha", "flash_read_jid", "flash_read_status_reg", "log_read",
             "ecdh_get_pk", "ecdh_chanllenge", "efuse_security_read"
         ]
+        # cmd id bytes of each command, converted once
+        self._com_cmd_ids = {}
+        for section, cmd in self._com_cmds.items():
+            self._com_cmd_ids[section] = bflb_utils.hexstr_to_bytearray(cmd["cmd_id"])
+        # command frame buffer, reused by every command
+        self._com_frame_buf = bytearray(0)
+        self._com_frame_view = memoryview(self._com_frame_buf)
 
     def object_status_clear(self):
         self._bootinfo = None
@@ -310,26 +447,49 @@ class BflbEflashLoader(object):
     def set_mass_opt_flag(self, flag):
         self._mass_opt = flag
 
+    # build command frame in place: cmd_id + checksum + len + [addr] + data
+    def com_build_one_cmd(self, cmd_id, data_send, addr=None):
+        data_len = len(data_send)
+        if addr is not None:
+            data_len += 4
+        frame_len = 4 + data_len
+        if len(self._com_frame_buf) < frame_len:
+            self._com_frame_buf = bytearray(frame_len)
+            self._com_frame_view = memoryview(self._com_frame_buf)
+        frame = self._com_frame_view
+        frame[0] = cmd_id[0]
+        frame[2] = data_len & 0xff
+        frame[3] = (data_len >> 8) & 0xff
+        if addr is not None:
+            frame[4:8] = struct.pack("<I", addr)
+            frame[8:frame_len] = data_send
+        else:
+            frame[4:frame_len] = data_send
+        # checksum covers len and data
+        frame[1] = sum(frame[2:frame_len]) & 0xff
+        return frame[0:frame_len]
+
+    # command send without waiting for ack
+    def com_send_one_cmd(self, cmd_id, data_send, addr=None):
+        self._bflb_com_if.if_write(self.com_build_one_cmd(cmd_id, data_send, addr))
+
     # command common process
-    def com_process_one_cmd(self, section, cmd_id, data_send):
+    def com_process_one_cmd(self, section, cmd_id, data_send, addr=None):
         data_read = bytearray(0)
-        data_len = bflb_utils.int_to_2bytearray_l(len(data_send))
-        checksum = 0
-        checksum += bflb_utils.bytearray_to_int(data_len[0:1]) + bflb_utils.bytearray_to_int(
-            data_len[1:2])
-        for char in data_send:
-            checksum += char
-        data = cmd_id + bflb_utils.int_to_2bytearray_l(checksum & 0xff)[0:1] + data_len + data_send
-        self._bflb_com_if.if_write(data)
+        self.com_send_one_cmd(cmd_id, data_send, addr)
         if section in self._resp_cmds:
             res, data_read = self._bflb_com_if.if_deal_response()
+            # uart response may be a view of its receive buffer, valid until next command,
+            # flash read callers copy it out at once, others get a copy as they may keep it
+            if data_read is not None and section != "flash_read" and section != "flash_xip_read":
+                data_read = bytearray(data_read)
         else:
             res = self._bflb_com_if.if_deal_ack()
         return res, data_read
 
     # change interface rate
     def com_inf_change_rate(self, section, newrate):
-        cmd_id = bflb_utils.hexstr_to_bytearray(self._com_cmds.get(section)["cmd_id"])
+        cmd_id = self._com_cmd_ids[section]
         cmd_len = bflb_utils.hexstr_to_bytearray(self._com_cmds.get(section)["data_len"])
         bflb_utils.printf("Process ", section, ", cmd=",
                           binascii.hexlify(cmd_id).decode('utf-8'), ",data len=",
@@ -568,7 +728,7 @@ class BflbEflashLoader(object):
             self._bflb_com_if.if_init(self._bflb_com_device, self._bflb_com_speed, self._chip_type,
                                       self._chip_name)
         # send command
-        cmd_id = bflb_utils.hexstr_to_bytearray(self._com_cmds.get("opt_finish")["cmd_id"])
+        cmd_id = self._com_cmd_ids["opt_finish"]
         ret, dmy = self.com_process_one_cmd("opt_finish", cmd_id, bytearray(0))
         if ret.startswith("OK"):
             return True
@@ -589,7 +749,7 @@ class BflbEflashLoader(object):
             self._bflb_com_if.if_init(self._bflb_com_device, self._bflb_com_speed, self._chip_type,
                                       self._chip_name)
         # send command
-        cmd_id = bflb_utils.hexstr_to_bytearray(self._com_cmds.get("flash_boot")["cmd_id"])
+        cmd_id = self._com_cmd_ids["flash_boot"]
         ret, dmy = self.com_process_one_cmd("flash_boot", cmd_id, bytearray(0))
         if ret.startswith("OK"):
             return True
@@ -631,7 +791,7 @@ class BflbEflashLoader(object):
             if self.img_load_shake_hand() is False:
                 return False
         # send command
-        cmd_id = bflb_utils.hexstr_to_bytearray(self._com_cmds.get("reset")["cmd_id"])
+        cmd_id = self._com_cmd_ids["reset"]
         ret, dmy = self.com_process_one_cmd("reset", cmd_id, bytearray(0))
         if ret.startswith("OK"):
             return True
@@ -648,7 +808,7 @@ class BflbEflashLoader(object):
                 return False
         start_time = (time.time() * 1000)
         # send command
-        cmd_id = bflb_utils.hexstr_to_bytearray(self._com_cmds.get("clk_set")["cmd_id"])
+        cmd_id = self._com_cmd_ids["clk_set"]
         irq_enable = bytearray(4)
         load_speed = bytearray(4)
         if irq_en:
@@ -675,6 +835,95 @@ class BflbEflashLoader(object):
         time.sleep(0.01)
         return True
 
+    def com_speed_loopback_test(self, frames=8):
+        # read back a burst of flash data without retry and check it against flash sha256
+        readdata = bytearray(0)
+        cur_len = self._bflb_com_tx_size - 8
+        try:
+            for i in range(frames):
+                data_send = bflb_utils.int_to_4bytearray_l(
+                    i * cur_len) + bflb_utils.int_to_4bytearray_l(cur_len)
+                ret, data_read = self.com_process_one_cmd("flash_read",
+                                                          self._com_cmd_ids["flash_read"],
+                                                          data_send)
+                if not ret or not ret.startswith("OK") or len(data_read) != cur_len:
+                    return False
+                readdata += data_read
+            data_send = bflb_utils.int_to_4bytearray_l(0) + bflb_utils.int_to_4bytearray_l(
+                len(readdata))
+            ret, data_read = self.com_process_one_cmd("flash_readSha",
+                                                      self._com_cmd_ids["flash_readSha"],
+                                                      data_send)
+            if not ret or not ret.startswith("OK"):
+                return False
+        except Exception as e:
+            bflb_utils.printf(e)
+            return False
+        return bytes(data_read) == hashlib.sha256(readdata).digest()
+
+    def com_speed_probe(self, speed):
+        bflb_utils.printf("try speed: ", speed)
+        try:
+            ret = self.com_inf_change_rate("change_rate", speed)
+        except Exception as e:
+            bflb_utils.printf(e)
+            return False
+        if not ret or not ret.startswith("OK"):
+            return False
+        if self.com_speed_loopback_test() is False:
+            bflb_utils.printf("loopback test fail")
+            return False
+        return True
+
+    def com_speed_autotune(self, speed_list, cache_file):
+        bflb_utils.printf("========= uart speed autotune =========")
+        start_time = (time.time() * 1000)
+        cache_key = self._bflb_com_device
+        adapter_id = bflb_utils.get_serial_adapter_id(self._bflb_com_device)
+        if adapter_id:
+            cache_key += " " + adapter_id
+        cache_key = re.sub(r"[^\w.:\- ]", "_", cache_key)
+        cache_cfg = BFConfigParser()
+        if os.path.isfile(cache_file):
+            cache_cfg.read(cache_file)
+        good_speed = self._bflb_com_speed
+        cached_speed = 0
+        if cache_cfg.has_option(cache_key, "speed"):
+            cached_speed = int(cache_cfg.get(cache_key, "speed"))
+        if cached_speed > good_speed:
+            if self.com_speed_probe(cached_speed):
+                bflb_utils.printf("use cached speed: ", cached_speed)
+                return True
+            bflb_utils.printf("cached speed fail, tune again")
+            self._bflb_com_speed = good_speed
+            if self.img_load_shake_hand() is False:
+                return False
+        for speed in sorted(set(speed_list)):
+            if speed <= good_speed:
+                continue
+            if self.com_speed_probe(speed):
+                good_speed = speed
+                continue
+            # link is lost at new speed, shake hand again at last good speed
+            self._bflb_com_speed = good_speed
+            if self.img_load_shake_hand() is False:
+                return False
+            break
+        bflb_utils.printf("autotune speed: ", good_speed)
+        bflb_utils.printf("Autotune time cost(ms): ", (time.time() * 1000) - start_time)
+        if cached_speed != good_speed:
+
+            def update(cache_cfg):
+                if cache_key not in cache_cfg.sections():
+                    cache_cfg.cfg_obj[cache_key] = {}
+                cache_cfg.set(cache_key, "speed", good_speed)
+
+            try:
+                cfg_file_update(cache_file, update)
+            except Exception as e:
+                bflb_utils.printf(e)
+        return True
+
     def close_port(self, shakehand=0):
         if self._bflb_com_if is not None:
             self._bflb_com_if.if_close()
@@ -705,7 +954,7 @@ class BflbEflashLoader(object):
         bflb_utils.printf(self._ecdh_public_key)
         bflb_utils.printf("ecdh private key")
         bflb_utils.printf(self._ecdh_private_key)
-        cmd_id = bflb_utils.hexstr_to_bytearray(self._com_cmds.get("ecdh_get_pk")["cmd_id"])
+        cmd_id = self._com_cmd_ids["ecdh_get_pk"]
         data_send = bytearray.fromhex(self._ecdh_public_key)
         ret, data_read = self.com_process_one_cmd("ecdh_get_pk", cmd_id, data_send)
         if ret.startswith("OK") is True:
@@ -716,8 +965,7 @@ class BflbEflashLoader(object):
             bflb_utils.printf("ecdh shared key")
             bflb_utils.printf(self._ecdh_shared_key)
             # challenge
-            cmd_id = bflb_utils.hexstr_to_bytearray(
-                self._com_cmds.get("ecdh_chanllenge")["cmd_id"])
+            cmd_id = self._com_cmd_ids["ecdh_chanllenge"]
             data_send = bytearray(0)
             ret, data_read = self.com_process_one_cmd("ecdh_chanllenge", cmd_id, data_send)
             if ret.startswith("OK") is True:
@@ -770,7 +1018,7 @@ class BflbEflashLoader(object):
             bflb_utils.printf(FLASH_LOAD_SHAKE_HAND)
             if self.img_load_shake_hand() is False:
                 return False, None
-        cmd_id = bflb_utils.hexstr_to_bytearray(self._com_cmds.get("efuse_read_mac")["cmd_id"])
+        cmd_id = self._com_cmd_ids["efuse_read_mac"]
         bflb_utils.printf("Read mac addr ")
         ret, data_read = self.com_process_one_cmd("efuse_read_mac", cmd_id, bytearray(0))
         if ret.startswith("OK") is False:
@@ -792,7 +1040,7 @@ class BflbEflashLoader(object):
             bflb_utils.printf(FLASH_LOAD_SHAKE_HAND)
             if self.img_load_shake_hand() is False:
                 return False, None
-        cmd_id = bflb_utils.hexstr_to_bytearray(self._com_cmds.get("efuse_write_mac")["cmd_id"])
+        cmd_id = self._com_cmd_ids["efuse_write_mac"]
         ret, data_read = self.com_process_one_cmd("efuse_write_mac", cmd_id, macaddr)
         bflb_utils.printf("Write mac addr ")
         if ret.startswith("OK") is False:
@@ -816,7 +1064,7 @@ class BflbEflashLoader(object):
             cmd_name = "efuse_security_read"
         else:
             cmd_name = "efuse_read"
-        cmd_id = bflb_utils.hexstr_to_bytearray(self._com_cmds.get(cmd_name)["cmd_id"])
+        cmd_id = self._com_cmd_ids[cmd_name]
         data_send = bflb_utils.int_to_4bytearray_l(start_addr) + bflb_utils.int_to_4bytearray_l(
             data_len)
         ret, data_read = self.com_process_one_cmd(cmd_name, cmd_id, data_send)
@@ -870,7 +1118,7 @@ class BflbEflashLoader(object):
             cmd_name = "efuse_security_write"
         else:
             cmd_name = "efuse_write"
-        cmd_id = bflb_utils.hexstr_to_bytearray(self._com_cmds.get(cmd_name)["cmd_id"])
+        cmd_id = self._com_cmd_ids[cmd_name]
         data_send = efuse_data[0:124] + bytearray(4)
         if security_write:
             data_send = self.ecdh_encrypt_data(data_send)
@@ -934,7 +1182,7 @@ class BflbEflashLoader(object):
                 cmd_name = "efuse_security_write"
             else:
                 cmd_name = "efuse_write"
-            cmd_id = bflb_utils.hexstr_to_bytearray(self._com_cmds.get(cmd_name)["cmd_id"])
+            cmd_id = self._com_cmd_ids[cmd_name]
             data_send = efuse_data[128:252] + bytearray(4)
             if security_write:
                 data_send = self.ecdh_encrypt_data(data_send)
@@ -1157,7 +1405,7 @@ class BflbEflashLoader(object):
                 cmd_name = "efuse_security_write"
             else:
                 cmd_name = "efuse_write"
-            cmd_id = bflb_utils.hexstr_to_bytearray(self._com_cmds.get(cmd_name)["cmd_id"])
+            cmd_id = self._com_cmd_ids[cmd_name]
             start_addr = int(addr) - int(addr) % 16
             efuse_data = bytearray(int(addr) % 16) + bytearray.fromhex(data) + \
                          bytearray(16 - (int(addr) + int(len(data) / 2)) % 16)
@@ -1225,7 +1473,7 @@ class BflbEflashLoader(object):
             bflb_utils.printf(FLASH_LOAD_SHAKE_HAND)
             if self.img_load_shake_hand() is False:
                 return False, None
-        cmd_id = bflb_utils.hexstr_to_bytearray(self._com_cmds.get("flash_read_jid")["cmd_id"])
+        cmd_id = self._com_cmd_ids["flash_read_jid"]
         ret, data_read = self.com_process_one_cmd("flash_read_jid", cmd_id, bytearray(0))
         bflb_utils.printf("Read flash jedec ID ")
         if ret.startswith("OK") is False:
@@ -1246,8 +1494,7 @@ class BflbEflashLoader(object):
             if self.img_load_shake_hand() is False:
                 return False, None
 
-        cmd_id = bflb_utils.hexstr_to_bytearray(
-            self._com_cmds.get("flash_read_status_reg")["cmd_id"])
+        cmd_id = self._com_cmd_ids["flash_read_status_reg"]
         data_send = bflb_utils.int_to_4bytearray_l(int(cmd,
                                                        16)) + bflb_utils.int_to_4bytearray_l(len)
         ret, data_read = self.com_process_one_cmd("flash_read_status_reg", cmd_id, data_send)
@@ -1270,8 +1517,7 @@ class BflbEflashLoader(object):
                 return False, "Flash load shake hand fail"
 
         bflb_utils.printf("write_data ", write_data)
-        cmd_id = bflb_utils.hexstr_to_bytearray(
-            self._com_cmds.get("flash_write_status_reg")["cmd_id"])
+        cmd_id = self._com_cmd_ids["flash_write_status_reg"]
         data_send = bflb_utils.int_to_4bytearray_l(int(
             cmd, 16)) + bflb_utils.int_to_4bytearray_l(len) + bflb_utils.int_to_4bytearray_l(
                 int(write_data, 16))
@@ -1300,7 +1546,7 @@ class BflbEflashLoader(object):
             self._bflb_com_if.if_set_rx_timeout(self._default_time_out)
         else:
             self._bflb_com_if.if_set_rx_timeout(self._erase_time_out / 1000)
-        cmd_id = bflb_utils.hexstr_to_bytearray(self._com_cmds.get("flash_erase")["cmd_id"])
+        cmd_id = self._com_cmd_ids["flash_erase"]
         data_send = bflb_utils.int_to_4bytearray_l(start_addr) + \
                     bflb_utils.int_to_4bytearray_l(end_addr)
         try_cnt = 0
@@ -1338,6 +1584,54 @@ class BflbEflashLoader(object):
         self._bflb_com_if.if_set_rx_timeout(self._default_time_out)
         return True
 
+    def flash_erase_plan_check(self, flash_ranges, erase):
+        # erase all files before writing only when each file would erase its whole range anyway
+        if erase != 1 or len(flash_ranges) < 2:
+            # chip erase or no erase asked, a single file gains nothing from a plan
+            return False
+        if self._delta_write is True:
+            # delta write erases only sectors that differ from the file
+            return False
+        if self._session_journal_file != "":
+            # a resumed session keeps the pieces written by the last session
+            return False
+        if self._flash2_en is True:
+            # files over flash1 end are split and the rest is erased on flash2 after bank switch
+            return False
+        if self._skip_len != 0:
+            # skipped ranges keep their flash content
+            return False
+        if self._isp_en is True:
+            # isp mode is served by the handler in running firmware, keep its per file erase
+            return False
+        if self._mass_opt is False and \
+           (self._chip_type == "bl808" or self._chip_type == "bl616" or \
+            self._chip_type == "wb03" or self._chip_type == "bl628"):
+            for start_addr, flash_data_len in flash_ranges:
+                if start_addr <= 0x1000 and start_addr + flash_data_len - 1 > 0x1000:
+                    # rf para at 0x1000 is read back by flash_load_opt before its file is written
+                    return False
+        return True
+
+    def flash_erase_plan(self, flash_ranges, erase=1):
+        # merge 4K aligned erase ranges of all files, device erases large blocks inside a range
+        if self.flash_erase_plan_check(flash_ranges, erase) is False:
+            return []
+        plan = []
+        for start_addr, flash_data_len in flash_ranges:
+            if flash_data_len == 0:
+                continue
+            end_addr = start_addr + flash_data_len - 1
+            plan.append([start_addr & 0xFFFFF000, (end_addr | 0xFFF) + 1])
+        plan.sort()
+        erase_plan = []
+        for start_addr, end_addr in plan:
+            if erase_plan and start_addr <= erase_plan[-1][1]:
+                erase_plan[-1][1] = max(erase_plan[-1][1], end_addr)
+            else:
+                erase_plan.append([start_addr, end_addr])
+        return erase_plan
+
     def flash_chiperase_main_process(self, shakehand=0):
         bflb_utils.printf("Flash Chip Erase All")
         # shake hand
@@ -1354,7 +1648,7 @@ class BflbEflashLoader(object):
             self._bflb_com_if.if_set_rx_timeout(self._default_time_out)
         else:
             self._bflb_com_if.if_set_rx_timeout(self._erase_time_out / 1000)
-        cmd_id = bflb_utils.hexstr_to_bytearray(self._com_cmds.get("flash_chiperase")["cmd_id"])
+        cmd_id = self._com_cmd_ids["flash_chiperase"]
         try_cnt = 0
         while True:
             ret, dmy = self.com_process_one_cmd("flash_chiperase", cmd_id, bytearray(0))
@@ -1390,24 +1684,11 @@ class BflbEflashLoader(object):
         return True
 
     def flash_loader_cut_flash_bin(self, file, addr, flash1_size):
-        flash1_bin = "flash1.bin"
-        flash2_bin = "flash2.bin"
-
-        fp = open_file(file, 'rb')
-        flash_data = bytearray(fp.read())
-        fp.close()
-        flash_data_len = len(flash_data)
-        if flash1_size < addr + flash_data_len and flash1_size > addr:
-            flash1_data = flash_data[0:flash1_size - addr]
-            flash2_data = flash_data[flash1_size - addr:flash_data_len]
-            fp = open_file(flash1_bin, 'wb+')
-            fp.write(flash1_data)
-            fp.close()
-            fp = open_file(flash2_bin, 'wb+')
-            fp.write(flash2_data)
-            fp.close()
-            return flash1_bin, len(flash1_data), flash2_bin, len(flash2_data)
-        return "", 0, "", 0
+        # split image in memory at the end of flash1
+        image = FlashImage(addr, self.flash_load_file_data(file), file)
+        if flash1_size < image.end and flash1_size > addr:
+            return image.split(flash1_size)
+        return None, None
 
     def flash_switch_bank_process(self, bank, shakehand=0):
         bflb_utils.printf("Flash Switch Bank")
@@ -1420,7 +1701,7 @@ class BflbEflashLoader(object):
         start_time = (time.time() * 1000)
         # send command
         self._bflb_com_if.if_set_rx_timeout(self._erase_time_out / 1000)
-        cmd_id = bflb_utils.hexstr_to_bytearray(self._com_cmds.get("flash_switch_bank")["cmd_id"])
+        cmd_id = self._com_cmd_ids["flash_switch_bank"]
         data_send = bflb_utils.int_to_4bytearray_l(bank)
         ret, dmy = self.com_process_one_cmd("flash_switch_bank", cmd_id, data_send)
         if ret.startswith("OK") is False:
@@ -1450,7 +1731,7 @@ class BflbEflashLoader(object):
                 return False
         start_time = (time.time() * 1000)
         # send command
-        cmd_id = bflb_utils.hexstr_to_bytearray(self._com_cmds.get("flash_set_para")["cmd_id"])
+        cmd_id = self._com_cmd_ids["flash_set_para"]
         data_send = bflb_utils.int_to_4bytearray_l(flash_pin) + flash_para
         try_cnt = 0
         while True:
@@ -1475,19 +1756,41 @@ class BflbEflashLoader(object):
         bflb_utils.printf("========= flash read =========")
         i = 0
         cur_len = 0
-        readdata = bytearray(0)
+        readdata = None
+        if file is None:
+            readdata = bytearray(flash_data_len)
         # shake hand
         if shakehand != 0:
             bflb_utils.printf(FLASH_LOAD_SHAKE_HAND)
             if self.img_load_shake_hand() is False:
                 return False, None
+        # stream to file when file is given, data is not kept in memory
+        if file is not None:
+            session_key = None
+            if self._session_journal_file:
+                session_key = "%s read %08X %08X %s" % (
+                    self.session_journal_device(), start_addr, flash_data_len,
+                    hashlib.sha256(flash_file_preload_key(file).encode("utf-8")).hexdigest()[:16])
+                i = self.session_journal_get(session_key)
+            if i > 0 and os.path.isfile(os.path.join(app_path, file)) and \
+               os.path.getsize(os.path.join(app_path, file)) >= i:
+                fp = open_file(file, 'rb+')
+                sh = hashlib.sha256()
+                while fp.tell() < i:
+                    sh.update(fp.read(min(0x10000, i - fp.tell())))
+                i = self.session_resume_check(session_key, start_addr, sh)
+                fp.seek(i)
+                fp.truncate()
+            else:
+                i = 0
+                fp = open_file(file, 'wb+')
         start_time = (time.time() * 1000)
-        log = ""
+        log_time = 0
         while i < flash_data_len:
             cur_len = flash_data_len - i
             if cur_len > self._bflb_com_tx_size - 8:
                 cur_len = self._bflb_com_tx_size - 8
-            cmd_id = bflb_utils.hexstr_to_bytearray(self._com_cmds.get("flash_read")["cmd_id"])
+            cmd_id = self._com_cmd_ids["flash_read"]
             data_send = bflb_utils.int_to_4bytearray_l(
                 i + start_addr) + bflb_utils.int_to_4bytearray_l(cur_len)
             try_cnt = 0
@@ -1500,26 +1803,118 @@ class BflbEflashLoader(object):
                     try_cnt += 1
                 else:
                     self.error_code_print("0035")
+                    if file is not None:
+                        fp.close()
                     return False, None
-            i += cur_len
-            log += ("Read " + str(i) + "/" + str(flash_data_len))
-            if len(log) > 50:
-                bflb_utils.printf(log)
-                log = ""
+            if file is not None:
+                fp.write(data_read)
             else:
-                log += "\n"
+                readdata[i:i + cur_len] = data_read
+            i += cur_len
+            if file is not None and session_key is not None and \
+               (i % self._session_checkpoint < cur_len or i == flash_data_len):
+                fp.flush()
+                self.session_journal_set(session_key, i)
+            # log progress at most every 0.5s
+            if time.time() - log_time > 0.5 or i == flash_data_len:
+                log_time = time.time()
+                bflb_utils.printf("Read " + str(i) + "/" + str(flash_data_len))
             if callback is not None:
                 callback(i, flash_data_len, "APP_VR")
-            readdata += data_read
-        bflb_utils.printf(log)
         bflb_utils.printf("Flash read time cost(ms): ", (time.time() * 1000) - start_time)
         bflb_utils.printf("Finished")
         if file is not None:
-            fp = open_file(file, 'wb+')
-            fp.write(readdata)
             fp.close()
+            if session_key is not None:
+                self.session_journal_set(session_key, 0)
         return True, readdata
 
+    def flash_read_sparse_process(self,
+                                  start_addr,
+                                  flash_data_len,
+                                  shakehand=0,
+                                  file=None,
+                                  callback=None):
+        bflb_utils.printf("========= flash sparse read =========")
+        # shake hand
+        if shakehand != 0:
+            bflb_utils.printf(FLASH_LOAD_SHAKE_HAND)
+            if self.img_load_shake_hand() is False:
+                return False, None
+        start_time = (time.time() * 1000)
+        blank_sha = {}
+
+        def is_blank(addr, length):
+            if length not in blank_sha:
+                blank_sha[length] = hashlib.sha256(b"\xff" * length).digest()
+            ret, sha = self.flash_read_sha_process(addr, length)
+            if ret is False:
+                return None
+            return sha == blank_sha[length]
+
+        # compare sha of 64K blocks then 4K sectors with erased flash, read the rest only
+        extents = []
+        end_addr = start_addr + flash_data_len
+        addr = start_addr
+        while addr < end_addr:
+            block_end = min((addr // 0x10000 + 1) * 0x10000, end_addr)
+            ret = is_blank(addr, block_end - addr)
+            if ret is None:
+                return False, None
+            while ret is False and addr < block_end:
+                sector_end = min((addr // 0x1000 + 1) * 0x1000, block_end)
+                blank = is_blank(addr, sector_end - addr)
+                if blank is None:
+                    return False, None
+                if blank is False:
+                    # coalesce contiguous sectors into one extent
+                    if extents and extents[-1][0] + extents[-1][1] == addr - start_addr:
+                        extents[-1][1] += sector_end - addr
+                    else:
+                        extents.append([addr - start_addr, sector_end - addr])
+                addr = sector_end
+            addr = block_end
+            if callback is not None:
+                callback(addr - start_addr, flash_data_len, "APP_VR")
+        read_all = sum(length for offset, length in extents)
+        bflb_utils.printf("Sparse %d/%d bytes in %d extents" % (read_all, flash_data_len,
+                                                                 len(extents)))
+        fp = open_file(file, 'wb+')
+        bflb_flash_sparse.sparse_write_header(fp, start_addr, flash_data_len, extents)
+        cmd_id = self._com_cmd_ids["flash_read"]
+        read_len = 0
+        log_time = 0
+        for offset, length in extents:
+            i = 0
+            while i < length:
+                cur_len = min(length - i, self._bflb_com_tx_size - 8)
+                data_send = bflb_utils.int_to_4bytearray_l(
+                    start_addr + offset + i) + bflb_utils.int_to_4bytearray_l(cur_len)
+                try_cnt = 0
+                while True:
+                    ret, data_read = self.com_process_one_cmd("flash_read", cmd_id, data_send)
+                    if ret.startswith("OK"):
+                        break
+                    if try_cnt < self._checksum_err_retry_limit:
+                        bflb_utils.printf("Retry")
+                        try_cnt += 1
+                    else:
+                        self.error_code_print("0035")
+                        fp.close()
+                        return False, None
+                fp.write(data_read)
+                i += cur_len
+                read_len += cur_len
+                if time.time() - log_time > 0.5 or read_len == read_all:
+                    log_time = time.time()
+                    bflb_utils.printf("Read " + str(read_len) + "/" + str(read_all))
+                if callback is not None:
+                    callback(read_len, read_all, "APP_VR")
+        fp.close()
+        bflb_utils.printf("Flash read time cost(ms): ", (time.time() * 1000) - start_time)
+        bflb_utils.printf("Finished")
+        return True, None
+
     def flash_xip_read_main_process(self,
                                     start_addr,
                                     flash_data_len,
@@ -1529,7 +1924,7 @@ class BflbEflashLoader(object):
         bflb_utils.printf("========= flash read =========")
         i = 0
         cur_len = 0
-        readdata = bytearray(0)
+        readdata = bytearray(flash_data_len)
         # shake hand
         if shakehand != 0:
             bflb_utils.printf(FLASH_LOAD_SHAKE_HAND)
@@ -1537,8 +1932,7 @@ class BflbEflashLoader(object):
                 return False, None
         start_time = (time.time() * 1000)
         log = ""
-        cmd_id = bflb_utils.hexstr_to_bytearray(
-            self._com_cmds.get("flash_xip_read_start")["cmd_id"])
+        cmd_id = self._com_cmd_ids["flash_xip_read_start"]
         ret, dmy = self.com_process_one_cmd("flash_xip_read_start", cmd_id, bytearray(0))
         if ret.startswith("OK") is False:
             self.error_code_print("0039")
@@ -1547,7 +1941,7 @@ class BflbEflashLoader(object):
             cur_len = flash_data_len - i
             if cur_len > self._bflb_com_tx_size - 8:
                 cur_len = self._bflb_com_tx_size - 8
-            cmd_id = bflb_utils.hexstr_to_bytearray(self._com_cmds.get("flash_xip_read")["cmd_id"])
+            cmd_id = self._com_cmd_ids["flash_xip_read"]
             data_send = bflb_utils.int_to_4bytearray_l(
                 i + start_addr) + bflb_utils.int_to_4bytearray_l(cur_len)
             try_cnt = 0
@@ -1561,6 +1955,7 @@ class BflbEflashLoader(object):
                 else:
                     self.error_code_print("0035")
                     return False, None
+            readdata[i:i + cur_len] = data_read
             i += cur_len
             log += ("Read " + str(i) + "/" + str(flash_data_len))
             if len(log) > 50:
@@ -1570,9 +1965,7 @@ class BflbEflashLoader(object):
                 log += "\n"
             if callback is not None:
                 callback(i, flash_data_len, "APP_VR")
-            readdata += data_read
-        cmd_id = bflb_utils.hexstr_to_bytearray(
-            self._com_cmds.get("flash_xip_read_finish")["cmd_id"])
+        cmd_id = self._com_cmd_ids["flash_xip_read_finish"]
         ret, dmy = self.com_process_one_cmd("flash_xip_read_finish", cmd_id, bytearray(0))
         if ret.startswith("OK") is False:
             self.error_code_print("0039")
@@ -1600,7 +1993,7 @@ class BflbEflashLoader(object):
                 return False, None
         start_time = (time.time() * 1000)
         log = ""
-        cmd_id = bflb_utils.hexstr_to_bytearray(self._com_cmds.get("flash_readSha")["cmd_id"])
+        cmd_id = self._com_cmd_ids["flash_readSha"]
         data_send = bflb_utils.int_to_4bytearray_l(start_addr) + bflb_utils.int_to_4bytearray_l(
             flash_data_len)
         try_cnt = 0
@@ -1639,15 +2032,14 @@ class BflbEflashLoader(object):
             bflb_utils.printf(FLASH_LOAD_SHAKE_HAND)
             if self.img_load_shake_hand() is False:
                 return False, None
-        cmd_id = bflb_utils.hexstr_to_bytearray(
-            self._com_cmds.get("flash_xip_read_start")["cmd_id"])
+        cmd_id = self._com_cmd_ids["flash_xip_read_start"]
         ret, dmy = self.com_process_one_cmd("flash_xip_read_start", cmd_id, bytearray(0))
         if ret.startswith("OK") is False:
             self.error_code_print("0039")
             return False, None
         start_time = (time.time() * 1000)
         log = ""
-        cmd_id = bflb_utils.hexstr_to_bytearray(self._com_cmds.get("flash_xip_readSha")["cmd_id"])
+        cmd_id = self._com_cmd_ids["flash_xip_readSha"]
         data_send = bflb_utils.int_to_4bytearray_l(start_addr) + bflb_utils.int_to_4bytearray_l(
             flash_data_len)
         try_cnt = 0
@@ -1661,8 +2053,7 @@ class BflbEflashLoader(object):
             else:
                 bflb_utils.printf("Read Fail")
                 # exit xip mode
-                cmd_id = bflb_utils.hexstr_to_bytearray(
-                    self._com_cmds.get("flash_xip_read_finish")["cmd_id"])
+                cmd_id = self._com_cmd_ids["flash_xip_read_finish"]
                 ret, dmy = self.com_process_one_cmd("flash_xip_read_finish", cmd_id, bytearray(0))
                 if ret.startswith("OK") is False:
                     self.error_code_print("0039")
@@ -1680,8 +2071,7 @@ class BflbEflashLoader(object):
             fp.write(readdata)
             fp.close()
         # exit xip mode
-        cmd_id = bflb_utils.hexstr_to_bytearray(
-            self._com_cmds.get("flash_xip_read_finish")["cmd_id"])
+        cmd_id = self._com_cmd_ids["flash_xip_read_finish"]
         ret, dmy = self.com_process_one_cmd("flash_xip_read_finish", cmd_id, bytearray(0))
         if ret.startswith("OK") is False:
             self.error_code_print("0039")
@@ -1696,7 +2086,7 @@ class BflbEflashLoader(object):
             if self.img_load_shake_hand() is False:
                 return False
         # send command
-        cmd_id = bflb_utils.hexstr_to_bytearray(self._com_cmds.get("flash_write_check")["cmd_id"])
+        cmd_id = self._com_cmd_ids["flash_write_check"]
         try_cnt = 0
         while True:
             retry = 0
@@ -1713,43 +2103,212 @@ class BflbEflashLoader(object):
                 return False
         return True
 
-    def flash_load_xz_compress(self, file):
+    def flash_load_xz_decide(self, data):
+        # decompress write decision of one image, returns (decompress, key), key may be None
+        if not self._decompress_write or len(data) < flash_xz_check_min:
+            return False, None
+        # decision and key of whole file data made by early compress is reused
+        base = data.obj if isinstance(data, memoryview) else data
+        for i in range(len(self._flash_xz_keys)):
+            item, key = self._flash_xz_keys[i]
+            if item is base and len(data) == len(item):
+                del self._flash_xz_keys[i]
+                return key is not None, key
+        return self.flash_load_xz_check(data), None
+
+    def flash_load_xz_compress_start(self, data, key=None, cache=True):
+        # compress in background thread, so it overlaps handshake and erase
+        if key is None:
+            key = flash_xz_cache_key(data)
+        with flash_xz_cache_lock:
+            if key in flash_xz_cache:
+                return key
+            event = threading.Event()
+            flash_xz_cache[key] = event
+        compress_thread = threading.Thread(target=flash_xz_compress_worker,
+                                           args=(key, data, event, cache))
+        compress_thread.daemon = True
+        compress_thread.start()
+        return key
+
+    def flash_load_xz_compress_files(self, files):
+        self._flash_file_data = {}
+        self._flash_xz_keys = []
+        for file in files:
+            try:
+                data = self.flash_load_file_data(file)
+                stat = os.stat(os.path.join(app_path, file))
+            except Exception:
+                continue
+            if len(data) < flash_xz_check_min:
+                continue
+            key = None
+            if self.flash_load_xz_check(data):
+                key = self.flash_load_xz_compress_start(data)
+            # same data object goes to the write, so its decision is found by identity
+            self._flash_file_data[flash_file_preload_key(file)] = (stat.st_size,
+                                                                  stat.st_mtime_ns, data)
+            self._flash_xz_keys.append((data, key))
+
+    def flash_load_xz_check(self, data):
+        # trial compress sample blocks, use decompress write only when it is faster
+        sample_size = 16 * 1024
+        sample_cnt = 8
+        if len(data) <= sample_size * sample_cnt:
+            sample = data
+        else:
+            step = len(data) // sample_cnt
+            sample = b"".join(
+                bytes(data[i * step:i * step + sample_size]) for i in range(sample_cnt))
         try:
-            xz_filters = [
-                {
-                    "id": lzma.FILTER_LZMA2,
-                    "dict_size": 32768
-                },
-            ]
-            fp = open_file(file, 'rb')
-            data = bytearray(fp.read())
-            fp.close()
-            flash_data = lzma.compress(data, check=lzma.CHECK_CRC32, filters=xz_filters)
-            flash_data_len = len(flash_data)
+            ratio = len(lzma.compress(sample, check=lzma.CHECK_CRC32,
+                                      filters=flash_xz_filters)) / len(sample)
         except Exception as e:
             bflb_utils.printf(e)
+            return False
+        if isinstance(self._bflb_com_if, bflb_interface_uart.BflbUartPort) and \
+           self._bflb_com_speed > 0:
+            # time per byte, uart sends 10 bits per byte, chip decompresses after receive
+            write_cost = 10.0 / self._bflb_com_speed
+            xz_cost = ratio * write_cost + 1.0 / self._decompress_speed
+        else:
+            write_cost = 1.0
+            xz_cost = ratio + 0.1
+        bflb_utils.printf("xz sample ratio %.2f, estimated speedup %.2f" %
+                          (ratio, write_cost / xz_cost))
+        return xz_cost < write_cost
+
+    def flash_load_xz_compress(self, data, key=None, cache=True):
+        key = self.flash_load_xz_compress_start(data, key, cache)
+        with flash_xz_cache_lock:
+            flash_data = flash_xz_cache.get(key)
+        if isinstance(flash_data, threading.Event):
+            flash_data.wait()
+            with flash_xz_cache_lock:
+                flash_data = flash_xz_cache.get(key)
+        with flash_xz_cache_lock:
+            # consumed, a retry reads it from xz cache dir
+            if not isinstance(flash_xz_cache.get(key), threading.Event):
+                flash_xz_cache.pop(key, None)
+        if flash_data is None:
             return False, None, None
-        return True, flash_data, flash_data_len
+        return True, flash_data, len(flash_data)
 
-    def flash_load_main_process(self, file, start_addr, erase=1, callback=None):
+    def flash_load_window_process(self, flash_data, start_addr, callback=None, sh=None):
+        flash_data_len = len(flash_data)
+        flash_view = memoryview(flash_data)
+        cmd_id = self._com_cmd_ids["flash_write"]
+        # frames sent and waiting for ack, acks come back in send order
+        window = deque()
+        failed = []
+        i = 0
+        load_len = 0
+        log_len = 0
+        while i < flash_data_len or len(window) > 0:
+            # stop filling the window once a frame failed, drain it and resend
+            while i < flash_data_len and len(window) < self._flash_write_window \
+                    and len(failed) == 0:
+                cur_len = flash_data_len - i
+                if cur_len > self._bflb_com_tx_size - 8:
+                    cur_len = self._bflb_com_tx_size - 8
+                self.com_send_one_cmd(cmd_id, flash_view[i:i + cur_len], i + start_addr)
+                # hash while chip writes the frame
+                if sh is not None:
+                    sh.update(flash_view[i:i + cur_len])
+                window.append((i, cur_len))
+                i += cur_len
+            frame = window.popleft()
+            ret = self._bflb_com_if.if_deal_ack()
+            if ret is None or ret.startswith("OK") is False:
+                bflb_utils.printf("Flash write frame fail at ", hex(frame[0] + start_addr))
+                failed.append(frame)
+            else:
+                load_len += frame[1]
+            if len(window) == 0 and len(failed) > 0:
+                # drop late acks, then resend failed frames one by one
+                self._bflb_com_if.if_clear_buf()
+                for offset, cur_len in failed:
+                    try_cnt = 0
+                    while True:
+                        ret, dmy = self.com_process_one_cmd("flash_write", cmd_id,
+                                                            flash_view[offset:offset + cur_len],
+                                                            offset + start_addr)
+                        if ret.startswith("OK"):
+                            break
+                        if try_cnt < self._checksum_err_retry_limit:
+                            bflb_utils.printf("Retry")
+                            try_cnt += 1
+                        else:
+                            self.error_code_print("0036")
+                            return False
+                    load_len += cur_len
+                failed = []
+            # one line per frame written like single frame write, a failed ack adds none,
+            # last line is printed by flash_load_data_process
+            if load_len == log_len:
+                continue
+            log_len = load_len
+            if load_len < flash_data_len:
+                bflb_utils.printf("Load " + str(load_len) + "/" + str(flash_data_len) +
+                                  " {\"progress\":" + str((load_len * 100) // flash_data_len) +
+                                  "}")
+            if callback is not None and flash_data_len > 200:
+                callback(load_len, flash_data_len, "APP_WR")
+        return True
+
+    def flash_load_file_data(self, file):
+        flash_data = flash_file_preload.get(flash_file_preload_key(file))
+        if flash_data is not None:
+            return flash_data
+        item = self._flash_file_data.pop(flash_file_preload_key(file), None)
+        if item is not None:
+            stat = os.stat(os.path.join(app_path, file))
+            if item[:2] == (stat.st_size, stat.st_mtime_ns):
+                return item[2]
         fp = open_file(file, 'rb')
-        flash_data = bytearray(fp.read())
+        flash_data = fp.read()
         fp.close()
+        return flash_data
+
+    def flash_load_main_process(self, file, start_addr, erase=1, callback=None):
+        flash_data = self.flash_load_file_data(file)
+        return self.flash_load_data_process(flash_data, start_addr, erase, callback)
+
+    def flash_load_data_process(self,
+                                flash_data,
+                                start_addr,
+                                erase=1,
+                                callback=None,
+                                sh=None,
+                                decompress=None,
+                                xz_key=None,
+                                xz_cache=True):
+        # decompress is None for data decided here, else decision of the image data belongs to,
+        # xz_cache is False for pieces of an image
         flash_data_len = len(flash_data)
         i = 0
         cur_len = 0
+        if decompress is None:
+            decompress, xz_key = self.flash_load_xz_decide(flash_data)
+        decompress_write = decompress and flash_data_len > 4 * 1024
+        if decompress_write:
+            xz_key = self.flash_load_xz_compress_start(flash_data, xz_key, xz_cache)
+            # frames carry xz data, hash raw data now
+            if sh is not None:
+                sh.update(flash_data)
         if erase == 1:
             ret = self.flash_erase_main_process(start_addr, start_addr + flash_data_len - 1)
             if ret is False:
                 return False
         start_time = (time.time() * 1000)
         log = ""
-        if self._decompress_write and flash_data_len > 4 * 1024:
+        if decompress_write:
             # set rx timeout to 9s to avoid chip decompress data cause timeout
             self._bflb_com_if.if_set_rx_timeout(30.0)
             start_addr |= 0x80000000
             cmd_name = "flash_decompress_write"
-            ret, flash_data, flash_data_len = self.flash_load_xz_compress(file)
+            ret, flash_data, flash_data_len = self.flash_load_xz_compress(
+                flash_data, xz_key, xz_cache)
             if ret is False:
                 bflb_utils.printf("Flash write data xz fail")
                 self._bflb_com_if.if_set_rx_timeout(self._default_time_out)
@@ -1769,16 +2328,25 @@ class BflbEflashLoader(object):
             bflb_utils.printf("decompress flash load ", flash_data_len)
         else:
             cmd_name = "flash_write"
+        # decompress write is one xz stream, frames must be acked in order
+        if cmd_name == "flash_write" and self._flash_write_window > 1:
+            if self.flash_load_window_process(flash_data, start_addr, callback, sh) is False:
+                self._bflb_com_if.if_set_rx_timeout(self._default_time_out)
+                return False
+            i = flash_data_len
+            log = ("Load " + str(i) + "/" + str(flash_data_len) + " {\"progress\":100}")
+        cmd_id = self._com_cmd_ids[cmd_name]
+        flash_view = memoryview(flash_data)
         while i < flash_data_len:
             cur_len = flash_data_len - i
             if cur_len > self._bflb_com_tx_size - 8:
                 cur_len = self._bflb_com_tx_size - 8
-            cmd_id = bflb_utils.hexstr_to_bytearray(self._com_cmds.get(cmd_name)["cmd_id"])
-            data_send = bflb_utils.int_to_4bytearray_l(i + start_addr) + flash_data[i:i + cur_len]
+            addr = i + start_addr
             start_addr &= 0x7FFFFFFF
             try_cnt = 0
             while True:
-                ret, dmy = self.com_process_one_cmd(cmd_name, cmd_id, data_send)
+                ret, dmy = self.com_process_one_cmd(cmd_name, cmd_id, flash_view[i:i + cur_len],
+                                                    addr)
                 if ret.startswith("OK"):
                     break
                 if try_cnt < self._checksum_err_retry_limit:
@@ -1788,6 +2356,8 @@ class BflbEflashLoader(object):
                     self.error_code_print("0036")
                     self._bflb_com_if.if_set_rx_timeout(self._default_time_out)
                     return False
+            if sh is not None and cmd_name == "flash_write":
+                sh.update(flash_view[i:i + cur_len])
             i += cur_len
             log = ("Load " + str(i) + "/" + str(flash_data_len) + " {\"progress\":" + str(
                 (i * 100) // flash_data_len) + "}")
@@ -1804,6 +2374,237 @@ class BflbEflashLoader(object):
         bflb_utils.printf("Finished")
         return True
 
+    def flash_read_sha_process(self, start_addr, flash_data_len):
+        data_send = bflb_utils.int_to_4bytearray_l(start_addr) + bflb_utils.int_to_4bytearray_l(
+            flash_data_len)
+        try_cnt = 0
+        while True:
+            ret, data_read = self.com_process_one_cmd("flash_readSha",
+                                                      self._com_cmd_ids["flash_readSha"],
+                                                      data_send)
+            if ret.startswith("OK"):
+                return True, data_read
+            if try_cnt < self._checksum_err_retry_limit:
+                bflb_utils.printf("Retry")
+                try_cnt += 1
+            else:
+                self.error_code_print("0038")
+                return False, None
+
+    def flash_load_sparse_process(self, file, start_addr, erase=1, callback=None):
+        bflb_utils.printf("========= flash sparse load =========")
+        sparse = bflb_flash_sparse.sparse_read(os.path.join(app_path, file))
+        if sparse is None:
+            bflb_utils.printf("Sparse file format error")
+            return False
+        base_addr, flash_data_len, extents = sparse
+        if erase == 1:
+            ret = self.flash_erase_main_process(start_addr, start_addr + flash_data_len - 1)
+            if ret is False:
+                return False
+        # sha of flat image, gaps are erased flash
+        sh = hashlib.sha256()
+        blank = b"\xff" * 0x10000
+        pos = 0
+        for offset, data in extents + [(flash_data_len, b"")]:
+            while pos < offset:
+                sh.update(blank[:min(offset - pos, len(blank))])
+                pos += min(offset - pos, len(blank))
+            if len(data) == 0:
+                continue
+            bflb_utils.printf("Sparse load 0x%08X-0x%08X" %
+                              (start_addr + offset, start_addr + offset + len(data)))
+            ret = self.flash_load_data_process(data, start_addr + offset, 0, None, sh)
+            if ret is False:
+                bflb_utils.printf("Flash load fail")
+                return False
+            pos += len(data)
+            if callback is not None:
+                callback(pos, flash_data_len, "APP_WR")
+        fw_sha256 = sh.digest()
+        bflb_utils.printf("Sha caled by host: ", binascii.hexlify(fw_sha256).decode('utf-8'))
+        bflb_utils.printf("xip mode Verify")
+        if flash_data_len > (2 * 1024 * 1024):
+            self._bflb_com_if.if_set_rx_timeout(2.0 * (flash_data_len / (2 * 1024 * 1024) + 1))
+        ret, read_data = self.flash_xip_read_sha_main_process(start_addr, flash_data_len, 0, None,
+                                                              callback)
+        self._bflb_com_if.if_set_rx_timeout(self._default_time_out)
+        if ret is True and read_data == fw_sha256:
+            bflb_utils.printf("Verify success")
+            return True
+        bflb_utils.printf("Verify fail")
+        self.flash_load_tips()
+        self.error_code_print("003E")
+        return False
+
+    def flash_verify_segment_process(self, flash_view, start_addr, seg_start, seg_end, runs):
+        # binary search sectors whose sha differs from data
+        ret, sha = self.flash_read_sha_process(seg_start, seg_end - seg_start)
+        if ret is False:
+            return False
+        if sha == hashlib.sha256(flash_view[seg_start - start_addr:seg_end - start_addr]).digest():
+            return True
+        if seg_start // 0x1000 == (seg_end - 1) // 0x1000:
+            if runs and runs[-1][1] == seg_start:
+                runs[-1][1] = seg_end
+            else:
+                runs.append([seg_start, seg_end])
+            return True
+        seg_mid = ((seg_start + seg_end) // 2) & 0xFFFFF000
+        if seg_mid <= seg_start:
+            seg_mid = (seg_start | 0xFFF) + 1
+        if self.flash_verify_segment_process(flash_view, start_addr, seg_start, seg_mid,
+                                             runs) is False:
+            return False
+        return self.flash_verify_segment_process(flash_view, start_addr, seg_mid, seg_end, runs)
+
+    def flash_load_repair_process(self, flash_data, start_addr, callback=None, decompress=False):
+        bflb_utils.printf("========= flash verify repair =========")
+        start_time = (time.time() * 1000)
+        flash_view = memoryview(flash_data)
+        runs = []
+        if self.flash_verify_segment_process(flash_view, start_addr, start_addr,
+                                             start_addr + len(flash_data), runs) is False:
+            return False
+        bflb_utils.printf("Repair %d bad runs" % len(runs))
+        for run_start, run_end in runs:
+            bflb_utils.printf("Repair 0x%08X-0x%08X" % (run_start, run_end))
+            ret = self.flash_load_data_process(
+                flash_view[run_start - start_addr:run_end - start_addr], run_start, 1, callback,
+                None, decompress, None, False)
+            if ret is False:
+                return False
+        bflb_utils.printf("Flash repair time cost(ms): ", (time.time() * 1000) - start_time)
+        return True
+
+    def session_journal_device(self):
+        # sessions of boards programmed at same time must not share a record
+        return re.sub(r"[^\w.:\-]", "_", str(self._bflb_com_device))
+
+    def session_journal_get(self, key):
+        journal_cfg = BFConfigParser()
+        if os.path.isfile(self._session_journal_file):
+            journal_cfg.read(self._session_journal_file)
+        if journal_cfg.has_option(key, "offset"):
+            return int(journal_cfg.get(key, "offset"))
+        return 0
+
+    def session_journal_set(self, key, offset):
+        # offset 0 removes the session
+
+        def update(journal_cfg):
+            if offset == 0:
+                if key not in journal_cfg.sections():
+                    return False
+                journal_cfg.delete_section(key)
+            else:
+                if key not in journal_cfg.sections():
+                    # keep a few unfinished sessions of every port only
+                    for section in journal_cfg.sections()[:-64]:
+                        journal_cfg.delete_section(section)
+                    journal_cfg.cfg_obj[key] = {}
+                journal_cfg.set(key, "offset", offset)
+
+        try:
+            cfg_file_update(self._session_journal_file, update)
+        except Exception as e:
+            bflb_utils.printf(e)
+
+    def session_resume_check(self, key, start_addr, sh):
+        # resume only when flash still holds the transferred prefix
+        offset = self.session_journal_get(key)
+        if offset == 0:
+            return 0
+        ret, sha = self.flash_read_sha_process(start_addr, offset)
+        if ret is True and sha == sh.digest():
+            bflb_utils.printf("Resume session at 0x%08X" % (start_addr + offset))
+            return offset
+        bflb_utils.printf("Session prefix mismatch, start over")
+        return 0
+
+    def flash_load_session_process(self,
+                                   flash_data,
+                                   start_addr,
+                                   callback=None,
+                                   sh=None,
+                                   decompress=False):
+        # write in checkpoint aligned pieces, each confirmed by write check
+        flash_data_len = len(flash_data)
+        flash_view = memoryview(flash_data)
+        key = "%s write %08X %s" % (self.session_journal_device(), start_addr,
+                                    hashlib.sha256(flash_view).hexdigest()[:16])
+        offset = self.session_journal_get(key)
+        if offset > 0:
+            offset = self.session_resume_check(key, start_addr,
+                                               hashlib.sha256(flash_view[:offset]))
+        if sh is not None:
+            sh.update(flash_view[:offset])
+        while offset < flash_data_len:
+            piece_end = min(((start_addr + offset) // self._session_checkpoint + 1) *
+                            self._session_checkpoint - start_addr, flash_data_len)
+            ret = self.flash_load_data_process(flash_view[offset:piece_end], start_addr + offset,
+                                               1, None, sh, decompress, None, False)
+            if ret is False:
+                return False
+            offset = piece_end
+            self.session_journal_set(key, offset)
+            if callback is not None:
+                callback(offset, flash_data_len, "APP_WR")
+        self.session_journal_set(key, 0)
+        return True
+
+    def flash_load_delta_process(self,
+                                 flash_data,
+                                 start_addr,
+                                 callback=None,
+                                 sh=None,
+                                 decompress=False):
+        bflb_utils.printf("========= flash delta load =========")
+        start_time = (time.time() * 1000)
+        flash_data_len = len(flash_data)
+        flash_view = memoryview(flash_data)
+        end_addr = start_addr + flash_data_len
+        # compare 64K blocks first, then 4K sectors of the differing blocks
+        runs = []
+        addr = start_addr
+        while addr < end_addr:
+            block_end = min((addr // 0x10000 + 1) * 0x10000, end_addr)
+            if sh is not None:
+                sh.update(flash_view[addr - start_addr:block_end - start_addr])
+            ret, sha = self.flash_read_sha_process(addr, block_end - addr)
+            if ret is False:
+                return False
+            if sha == hashlib.sha256(flash_view[addr - start_addr:block_end -
+                                                start_addr]).digest():
+                addr = block_end
+                continue
+            while addr < block_end:
+                sector_end = min((addr // 0x1000 + 1) * 0x1000, block_end)
+                ret, sha = self.flash_read_sha_process(addr, sector_end - addr)
+                if ret is False:
+                    return False
+                if sha != hashlib.sha256(flash_view[addr - start_addr:sector_end -
+                                                    start_addr]).digest():
+                    # coalesce contiguous sectors into one erase and write run
+                    if runs and runs[-1][1] == addr:
+                        runs[-1][1] = sector_end
+                    else:
+                        runs.append([addr, sector_end])
+                addr = sector_end
+        delta_len = sum(run_end - run_start for run_start, run_end in runs)
+        bflb_utils.printf("Delta %d/%d bytes in %d runs" % (delta_len, flash_data_len, len(runs)))
+        for run_start, run_end in runs:
+            bflb_utils.printf("Delta load 0x%08X-0x%08X" % (run_start, run_end))
+            ret = self.flash_load_data_process(
+                flash_view[run_start - start_addr:run_end - start_addr], run_start, 1, callback,
+                None, decompress, None, False)
+            if ret is False:
+                return False
+        if callback is not None:
+            callback(flash_data_len, flash_data_len, "APP_WR")
+        bflb_utils.printf("Flash delta load time cost(ms): ", (time.time() * 1000) - start_time)
+        return True
+
     def setOpenFile_zip(self, packet_file):
         bflb_utils.printf("Unpack file")
         filename = packet_file
@@ -1881,7 +2682,14 @@ class BflbEflashLoader(object):
         bflb_utils.printf(
             "########################################################################")
 
-    def flash_load_opt(self, file, start_addr, erase=1, verify=0, shakehand=0, callback=None):
+    def flash_load_opt(self,
+                       file,
+                       start_addr,
+                       erase=1,
+                       verify=0,
+                       shakehand=0,
+                       callback=None,
+                       decompress=None):
         bflb_utils.printf("========= flash load =========")
         if shakehand != 0:
             bflb_utils.printf(FLASH_LOAD_SHAKE_HAND)
@@ -1889,13 +2697,17 @@ class BflbEflashLoader(object):
                 return False
         if self._flash2_select is True:
             start_addr -= self._flash1_size
+        # file is read once, for rf para check, load, sha and verify
+        if isinstance(file, FlashImage):
+            image = file
+        elif bflb_flash_sparse.sparse_is_sparse(os.path.join(app_path, file)):
+            return self.flash_load_sparse_process(file, start_addr, erase, callback)
+        else:
+            image = FlashImage(start_addr, self.flash_load_file_data(file), file)
         if self._chip_type == "bl808" or self._chip_type == "bl616" or \
            self._chip_type == "wb03" or self._chip_type == "bl628":
             if self._mass_opt is False:
-                fp = open_file(file, 'rb')
-                flash_data = bytearray(fp.read())
-                fp.close()
-                flash_data_len = len(flash_data)
+                flash_data_len = len(image)
                 end_addr = start_addr + flash_data_len - 1
                 if start_addr <= 0x1000 and end_addr > 0x1000:
                     ret, flash_read_data = self.flash_read_main_process(
@@ -1903,27 +2715,33 @@ class BflbEflashLoader(object):
                     if flash_read_data[0:4] == bflb_utils.int_to_4bytearray_b(0x424C5246):
                         bflb_utils.printf(
                             "RF para already write at flash 0x1000 addr, replace it.")
-                        flash_data[0x1000:0x2000] = flash_read_data[0x0:0x1000]
-                        fp = open_file(file, 'wb')
-                        fp.write(flash_data)
-                        fp.close()
-        ret = self.flash_load_main_process(file, start_addr, erase, callback)
+                        # patch copies the image, source file is not changed
+                        image.patch(image.addr + 0x1000, flash_read_data[0x0:0x1000])
+        flash_data = image.data
+        # image sha-256 is updated as data goes out
+        sh = hashlib.sha256()
+        # decided once, delta, session and repair pieces of the image follow it,
+        # skip range pieces come with decision of their file
+        xz_key = None
+        xz_cache = decompress is None
+        if decompress is None:
+            decompress, xz_key = self.flash_load_xz_decide(flash_data)
+        if self._delta_write and erase == 1:
+            ret = self.flash_load_delta_process(flash_data, start_addr, callback, sh, decompress)
+        elif self._session_journal_file and erase == 1:
+            ret = self.flash_load_session_process(flash_data, start_addr, callback, sh,
+                                                  decompress)
+        else:
+            ret = self.flash_load_data_process(flash_data, start_addr, erase, callback, sh,
+                                               decompress, xz_key, xz_cache)
         if ret is False:
             bflb_utils.printf("Flash load fail")
             return ret
-        # temp var to store imgage sha-256
-        fw_sha256 = ''
-        fp = open_file(file, 'rb')
-        flash_data = fp.read()
-        fp.close()
         flash_data_len = len(flash_data)
         if flash_data_len > (2 * 1024 * 1024):
             # if program file size is greater than 2*1024*1024, xip read sha will use more time
             self._bflb_com_if.if_set_rx_timeout(2.0 * (flash_data_len / (2 * 1024 * 1024) + 1))
-        sh = hashlib.sha256()
-        sh.update(flash_data)
-        fw_sha256 = sh.hexdigest()
-        fw_sha256 = bflb_utils.hexstr_to_bytearray(fw_sha256)
+        fw_sha256 = bytearray(sh.digest())
         bflb_utils.printf("Sha caled by host: ", binascii.hexlify(fw_sha256).decode('utf-8'))
         del sh
         # xip mode verify
@@ -1931,6 +2749,16 @@ class BflbEflashLoader(object):
         ret, read_data = self.flash_xip_read_sha_main_process(start_addr, flash_data_len, 0, None,
                                                               callback)
         bflb_utils.printf("Sha caled by dev: ", binascii.hexlify(read_data).decode('utf-8'))
+        repair_cnt = 0
+        while ret is True and read_data != fw_sha256 and repair_cnt < self._verify_repair:
+            repair_cnt += 1
+            bflb_utils.printf("Verify fail, repair ", repair_cnt)
+            if self.flash_load_repair_process(flash_data, start_addr, callback,
+                                              decompress) is False:
+                break
+            ret, read_data = self.flash_xip_read_sha_main_process(start_addr, flash_data_len, 0,
+                                                                  None, callback)
+            bflb_utils.printf("Sha caled by dev: ", binascii.hexlify(read_data).decode('utf-8'))
         if ret is True and read_data == fw_sha256:
             bflb_utils.printf("Verify success")
         else:
@@ -1939,10 +2767,6 @@ class BflbEflashLoader(object):
             self.error_code_print("003E")
             ret = False
         if verify > 0:
-            fp = open_file(file, 'rb')
-            flash_data = bytearray(fp.read())
-            fp.close()
-            flash_data_len = len(flash_data)
             ret, read_data = self.flash_read_main_process(start_addr, flash_data_len, 0, None,
                                                           callback)
             if ret is True and read_data == flash_data:
@@ -1974,63 +2798,46 @@ class BflbEflashLoader(object):
                              verify=0,
                              shakehand=0,
                              callback=None):
-        ret = False
-        if self._skip_len > 0:
-            bflb_utils.printf("skip flash file, skip addr 0x%08X, skip len 0x%08X"\
-                               % (self._skip_addr, self._skip_len))
-            fp = open_file(file, 'rb')
-            flash_data = fp.read()
-            fp.close()
-            flash_data_len = len(flash_data)
-            if self._skip_addr <= start_addr and \
-               self._skip_addr + self._skip_len > start_addr and \
-               self._skip_addr + self._skip_len < start_addr + flash_data_len:
-                addr = self._skip_addr + self._skip_len
-                data = flash_data[self._skip_addr + self._skip_len - start_addr:]
-                filename, ext = os.path.splitext(file)
-                file_temp = os.path.join(app_path, filename + '_skip' + ext)
-                fp = open(file_temp, 'wb')
-                fp.write(data)
-                fp.close()
-                ret = self.flash_load_opt(file_temp, addr, erase, verify, shakehand, callback)
-            elif self._skip_addr > start_addr and \
-                 self._skip_addr + self._skip_len < start_addr + flash_data_len:
-                addr = start_addr
-                data = flash_data[:self._skip_addr - start_addr]
-                filename, ext = os.path.splitext(file)
-                file_temp = os.path.join(app_path, filename + '_skip1' + ext)
-                fp = open(file_temp, 'wb')
-                fp.write(data)
-                fp.close()
-                ret = self.flash_load_opt(file_temp, addr, erase, verify, shakehand, callback)
-                addr = self._skip_addr + self._skip_len
-                data = flash_data[self._skip_addr + self._skip_len - start_addr:]
-                filename, ext = os.path.splitext(file)
-                file_temp = os.path.join(app_path, filename + '_skip2' + ext)
-                fp = open(file_temp, 'wb')
-                fp.write(data)
-                fp.close()
-                ret = self.flash_load_opt(file_temp, addr, erase, verify, shakehand, callback)
-            elif self._skip_addr > start_addr and \
-                 self._skip_addr < start_addr + flash_data_len and \
-                 self._skip_addr + self._skip_len >= start_addr + flash_data_len:
-                addr = start_addr
-                data = flash_data[:self._skip_addr - start_addr]
-                filename, ext = os.path.splitext(file)
-                file_temp = os.path.join(app_path, filename + '_skip' + ext)
-                fp = open(file_temp, 'wb')
-                fp.write(data)
-                fp.close()
-                ret = self.flash_load_opt(file_temp, addr, erase, verify, shakehand, callback)
-            elif self._skip_addr <= start_addr and \
-                 self._skip_addr + self._skip_len >= start_addr + flash_data_len:
-                return True
-            else:
-                ret = self.flash_load_opt(file, start_addr, erase, verify, shakehand, callback)
+        ret = True
+        if len(self._skip_ranges) == 0:
+            return self.flash_load_opt(file, start_addr, erase, verify, shakehand, callback)
+        if isinstance(file, FlashImage):
+            image = file
+        elif bflb_flash_sparse.sparse_is_sparse(os.path.join(app_path, file)):
+            return self.flash_load_opt(file, start_addr, erase, verify, shakehand, callback)
         else:
-            ret = self.flash_load_opt(file, start_addr, erase, verify, shakehand, callback)
+            image = FlashImage(start_addr, self.flash_load_file_data(file), file)
+        for skip_addr, skip_len in self._skip_ranges:
+            bflb_utils.printf("skip flash file, skip addr 0x%08X, skip len 0x%08X"\
+                               % (skip_addr, skip_len))
+        decompress = self.flash_load_xz_decide(image.data)[0]
+        for piece in image.skip(self._skip_ranges):
+            ret = self.flash_load_opt(piece, piece.addr, erase, verify, shakehand, callback,
+                                      decompress)
+            if ret is False:
+                return False
+            shakehand = 0
         return ret
 
+    def parse_skip_para(self, skip_para):
+        # pairs of skip addr and skip len
+        skip_ranges = []
+        if isinstance(skip_para, str):
+            skip_para = skip_para.split(",")
+        skip_para = [
+            int(item, 16) if item.strip().lower().startswith("0x") else int(item, 10)
+            for item in skip_para
+            if item.strip()
+        ]
+        for i in range(0, len(skip_para) - 1, 2):
+            if skip_para[i + 1] > 0:
+                skip_ranges.append((skip_para[i], skip_para[i + 1]))
+        self._skip_ranges = skip_ranges
+        if skip_ranges:
+            self._skip_addr, self._skip_len = skip_ranges[0]
+        else:
+            self._skip_addr, self._skip_len = 0, 0
+
     def log_read_process(self, shakehand=1, callback=None):
         readdata = bytearray(0)
         try:
@@ -2039,7 +2846,7 @@ class BflbEflashLoader(object):
                 bflb_utils.printf(FLASH_LOAD_SHAKE_HAND)
                 if self.img_load_shake_hand() is False:
                     bflb_utils.printf("Shake hand redo")
-            cmd_id = bflb_utils.hexstr_to_bytearray(self._com_cmds.get("log_read")["cmd_id"])
+            cmd_id = self._com_cmd_ids["log_read"]
             ret, data_read = self.com_process_one_cmd("log_read", cmd_id, bytearray(0))
             bflb_utils.printf("Read log ")
             if ret.startswith("OK") is False:
@@ -2171,21 +2978,7 @@ class BflbEflashLoader(object):
         return ret
 
     def get_suitable_conf_name(self, cfg_dir, flash_id):
-        conf_files = []
-        for home, dirs, files in os.walk(cfg_dir):
-            for filename in files:
-                if filename.split('_')[-1] == flash_id + '.conf':
-                    conf_files.append(filename)
-        if len(conf_files) > 1:
-            bflb_utils.printf("Flash id duplicate and alternative is:")
-            for i in range(len(conf_files)):
-                tmp = conf_files[i].split('.')[0]
-                bflb_utils.printf("%d:%s" % (i + 1, tmp))
-            return conf_files[i]
-        elif len(conf_files) == 1:
-            return conf_files[0]
-        else:
-            return ""
+        return bflb_flash_select.get_suitable_conf_name(cfg_dir, flash_id)
 
     def get_factory_config_info(self, file, output_file):
         version = 'ver0.0.1'
@@ -2412,11 +3205,19 @@ class BflbEflashLoader(object):
                 cfg_dir = app_path + "/utils/flash/" + self._chip_name + '/'
             else:
                 cfg_dir = app_path + "/utils/flash/" + self._chip_type + '/'
-            conf_name = sub_module.flash_select_do.get_suitable_file_name(cfg_dir, jedec_id)
+            conf_name = bflb_flash_select.get_suitable_conf_name(cfg_dir, jedec_id)
             offset, flashCfgLen, flash_para, flashCrcOffset, crcOffset = \
                 bflb_flash_select.update_flash_para_from_cfg\
                 (sub_module.bootheader_cfg_keys.bootheader_cfg_keys, cfg_dir+conf_name)
-            fp = open(os.path.join(app_path, file), 'wb+')
+            # gang programming workers share this file, only write it when changed
+            para_file = os.path.join(app_path, file)
+            if os.path.isfile(para_file):
+                fp = open(para_file, 'rb')
+                old_flash_para = fp.read()
+                fp.close()
+                if old_flash_para == flash_para:
+                    return flash_para
+            fp = open(para_file, 'wb+')
             fp.write(flash_para)
             fp.close()
         return flash_para
@@ -2456,6 +3257,7 @@ class BflbEflashLoader(object):
                     args, eflash_loader_cfg, eflash_loader_bin, callback, update_cutoff_time,
                     create_simple_callback, create_img_callback, macaddr_callback, task_num)
                 self._skip_len = 0
+                self._skip_ranges = []
                 if ret == "repeat_burn":
                     if self._bflb_com_if is not None:
                         self._bflb_com_if.if_close()
@@ -2665,16 +3467,7 @@ class BflbEflashLoader(object):
             if args.addr:
                 address = args.addr
             if args.skip:
-                skip_str = args.skip
-                skip_para = skip_str.split(",")
-                if skip_para[0][0:2] == "0x":
-                    self._skip_addr = int(skip_para[0][2:], 16)
-                else:
-                    self._skip_addr = int(skip_para[0], 10)
-                if skip_para[1][0:2] == "0x":
-                    self._skip_len = int(skip_para[1][2:], 16)
-                else:
-                    self._skip_len = int(skip_para[1], 10)
+                self.parse_skip_para(args.skip.split(","))
             if args.key:
                 aeskey = args.key
             if args.createcfg:
@@ -2776,6 +3569,8 @@ class BflbEflashLoader(object):
             self._bflb_com_device = port
         bflb_utils.printf("serial port is ", self._bflb_com_device)
         verify = int(cfg.get("LOAD_CFG", "verify"))
+        if cfg.has_option("LOAD_CFG", "verify_repair"):
+            self._verify_repair = int(cfg.get("LOAD_CFG", "verify_repair"))
         erase = int(cfg.get("LOAD_CFG", "erase"))
         if interface == "cklink":
             self._bflb_com_tx_size = 14344
@@ -2788,6 +3583,8 @@ class BflbEflashLoader(object):
         cutoff_time = 0
         shake_hand_retry = 2
         flash_burn_retry = 1
+        speed_autotune = False
+        speed_autotune_list = []
         if cfg.has_option("LOAD_CFG", "erase_time_out"):
             self._erase_time_out = int(cfg.get("LOAD_CFG", "erase_time_out"))
         if cfg.has_option("LOAD_CFG", "shake_hand_retry"):
@@ -2796,6 +3593,8 @@ class BflbEflashLoader(object):
             flash_burn_retry = int(cfg.get("LOAD_CFG", "flash_burn_retry"))
         if cfg.has_option("LOAD_CFG", "checksum_err_retry"):
             self._checksum_err_retry_limit = int(cfg.get("LOAD_CFG", "checksum_err_retry"))
+        if cfg.has_option("LOAD_CFG", "flash_write_window"):
+            self._flash_write_window = int(cfg.get("LOAD_CFG", "flash_write_window"))
         if cfg.has_option("LOAD_CFG", "chiptype"):
             self._chip_type = cfg.get("LOAD_CFG", "chiptype")
         if cfg.has_option("LOAD_CFG", "cpu_reset_after_load"):
@@ -2807,15 +3606,7 @@ class BflbEflashLoader(object):
         if cfg.has_option("LOAD_CFG", "eflash_loader_file") and eflash_loader_file is None:
             eflash_loader_file = cfg.get("LOAD_CFG", "eflash_loader_file")
         if cfg.has_option("LOAD_CFG", "skip_mode") and self._skip_len == 0:
-            skip_para = cfg.get("LOAD_CFG", "skip_mode")
-            if skip_para[0][0:2] == "0x":
-                self._skip_addr = int(skip_para[0][2:], 16)
-            else:
-                self._skip_addr = int(skip_para[0], 10)
-            if skip_para[1][0:2] == "0x":
-                self._skip_len = int(skip_para[1][2:], 16)
-            else:
-                self._skip_len = int(skip_para[1], 10)
+            self.parse_skip_para(cfg.get("LOAD_CFG", "skip_mode"))
             if self._skip_len > 0:
                 if erase == 2:
                     bflb_utils.printf("error: skip mode can not set flash chiperase!")
@@ -2847,6 +3638,13 @@ class BflbEflashLoader(object):
             else:
                 self._bflb_com_speed = int(cfg.get("LOAD_CFG", "speed_uart_load"))
             bflb_utils.printf("com speed: ", self._bflb_com_speed)
+            if interface == "uart" and cfg.has_option("LOAD_CFG", "speed_uart_autotune"):
+                speed_autotune = (cfg.get("LOAD_CFG", "speed_uart_autotune") == "true")
+            if speed_autotune and cfg.has_option("LOAD_CFG", "speed_uart_autotune_list"):
+                speed_autotune_list = [
+                    int(x) for x in re.compile(r'\s+').split(
+                        cfg.get("LOAD_CFG", "speed_uart_autotune_list").strip()) if x
+                ]
             self._bflb_boot_speed = int(cfg.get("LOAD_CFG", "speed_uart_boot"))
             if self._isp_en is True and self._chip_type == "bl602":
                 self._bflb_boot_speed = self._bflb_com_speed
@@ -2912,6 +3710,19 @@ class BflbEflashLoader(object):
                 else:
                     return True, flash_burn_retry
 
+            # compress flash files in background during handshake and erase
+            if args.flash and not romfs_data and not fwbin and not massbin and \
+               cfg.has_option("FLASH_CFG", "decompress_write") and \
+               cfg.get("FLASH_CFG", "decompress_write") == "true" and \
+               self._chip_type != "bl60x" and self._chip_type != "bl702":
+                if file:
+                    self.flash_load_xz_compress_files(
+                        [convert_path(item) for item in file.split(",")])
+                elif cfg.has_option("FLASH_CFG", "file"):
+                    self.flash_load_xz_compress_files([
+                        convert_path(item)
+                        for item in re.compile(r'\s+').split(cfg.get("FLASH_CFG", "file").strip())
+                    ])
             if cfg.has_option("LOAD_CFG", "load_function"):
                 load_function = int(cfg.get("LOAD_CFG", "load_function"))
             if cfg.has_option("LOAD_CFG", "isp_shakehand_timeout"):
@@ -3044,6 +3855,14 @@ class BflbEflashLoader(object):
                 self._decompress_write = (cfg.get("FLASH_CFG", "decompress_write") == "true")
             if self._chip_type == "bl60x" or self._chip_type == "bl702":
                 self._decompress_write = False
+            if cfg.has_option("FLASH_CFG", "delta_write"):
+                self._delta_write = (cfg.get("FLASH_CFG", "delta_write") == "true")
+            if cfg.has_option("FLASH_CFG", "decompress_speed"):
+                self._decompress_speed = int(cfg.get("FLASH_CFG", "decompress_speed"))
+            if cfg.has_option("FLASH_CFG", "session_resume") and \
+               cfg.get("FLASH_CFG", "session_resume") == "true":
+                self._session_journal_file = os.path.join(chip_path, self._chip_name,
+                                                          "eflash_loader/session_journal.ini")
             bflb_utils.printf("flash set para")
             if cfg.get("FLASH_CFG", "flash_pin"):
                 flash_pin_cfg = cfg.get("FLASH_CFG", "flash_pin")
@@ -3109,6 +3928,11 @@ class BflbEflashLoader(object):
             else:
                 self.error_code_print("0030")
                 return False, flash_burn_retry
+            if speed_autotune and speed_autotune_list:
+                cache_file = os.path.join(chip_path, self._chip_name,
+                                          "eflash_loader/uart_speed_cache.ini")
+                if self.com_speed_autotune(speed_autotune_list, cache_file) is False:
+                    return False, flash_burn_retry
             # flash2 init
             if self._chip_type == "bl616" or self._chip_type == "wb03":
                 if cfg.has_option("FLASH2_CFG", "flash2_en"):
@@ -3299,15 +4123,24 @@ class BflbEflashLoader(object):
                         size_before = 0
                         size_all = 0
                         i = 0
+                        flash_ranges = []
                         for item in flash_file:
                             if task_num != None and self._csv_burn_en is True:
-                                size_all += os.path.getsize(
+                                size_current = os.path.getsize(
                                     os.path.join(app_path,
                                                  convert_path("task" + str(task_num) + "/" +
                                                               item)))
                             else:
-                                size_all += os.path.getsize(
+                                size_current = os.path.getsize(
                                     os.path.join(app_path, convert_path(item)))
+                            size_all += size_current
+                            # sparse file covers more flash than its size
+                            sparse_len = bflb_flash_sparse.sparse_flash_len(
+                                os.path.join(app_path, convert_path(item)))
+                            flash_ranges.append((int(address[len(flash_ranges)], 16),
+                                                 sparse_len or size_current))
+                        # erase all files together before writing
+                        erase_plan = self.flash_erase_plan(flash_ranges, erase)
                         try:
                             ret = False
                             while i < len(flash_file):
@@ -3332,27 +4165,27 @@ class BflbEflashLoader(object):
                                     bflb_utils.printf("========= programming ",
                                                       convert_path(flash_file[i]),
                                                       " to 0x%08X" % (int(address[i], 16)))
-                                flash1_bin = ""
-                                flash1_bin_len = 0
-                                flash2_bin = ""
-                                flash2_bin_len = 0
+                                flash_cut = False
                                 if self._chip_type == "bl616" or self._chip_type == "wb03":
                                     if self._flash1_size != 0 and self._flash1_size < int(address[i], 16) + size_current and \
                                        self._flash1_size > int(address[i], 16) and self._flash2_select is False:
                                         bflb_utils.printf("%s file is overflow with flash1" %
                                                           flash_file[i])
-                                        flash1_bin, flash1_bin_len, flash2_bin, flash2_bin_len = \
-                                            self.flash_loader_cut_flash_bin(flash_file[i], int(address[i], 16), self._flash1_size)
-                                if flash1_bin != "" and flash2_bin != "":
-                                    ret = self.flash_cfg_option(read_flash_id, flash_para_file, flash_set, id_valid_flag, flash1_bin, \
+                                        flash_cut = True
+                                if flash_cut:
+                                    ret = self.flash_cfg_option(read_flash_id, flash_para_file, flash_set, id_valid_flag, flash_file[i], \
                                                                 config_file, cfg, create_img_callback, create_simple_callback)
                                     if ret is False:
                                         return False, flash_burn_retry
-                                    bflb_utils.printf("========= programming ",
-                                                      convert_path(flash1_bin),
-                                                      " to 0x%08X" % (int(address[i], 16)))
-                                    ret = self.flash_load_specified(convert_path(flash1_bin),
-                                                                    int(address[i], 16), erase,
+                                    # split after flash cfg option, it may recreate the image
+                                    flash1_image, flash2_image = self.flash_loader_cut_flash_bin(
+                                        convert_path(flash_file[i]), int(address[i], 16),
+                                        self._flash1_size)
+                                    bflb_utils.printf("========= programming flash1 part of ",
+                                                      convert_path(flash_file[i]),
+                                                      " to 0x%08X" % (flash1_image.addr))
+                                    ret = self.flash_load_specified(flash1_image,
+                                                                    flash1_image.addr, erase,
                                                                     verify, self._need_shake_hand,
                                                                     callback)
                                     if ret is False:
@@ -3366,11 +4199,11 @@ class BflbEflashLoader(object):
                                     if ret is False:
                                         return False, flash_burn_retry
                                     bflb_utils.printf(
-                                        "========= programming ", convert_path(flash2_bin),
-                                        " to 0x%08X" % (int(address[i], 16) + flash1_bin_len))
+                                        "========= programming flash2 part of ",
+                                        convert_path(flash_file[i]),
+                                        " to 0x%08X" % (flash2_image.addr))
                                     ret = self.flash_load_specified(
-                                        convert_path(flash2_bin),
-                                        int(address[i], 16) + flash1_bin_len, erase, verify,
+                                        flash2_image, flash2_image.addr, erase, verify,
                                         self._need_shake_hand, callback)
                                     if ret is False:
                                         return False, flash_burn_retry
@@ -3394,6 +4227,19 @@ class BflbEflashLoader(object):
                                                                     config_file, cfg, create_img_callback, create_simple_callback)
                                         if ret is False:
                                             return False, flash_burn_retry
+                                    # flash para is set now, run planned erase
+                                    if erase_plan:
+                                        bflb_utils.printf("Erase plan: ", ", ".join(
+                                            "0x%08X-0x%08X" % (start_addr, end_addr - 1)
+                                            for start_addr, end_addr in erase_plan))
+                                        for start_addr, end_addr in erase_plan:
+                                            ret = self.flash_erase_main_process(
+                                                start_addr, end_addr - 1, self._need_shake_hand)
+                                            self._need_shake_hand = False
+                                            if ret is False:
+                                                return False, flash_burn_retry
+                                        erase_plan = []
+                                        erase = 0
                                     ret = self.flash_load_specified(convert_path(flash_file[i]),
                                                                     int(address[i], 16), erase,
                                                                     verify, self._need_shake_hand,
@@ -3526,10 +4372,15 @@ class BflbEflashLoader(object):
                 else:
                     start_addr = int(start, 16)
                     end_addr = int(end, 16)
-                    ret, readdata = self.flash_read_main_process(start_addr,
-                                                                 end_addr - start_addr + 1,
-                                                                 self._need_shake_hand, file,
-                                                                 callback)
+                    if args.sparse and file:
+                        ret, readdata = self.flash_read_sparse_process(
+                            start_addr, end_addr - start_addr + 1, self._need_shake_hand, file,
+                            callback)
+                    else:
+                        ret, readdata = self.flash_read_main_process(start_addr,
+                                                                     end_addr - start_addr + 1,
+                                                                     self._need_shake_hand, file,
+                                                                     callback)
                     if ret is False:
                         return False, flash_burn_retry
             if args.efuse:
@@ -3552,6 +4403,8 @@ class BflbEflashLoader(object):
         bflb_utils.printf("-w --flash --file=1.bin,2.bin --addr=00000000,00001000 -c config.ini")
         bflb_utils.printf(
             "-r --flash --start=00000000 --end=0000FFFF --file=flash.bin -c config.ini")
+        bflb_utils.printf(
+            "-r --flash --sparse --start=00000000 --end=0000FFFF --file=flash.sparse -c config.ini")
 
 
 def run():
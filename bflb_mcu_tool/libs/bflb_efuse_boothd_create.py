@@ -29,6 +29,7 @@ try:
 except ImportError:
     from libs import bflb_path
 from libs import bflb_utils
+from libs import bflb_cfg_layout
 from libs.bflb_utils import app_path, chip_path, convert_path
 from libs.bflb_configobj import BFConfigParser
 
@@ -57,56 +58,13 @@ def bootheader_update_flash_pll_crc(bootheader_data, chiptype):
     return bootheader_data
 
 
-def get_int_mask(pos, length):
-    ones = "1" * 32
-    zeros = "0" * 32
-    mask = ones[0:32 - pos - length] + zeros[0:length] + ones[0:pos]
-    return int(mask, 2)
-
-
 def update_data_from_cfg(config_keys, config_file, section):
     bflb_utils.printf("Updating data according to <" + config_file + "[" + section + "]>")
     cfg = BFConfigParser()
     cfg.read(config_file)
-    # get finally data len
-    filelen = 0
-    for key in config_keys:
-        offset = int(config_keys.get(key)["offset"], 10)
-        if offset > filelen:
-            filelen = offset
-    filelen += 4
-    bflb_utils.printf("Created file len:" + str(filelen))
-    data = bytearray(filelen)
-    data_mask = bytearray(filelen)
-    # bflb_utils.printf(binascii.hexlify(data))
-    for key in cfg.options(section):
-        if config_keys.get(key) is None:
-            bflb_utils.printf(key + " not exist")
-            continue
-        # bflb_utils.printf(key)
-        val = cfg.get(section, key)
-        if val.startswith("0x"):
-            val = int(val, 16)
-        else:
-            val = int(val, 10)
-        # bflb_utils.printf(val)
-        offset = int(config_keys.get(key)["offset"], 10)
-        pos = int(config_keys.get(key)["pos"], 10)
-        bitlen = int(config_keys.get(key)["bitlen"], 10)
-
-        oldval = bflb_utils.bytearray_to_int(bflb_utils.bytearray_reverse(data[offset:offset + 4]))
-        oldval_mask = bflb_utils.bytearray_to_int(
-            bflb_utils.bytearray_reverse(data_mask[offset:offset + 4]))
-        newval = (oldval & get_int_mask(pos, bitlen)) + (val << pos)
-        if val != 0:
-            newval_mask = (oldval_mask | (~get_int_mask(pos, bitlen)))
-        else:
-            newval_mask = oldval_mask
-        # bflb_utils.printf(newval,binascii.hexlify(bflb_utils.int_to_4bytearray_l(newval)))
-        data[offset:offset + 4] = bflb_utils.int_to_4bytearray_l(newval)
-        data_mask[offset:offset + 4] = bflb_utils.int_to_4bytearray_l(newval_mask)
-    # bflb_utils.printf(binascii.hexlify(data))
-    return data, data_mask
+    layout = bflb_cfg_layout.get_cfg_layout(config_keys)
+    bflb_utils.printf("Created file len:" + str(layout.length))
+    return layout.pack(layout.cfg_values(cfg, section))
 
 
 def bootheader_create_do(chipname, chiptype, config_file, section, output_file=None, if_img=False):
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+#  Copyright (C) 2021- BOUFFALO LAB (NANJING) CO., LTD.
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+
+class FlashImage(object):
+    # flash data at an address, slices share the buffer, patch copies it on first write
+
+    def __init__(self, addr, data, name=""):
+        self.addr = addr
+        self.data = memoryview(data)
+        self.name = name
+        self._own = False
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def end(self):
+        return self.addr + len(self.data)
+
+    def slice(self, start_addr, end_addr):
+        start_addr = min(max(start_addr, self.addr), self.end)
+        end_addr = max(min(end_addr, self.end), start_addr)
+        return FlashImage(start_addr, self.data[start_addr - self.addr:end_addr - self.addr],
+                          self.name)
+
+    def split(self, addr):
+        return self.slice(self.addr, addr), self.slice(addr, self.end)
+
+    def skip(self, ranges):
+        # pieces left after removing (addr, len) ranges
+        images = [self]
+        for skip_addr, skip_len in ranges:
+            pieces = []
+            for image in images:
+                for piece in image.split(skip_addr)[0], image.slice(skip_addr + skip_len,
+                                                                     image.end):
+                    if len(piece) > 0:
+                        pieces.append(piece)
+            images = pieces
+        return images
+
+    def patch(self, addr, data):
+        # patch past the end grows the image, like a bytearray slice assignment does
+        start = addr - self.addr
+        end = start + len(data)
+        if not self._own or end > len(self.data):
+            buf = bytearray(self.data)
+            if end > len(buf):
+                buf.extend(b"\xff" * (end - len(buf)))
+            self.data = memoryview(buf)
+            self._own = True
+        self.data[start:end] = data
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+#  Copyright (C) 2021- BOUFFALO LAB (NANJING) CO., LTD.
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+import os
+import mmap
+
+from libs import bflb_utils
+from libs.bflb_flash_image import FlashImage
+
+# erased flash background, written in blocks of this size
+flash_layout_fill = b"\xff" * 0x10000
+
+
+class FlashLayout(object):
+    # flash image made of extents over an implicit 0xff background, a later extent wins on overlap
+
+    def __init__(self, length=0):
+        self.length = length
+        self.extents = []
+        self.maps = []
+
+    def add(self, addr, data, name=""):
+        image = FlashImage(addr, data, name)
+        if len(image) == 0:
+            return image
+        extents = []
+        for extent in self.extents:
+            if extent.addr < image.end and image.addr < extent.end:
+                bflb_utils.printf("Warning: %s overlaps %s at 0x%08X" %
+                                  (image.name or "data", extent.name or "data",
+                                   max(image.addr, extent.addr)))
+                extents.extend(extent.skip([(image.addr, len(image))]))
+            else:
+                extents.append(extent)
+        extents.append(image)
+        extents.sort(key=lambda extent: extent.addr)
+        self.extents = extents
+        if image.end > self.length:
+            self.length = image.end
+        return image
+
+    def add_file(self, addr, file):
+        with open(file, 'rb') as fp:
+            data = fp.read()
+        return self.add(addr, data, os.path.basename(file))
+
+    def map_file(self, file):
+        # read only view of file, valid until close
+        with open(file, 'rb') as fp:
+            if os.fstat(fp.fileno()).st_size == 0:
+                return memoryview(b"")
+            file_map = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(file_map)
+        self.maps.append((file_map, view))
+        return view
+
+    def clear(self):
+        self.length = 0
+        self.extents = []
+
+    def close(self):
+        for extent in self.extents:
+            extent.data.release()
+        self.extents = []
+        for file_map, view in self.maps:
+            view.release()
+            try:
+                file_map.close()
+            except BufferError:
+                # views still held by caller, map is closed once they are freed
+                pass
+        self.maps = []
+
+    def write(self, fp):
+        pos = 0
+        for extent in self.extents + [FlashImage(self.length, b"")]:
+            while pos < extent.addr:
+                fill_len = min(extent.addr - pos, len(flash_layout_fill))
+                fp.write(flash_layout_fill[:fill_len])
+                pos += fill_len
+            fp.write(extent.data)
+            pos = extent.end
+
+    def save(self, file):
+        with open(file, 'wb+') as fp:
+            self.write(fp)
+
+    def to_bytearray(self):
+        data = bytearray(b"\xff") * self.length
+        for extent in self.extents:
+            data[extent.addr:extent.end] = extent.data
+        return data
@@ -21,67 +21,151 @@
 
 import os
 import re
+import json
+import hashlib
 
 import config as gol
 from libs import bflb_utils
+from libs import bflb_cfg_layout
 from libs.bflb_utils import app_path, chip_path, conf_sign
 from libs.bflb_configobj import BFConfigParser
 
 
-def get_int_mask(pos, length):
-    ones = "1" * 32
-    zeros = "0" * 32
-    mask = ones[0:32 - pos - length] + zeros[0:length] + ones[0:pos]
-    return int(mask, 2)
+# flash cfg dir -> jedec id conf names and packed flash para, kept in user cache dir between runs
+flash_conf_index = {}
+flash_conf_keys_digest = {}
+
+
+def flash_conf_index_path():
+    # package dir may be read only or shared by several installs
+    if os.name == "nt":
+        cache_dir = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    else:
+        cache_dir = os.environ.get("XDG_CACHE_HOME") or \
+            os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_dir, "bflb_mcu_tool", "flash_conf_index.json")
+
+
+# empty when user cache dir is not writable, index is then kept in memory only
+flash_conf_index_file = flash_conf_index_path()
+
+
+def flash_conf_dir_stamp(cfg_dir):
+    # dir mtime catches added and removed files, newest conf mtime catches edits,
+    # build cache uses it once per image, conf lookups only check dir mtime
+    stamp = [os.path.getmtime(cfg_dir), 0, 0]
+    for entry in os.scandir(cfg_dir):
+        if entry.name.endswith(".conf"):
+            stamp[1] = max(stamp[1], entry.stat().st_mtime)
+            stamp[2] += 1
+    return stamp
+
+
+def flash_conf_index_save():
+    global flash_conf_index_file
+    if not flash_conf_index_file:
+        return
+    try:
+        index_all = {}
+        for cfg_dir, index in flash_conf_index.items():
+            index_all[cfg_dir] = {
+                "stamp": index["stamp"],
+                "names": index["names"],
+                "para": index["para"]
+            }
+        os.makedirs(os.path.dirname(flash_conf_index_file), exist_ok=True)
+        tmp_file = flash_conf_index_file + "." + str(os.getpid()) + ".tmp"
+        with open(tmp_file, 'w') as fp:
+            json.dump(index_all, fp)
+        os.replace(tmp_file, flash_conf_index_file)
+    except Exception as e:
+        bflb_utils.printf(e)
+        flash_conf_index_file = ""
+
+
+def get_flash_conf_index(cfg_dir):
+    # names only change with dir entries, so a lookup stats the dir alone,
+    # para of an edited conf is caught by its own mtime in update_flash_para_from_cfg
+    cfg_dir = os.path.normcase(os.path.abspath(cfg_dir))
+    try:
+        stamp = os.path.getmtime(cfg_dir)
+    except OSError:
+        return {"names": {}, "para": {}}
+    index = flash_conf_index.get(cfg_dir)
+    if index is None and flash_conf_index_file:
+        try:
+            with open(flash_conf_index_file, 'r') as fp:
+                index = json.load(fp).get(cfg_dir)
+        except Exception:
+            index = None
+    if index is None or index["stamp"] != stamp:
+        names = {}
+        # dir order, as the os.walk scan this replaces listed them
+        for filename in os.listdir(cfg_dir):
+            if filename.endswith(".conf"):
+                names.setdefault(filename.split('_')[-1][:-len(".conf")], []).append(filename)
+        index = {"stamp": stamp, "names": names, "para": {}}
+        flash_conf_index[cfg_dir] = index
+        flash_conf_index_save()
+    flash_conf_index[cfg_dir] = index
+    return index
+
+
+def get_suitable_conf_name(cfg_dir, flash_id):
+    conf_files = get_flash_conf_index(cfg_dir)["names"].get(flash_id, [])
+    if len(conf_files) > 1:
+        bflb_utils.printf("Flash id duplicate and alternative is:")
+        for i in range(len(conf_files)):
+            tmp = conf_files[i].split('.')[0]
+            bflb_utils.printf("%d:%s" % (i + 1, tmp))
+        # the scan used conf_files[i] after this loop, last one in dir order
+        return conf_files[-1]
+    elif len(conf_files) == 1:
+        return conf_files[0]
+    else:
+        return ""
 
 
 def update_flash_para_from_cfg(config_keys, config_file):
+    # packed flash para is cached per conf file and bootheader key layout
+    if id(config_keys) not in flash_conf_keys_digest:
+        flash_conf_keys_digest[id(config_keys)] = hashlib.sha256(
+            json.dumps(config_keys, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    cfg_dir, conf_name = os.path.split(os.path.abspath(config_file))
+    index = get_flash_conf_index(cfg_dir)
+    para_key = flash_conf_keys_digest[id(config_keys)] + " " + conf_name
+    # conf edited in place keeps dir mtime, so para is checked against the conf mtime
+    conf_mtime = os.path.getmtime(config_file)
+    para = index["para"].get(para_key)
+    if para is not None and para[0] == conf_mtime:
+        return para[1], para[2], bytearray.fromhex(para[3]), para[4], para[5]
+    minOffset, filelen, data, flashCrcOffset, crcOffset = \
+        create_flash_para_from_cfg(config_keys, config_file)
+    if "stamp" in index:
+        index["para"][para_key] = [
+            conf_mtime, minOffset, filelen,
+            data.hex(), flashCrcOffset, crcOffset
+        ]
+        flash_conf_index_save()
+    return minOffset, filelen, data, flashCrcOffset, crcOffset
+
+
+def create_flash_para_from_cfg(config_keys, config_file):
     section = "FLASH_CFG"
-    # bflb_utils.printf("Updating data according to <" + config_file + "[" + section + "]>")
     cfg = BFConfigParser()
     cfg.read(config_file)
-    # get finally data len
-    filelen = 0
-    offset = 0
-    minOffset = 0xFFFFFFFF
-    maxOffset = 0
+    layout = bflb_cfg_layout.get_cfg_layout(config_keys)
     flashCrcOffset = 0
     crcOffset = 0
-    if config_keys.get("crc32") != None:
-        crcOffset = int(config_keys.get("crc32")["offset"], 10)
-    if config_keys.get("flashcfg_crc32") != None:
-        flashCrcOffset = int(config_keys.get("flashcfg_crc32")["offset"], 10)
-    for key in cfg.options(section):
-        if config_keys.get(key) == None:
-            continue
-        offset = int(config_keys.get(key)["offset"], 10)
-        if offset < minOffset:
-            minOffset = offset
-        if offset > maxOffset:
-            maxOffset = offset
-    filelen = maxOffset - minOffset + 4
-    data = bytearray(filelen)
-    # bflb_utils.printf(binascii.hexlify(data))
-    for key in cfg.options(section):
-        if config_keys.get(key) == None:
-            bflb_utils.printf(key + " not exist")
-            continue
-        # bflb_utils.printf(key)
-        val = cfg.get(section, key)
-        if val.startswith("0x"):
-            val = int(val, 16)
-        else:
-            val = int(val, 10)
-        # bflb_utils.printf(val)
-        offset = int(config_keys.get(key)["offset"], 10) - minOffset
-        pos = int(config_keys.get(key)["pos"], 10)
-        bitlen = int(config_keys.get(key)["bitlen"], 10)
-
-        oldval = bflb_utils.bytearray_to_int(bflb_utils.bytearray_reverse(data[offset:offset + 4]))
-        newval = (oldval & get_int_mask(pos, bitlen)) + (val << pos)
-        # bflb_utils.printf(newval,binascii.hexlify(bflb_utils.int_to_4bytearray_l(newval)))
-        data[offset:offset + 4] = bflb_utils.int_to_4bytearray_l(newval)
-    # bflb_utils.printf(binascii.hexlify(data))
+    if "crc32" in layout.fields:
+        crcOffset = layout.fields["crc32"][0]
+    if "flashcfg_crc32" in layout.fields:
+        flashCrcOffset = layout.fields["flashcfg_crc32"][0]
+    values = layout.cfg_values(cfg, section)
+    offsets = [layout.fields[key][0] for key, val in values]
+    minOffset = min(offsets)
+    filelen = max(offsets) - minOffset + 4
+    data, data_mask = layout.pack(values, filelen, minOffset)
     return minOffset, filelen, data, flashCrcOffset, crcOffset
 
 
@@ -91,7 +175,7 @@ def update_flash_cfg_data_do(chipname, chiptype, flash_id):
     else:
         cfg_dir = app_path + "/utils/flash/" + gol.flash_dict[chipname] + '/'
     sub_module = __import__("libs." + chiptype, fromlist=[chiptype])
-    conf_name = sub_module.flash_select_do.get_suitable_file_name(cfg_dir, flash_id)
+    conf_name = get_suitable_conf_name(cfg_dir, flash_id)
     if os.path.isfile(cfg_dir + conf_name) == False:
         return None, None, None, None, None
     return update_flash_para_from_cfg(sub_module.bootheader_cfg_keys.bootheader_cfg_keys,
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+#  Copyright (C) 2021- BOUFFALO LAB (NANJING) CO., LTD.
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+
+import sys
+import struct
+
+# sparse flash image: header, extent table, then data of every extent
+#   header: magic, version, extent count, base address, flash length
+#   extent: offset from base address, length
+SPARSE_MAGIC = b"BFSP"
+SPARSE_VERSION = 1
+SPARSE_HEADER = struct.Struct("<4sIIII")
+SPARSE_EXTENT = struct.Struct("<II")
+
+
+def sparse_is_sparse(file):
+    try:
+        with open(file, 'rb') as fp:
+            return fp.read(4) == SPARSE_MAGIC
+    except Exception:
+        return False
+
+
+def sparse_write_header(fp, base_addr, flash_len, extents):
+    fp.write(SPARSE_HEADER.pack(SPARSE_MAGIC, SPARSE_VERSION, len(extents), base_addr, flash_len))
+    for offset, length in extents:
+        fp.write(SPARSE_EXTENT.pack(offset, length))
+
+
+def sparse_read_header(fp):
+    magic, version, extent_cnt, base_addr, flash_len = SPARSE_HEADER.unpack(
+        fp.read(SPARSE_HEADER.size))
+    if magic != SPARSE_MAGIC or version != SPARSE_VERSION:
+        return None
+    extents = []
+    for i in range(extent_cnt):
+        extents.append(SPARSE_EXTENT.unpack(fp.read(SPARSE_EXTENT.size)))
+    return base_addr, flash_len, extents
+
+
+def sparse_flash_len(file):
+    # flash length covered by sparse file, None for flat file
+    if not sparse_is_sparse(file):
+        return None
+    with open(file, 'rb') as fp:
+        header = sparse_read_header(fp)
+    if header is None:
+        return None
+    return header[1]
+
+
+def sparse_read(file):
+    # return base address, flash length and list of (offset, data)
+    with open(file, 'rb') as fp:
+        header = sparse_read_header(fp)
+        if header is None:
+            return None
+        base_addr, flash_len, extents = header
+        data = []
+        for offset, length in extents:
+            data.append((offset, fp.read(length)))
+    return base_addr, flash_len, data
+
+
+def sparse_to_flat(sparse_file, flat_file):
+    # gaps between extents are erased flash
+    with open(sparse_file, 'rb') as fp_in:
+        header = sparse_read_header(fp_in)
+        if header is None:
+            return False
+        base_addr, flash_len, extents = header
+        with open(flat_file, 'wb') as fp_out:
+            pos = 0
+            for offset, length in extents + [(flash_len, 0)]:
+                while pos < offset:
+                    fill_len = min(offset - pos, 0x10000)
+                    fp_out.write(b"\xff" * fill_len)
+                    pos += fill_len
+                while length > 0:
+                    data = fp_in.read(min(length, 0x10000))
+                    fp_out.write(data)
+                    pos += len(data)
+                    length -= len(data)
+    return True
+
+
+def run():
+    if len(sys.argv) != 3:
+        print("usage: bflb_flash_sparse.py sparse_file flat_file")
+        return
+    sparse_to_flat(sys.argv[1], sys.argv[2])
+
+
+if __name__ == '__main__':
+    run()
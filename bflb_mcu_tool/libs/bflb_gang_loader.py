@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+#  Copyright (C) 2021- BOUFFALO LAB (NANJING) CO., LTD.
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+import os
+import re
+import sys
+import copy
+import mmap
+import time
+import shutil
+import traceback
+import multiprocessing
+from queue import Empty
+
+from libs import bflb_utils
+from libs import bflb_eflash_loader
+from libs.bflb_utils import app_path, open_file
+from libs.bflb_configobj import BFConfigParser
+
+# callback stage names shown in gang report
+gang_stage_name = {
+    "进行": "setup",
+    "program1": "erase",
+    "program2": "erase",
+    "APP_WR": "write",
+    "APP_VR": "verify",
+    "program": "finish",
+}
+
+# progress queue of worker process, set by gang_worker_init
+gang_progress_queue = None
+
+
+class GangFlashIdChange(Exception):
+    pass
+
+
+def gang_ports_match(vidpid):
+    # all enumerated ports whose usb-serial adapter matches vid:pid, eg: 1a86:7523
+    vidpid = vidpid.upper().replace("0X", "")
+    ports = []
+    for port in bflb_utils.serial_enumerate():
+        if " (" in port:
+            port = port[:port.find(" (")]
+        if bflb_utils.get_serial_adapter_id(port).startswith(vidpid):
+            ports.append(port)
+    return ports
+
+
+def gang_preload_files(cfg_file):
+    # flash files of cfg, every worker maps them read only, so all ports share the page cache
+    files = []
+    cfg = BFConfigParser()
+    cfg.read(cfg_file)
+    if not cfg.has_option("FLASH_CFG", "file"):
+        return files
+    for file in re.compile(r'\s+').split(cfg.get("FLASH_CFG", "file").strip()):
+        if not file:
+            continue
+        if os.path.isfile(os.path.join(app_path, file)):
+            files.append(file)
+        else:
+            bflb_utils.printf("File not found: ", file)
+    return files
+
+
+def gang_worker_init(files, queue, lock):
+    global gang_progress_queue
+    gang_progress_queue = queue
+    bflb_eflash_loader.cfg_file_lock = lock
+    for file in files:
+        try:
+            fp = open_file(file, 'rb')
+            if os.fstat(fp.fileno()).st_size > 0:
+                data = memoryview(mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ))
+            else:
+                data = b""
+            fp.close()
+            bflb_eflash_loader.flash_file_preload[bflb_eflash_loader.flash_file_preload_key(
+                file)] = data
+        except Exception as e:
+            bflb_utils.printf(e)
+
+
+def gang_program_port(chipname, chiptype, args, eflash_loader_bin, port, log_dir, cfg_file):
+    stage_start = []
+    start_time = time.time()
+    port_name = re.sub(r"[^\w.-]", "_", port)
+    # flash id written by flash_cfg_option goes to a private cfg copy
+    port_cfg_file = os.path.join(log_dir, "gang_" + port_name + ".ini")
+    shutil.copyfile(cfg_file, port_cfg_file)
+    flash_id = []
+
+    def callback(cur, total, stage, *argv):
+        stage = gang_stage_name.get(stage, stage)
+        if not stage_start or stage_start[-1][0] != stage:
+            stage_start.append((stage, time.time()))
+        gang_progress_queue.put((port, stage, cur, total))
+
+    def create_img_callback():
+        # image is shared, it is rebuilt in main process and ports of this flash id run again
+        cfg = BFConfigParser()
+        cfg.read(port_cfg_file)
+        flash_id.append(cfg.get("FLASH_CFG", "flash_id"))
+        raise GangFlashIdChange("image rebuild needed for flash id " + flash_id[0])
+
+    args = copy.copy(args)
+    args.port = port
+    args.config = port_cfg_file
+    stdout = sys.stdout
+    log_fp = open(os.path.join(log_dir, "gang_" + port_name + ".log"), 'w', encoding="utf-8")
+    sys.stdout = log_fp
+    try:
+        eflash_loader_t = bflb_eflash_loader.BflbEflashLoader(chipname, chiptype)
+        ret = eflash_loader_t.efuse_flash_loader(args, None, eflash_loader_bin, callback, None,
+                                                 create_img_callback)
+    except Exception as e:
+        traceback.print_exc(limit=5, file=sys.stdout)
+        ret = str(e)
+    finally:
+        sys.stdout = stdout
+        log_fp.close()
+        os.remove(port_cfg_file)
+    end_time = time.time()
+    # connect lasts until first progress callback, every stage lasts until next one
+    stage_cost = []
+    stage_start.append(("", end_time))
+    stage, stage_time = "connect", start_time
+    for next_stage, next_time in stage_start:
+        for i in range(len(stage_cost)):
+            if stage_cost[i][0] == stage:
+                stage_cost[i] = (stage, stage_cost[i][1] + next_time - stage_time)
+                break
+        else:
+            stage_cost.append((stage, next_time - stage_time))
+        stage, stage_time = next_stage, next_time
+    gang_progress_queue.put((port, "done", 1, 1))
+    if flash_id:
+        ret = "flash id " + flash_id[0]
+    return port, ret is True, str(ret), end_time - start_time, stage_cost, "".join(flash_id)
+
+
+def gang_program_round(chipname, chiptype, args, eflash_loader_bin, ports, cfg_file, log_dir):
+    files = gang_preload_files(cfg_file)
+    queue = multiprocessing.Queue()
+    lock = multiprocessing.Lock()
+    pool = multiprocessing.Pool(len(ports), gang_worker_init, (files, queue, lock))
+    results = []
+    for port in ports:
+        results.append(
+            pool.apply_async(gang_program_port,
+                             (chipname, chiptype, args, eflash_loader_bin, port, log_dir,
+                              cfg_file)))
+    pool.close()
+    progress = {}
+    for port in ports:
+        progress[port] = ("connect", 0)
+    done = 0
+    log_time = 0
+    while done < len(ports):
+        try:
+            port, stage, cur, total = queue.get(timeout=0.5)
+        except Empty:
+            # worker may die without reporting done
+            if all(result.ready() for result in results):
+                break
+            continue
+        if stage == "done":
+            done += 1
+            continue
+        progress[port] = (stage, (cur * 100 // total) if total else 0)
+        if time.time() - log_time > 1.0:
+            log_time = time.time()
+            bflb_utils.printf("Gang progress: " + ", ".join("%s %s %d%%" % (p, progress[p][0],
+                                                                           progress[p][1])
+                                                            for p in ports))
+    pool.join()
+    port_results = []
+    for port, result in zip(ports, results):
+        try:
+            port_results.append(result.get())
+        except Exception as e:
+            port_results.append((port, False, str(e), 0, [], ""))
+    return port_results
+
+
+def gang_program(chipname,
+                 chiptype,
+                 args,
+                 eflash_loader_bin,
+                 ports,
+                 cfg_file,
+                 create_img_callback=None):
+    bflb_utils.printf("========= gang program =========")
+    bflb_utils.printf("ports: ", " ".join(ports))
+    start_time = time.time()
+    log_dir = os.path.join(app_path, "log")
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+    port_results = {}
+    for result in gang_program_round(chipname, chiptype, args, eflash_loader_bin, ports, cfg_file,
+                                     log_dir):
+        port_results[result[0]] = result
+    # boards whose flash differs from the image, image is rebuilt once for every flash id
+    flash_id_ports = {}
+    for port in ports:
+        flash_id = port_results[port][5]
+        if flash_id:
+            flash_id_ports.setdefault(flash_id, []).append(port)
+    for flash_id, id_ports in flash_id_ports.items():
+        if create_img_callback is None:
+            break
+        bflb_utils.printf("Rebuild image for flash id %s, ports: %s" %
+                          (flash_id, " ".join(id_ports)))
+        cfg = BFConfigParser()
+        cfg.read(cfg_file)
+        bflb_utils.update_cfg(cfg, "FLASH_CFG", "flash_id", flash_id)
+        cfg.write(cfg_file, "w+")
+        create_img_callback()
+        for result in gang_program_round(chipname, chiptype, args, eflash_loader_bin, id_ports,
+                                         cfg_file, log_dir):
+            port_results[result[0]] = result
+    pass_cnt = 0
+    for port in ports:
+        port, success, ret, cost, stage_cost, flash_id = port_results[port]
+        if success:
+            pass_cnt += 1
+            status = "PASS"
+        else:
+            status = "FAIL " + ret
+        bflb_utils.printf("%s: %s, time cost(ms): %d" % (port, status, cost * 1000))
+        bflb_utils.printf("    " + ", ".join("%s %dms" % (stage, stage_time * 1000)
+                                             for stage, stage_time in stage_cost))
+    bflb_utils.printf("Gang program %d/%d pass, time cost(ms): %d" %
+                      (pass_cnt, len(ports), (time.time() - start_time) * 1000))
+    if pass_cnt == len(ports):
+        bflb_utils.printf("[All Success]")
+        return True
+    return '{"ErrorCode":"FFFF","ErrorMsg":"GANG PROGRAM %d/%d FAIL"}' % (len(ports) - pass_cnt,
+                                                                       len(ports))
@@ -31,6 +31,7 @@ try:
 except ImportError:
     from libs import bflb_path
 from libs import bflb_utils
+from libs import bflb_build_cache
 from libs import bflb_efuse_boothd_create
 from libs.bflb_utils import app_path, chip_path, set_error_code, convert_path
 from libs.bflb_configobj import BFConfigParser
@@ -131,13 +132,35 @@ def compress_dir(chipname, zippath, efuse_load=False):
     return True
 
 
+def img_create_input_files(img_dir, config_file):
+    # config file and every file named in it
+    if config_file is None:
+        config_file = img_dir + "/img_create_cfg.ini"
+    input_files = [config_file]
+    if os.path.isfile(config_file):
+        cfg = BFConfigParser()
+        cfg.read(config_file)
+        for section in cfg.sections():
+            for option in cfg.options(section):
+                value = cfg.get(section, option)
+                if not isinstance(value, list):
+                    value = [value]
+                for item in value:
+                    for file in re.split(r"[\s|]+", str(item)):
+                        if file and os.path.isfile(file):
+                            input_files.append(file)
+    return input_files
+
+
 def img_create(args, chipname="bl60x", chiptype="bl60x", img_dir=None, config_file=None):
     sub_module = __import__("libs." + chiptype, fromlist=[chiptype])
-    img_dir_path = os.path.join(chip_path, chipname, "img_create_iot")
     if img_dir is None:
-        res = sub_module.img_create_do.img_create_do(args, img_dir_path, config_file)
-    else:
-        res = sub_module.img_create_do.img_create_do(args, img_dir, config_file)
+        img_dir = os.path.join(chip_path, chipname, "img_create_iot")
+    settings = {"args": vars(args), "chipname": chipname, "chiptype": chiptype}
+    res = bflb_build_cache.build_stage_run(
+        os.path.join(img_dir, bflb_build_cache.build_manifest_name), "img_create", {}, settings,
+        img_create_input_files(img_dir, config_file), [img_dir],
+        sub_module.img_create_do.img_create_do, args, img_dir, config_file)
     return res
 
 
@@ -189,6 +189,9 @@ class BflbImgLoader(object):
                 "callback": None
             },
         }
+        # command frame buffer, reused by every command
+        self._frame_buf = bytearray(0)
+        self._frame_view = memoryview(self._frame_buf)
 
     #####################interface close############################################################
     def close_port(self):
@@ -239,13 +242,9 @@ class BflbImgLoader(object):
         #bflb_utils.printf("process",section,",cmd=",binascii.hexlify(cmd_id), ",data len=",binascii.hexlify(cmd_len))
         read_len = bflb_utils.bytearray_to_int(cmd_len)
         read_data = self._bootrom_cmds.get(section)["callback"](section, read_len)
-        tmp = bytearray(2)
-        tmp[0] = cmd_len[1]
-        tmp[1] = cmd_len[0]
         data_read = bytearray(0)
         # in case data len change for some case
-        tmp = bflb_utils.int_to_2bytearray_l(len(read_data))
-        data = cmd_id + bytearray(1) + tmp + read_data
+        data = self.boot_build_one_cmd(cmd_id, read_data)
 
         if self._chip_type == "bl702" and section == "run_image":
             sub_module = __import__("libs." + self._chip_type, fromlist=[self._chip_type])
@@ -253,6 +252,8 @@ class BflbImgLoader(object):
         self.bflb_boot_if.if_write(data)
         if section == "get_boot_info" or section == "load_seg_header" or section == "get_chip_id":
             res, data_read = self.bflb_boot_if.if_deal_response()
+            if data_read is not None:
+                data_read = bytearray(data_read)
         else:
             res = self.bflb_boot_if.if_deal_ack(dmy_data=False)
         if res.startswith("OK") is True:
@@ -264,6 +265,22 @@ class BflbImgLoader(object):
                 bflb_utils.printf("python IO error")
         return res, data_read
 
+    #####################build command frame in place##########################################
+    def boot_build_one_cmd(self, cmd_id, data_send):
+        data_len = len(data_send)
+        frame_len = 4 + data_len
+        if len(self._frame_buf) < frame_len:
+            self._frame_buf = bytearray(frame_len)
+            self._frame_view = memoryview(self._frame_buf)
+        frame = self._frame_view
+        # checksum byte is left 0 for bootrom commands
+        frame[0] = cmd_id[0]
+        frame[1] = 0
+        frame[2] = data_len & 0xff
+        frame[3] = (data_len >> 8) & 0xff
+        frame[4:frame_len] = data_send
+        return frame[0:frame_len]
+
     #####################section common process##########################################
     def boot_process_one_section(self, section, data_len):
         cmd_id = bflb_utils.hexstr_to_bytearray(self._bootrom_cmds.get(section)["cmd_id"])
@@ -0,0 +1,762 @@
+# -*- coding:utf-8 -*-
+#  Copyright (C) 2021- BOUFFALO LAB (NANJING) CO., LTD.
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+import os
+import sys
+import time
+import lzma
+import socket
+import random
+import hashlib
+import argparse
+import threading
+import traceback
+from queue import Queue
+
+try:
+    import bflb_path
+except ImportError:
+    from libs import bflb_path
+from libs import bflb_utils
+from libs import bflb_interface_uart
+
+try:
+    import pty
+    import tty
+    pty_sign = True
+except ImportError:
+    pty_sign = False
+
+# device name prefix that makes BflbUartPort use an in-process emulated chip, registered when
+# this module is imported
+EMULATOR_DEVICE_PREFIX = "emulator"
+
+# emulated chips by device name, flash and efuse content survive port close and reopen
+emulator_devices = {}
+
+
+def get_emulator_device(name, chiptype="bl616"):
+    key = name.lower()
+    if key not in emulator_devices:
+        emulator_devices[key] = BflbEmulatorDevice(chiptype)
+    return emulator_devices[key]
+
+
+def add_emulator_device(name, device):
+    emulator_devices[name.lower()] = device
+    return device
+
+
+class BflbEmulatorDevice(object):
+
+    def __init__(self,
+                 chiptype="bl616",
+                 flash_size=0x1000000,
+                 flash_id="ef4016",
+                 efuse_size=512,
+                 bootinfo=None,
+                 sdio=False):
+        self._chiptype = chiptype
+        self._flash = bytearray(b'\xff') * flash_size
+        self._flash_id = bflb_utils.hexstr_to_bytearray(flash_id)
+        self._efuse = bytearray(efuse_size)
+        self._ram = {}
+        if bootinfo is None:
+            # rom version, sign/encrypt, reserved, chip id, reserved
+            bootinfo = bflb_utils.hexstr_to_bytearray("01000000" + "00000000" + "00000000" +
+                                                      "0102030405060708" + "00000000")
+        self._bootinfo = bootinfo
+        # sdio framing has 4 bytes error code and 4 bytes data header
+        self._sdio = sdio
+        # output function of the attached link
+        self._output = None
+        self._lock = threading.RLock()
+        # timing, all values in seconds
+        self._baudrate = 0
+        self._baudrate_throttle = False
+        self._latency = 0.0
+        self._erase_time_4k = 0.0
+        self._chip_erase_time = 0.0
+        self._write_time_4k = 0.0
+        self._pending_interval = 1.0
+        # error injection
+        self._random = random.Random()
+        self._error_rate = 0.0
+        self._max_baudrate = 0
+        self._error_cmds = None
+        self._error_code = 0x0103
+        self._error_hook = None
+        # statistics
+        self.stats = {}
+        self.reset()
+        self.stats_clear()
+
+        self._cmd_handlers = {
+            0x05: self._get_chip_id,
+            0x10: self._get_boot_info,
+            0x11: self._load_boot_header,
+            0x12: self._ack_ok,
+            0x13: self._ack_ok,
+            0x14: self._ack_ok,
+            0x15: self._ack_ok,
+            0x16: self._ack_ok,
+            0x17: self._load_seg_header,
+            0x18: self._load_seg_data,
+            0x19: self._check_image,
+            0x1a: self._run_image,
+            0x20: self._change_rate,
+            0x21: self._reset,
+            0x22: self._ack_ok,
+            0x23: self._ack_ok,
+            0x30: self._flash_erase,
+            0x31: self._flash_write,
+            0x32: self._flash_read,
+            0x33: self._ack_ok,
+            0x34: self._flash_read,
+            0x35: self._ack_ok,
+            0x36: self._flash_read_jid,
+            0x37: self._flash_read_status_reg,
+            0x38: self._ack_ok,
+            0x3a: self._flash_write_check,
+            0x3b: self._ack_ok,
+            0x3c: self._flash_chiperase,
+            0x3d: self._flash_read_sha,
+            0x3e: self._flash_read_sha,
+            0x3f: self._flash_decompress_write,
+            0x40: self._efuse_write,
+            0x41: self._efuse_read,
+            0x42: self._efuse_read_mac,
+            0x43: self._ack_ok,
+            0x50: self._memory_write,
+            0x60: self._ack_ok,
+            0x61: self._ack_ok,
+            0x71: self._log_read,
+        }
+
+    def set_timing(self,
+                   latency=None,
+                   baudrate_throttle=None,
+                   erase_time_4k=None,
+                   chip_erase_time=None,
+                   write_time_4k=None,
+                   pending_interval=None):
+        if latency is not None:
+            self._latency = latency
+        if baudrate_throttle is not None:
+            self._baudrate_throttle = baudrate_throttle
+        if erase_time_4k is not None:
+            self._erase_time_4k = erase_time_4k
+        if chip_erase_time is not None:
+            self._chip_erase_time = chip_erase_time
+        if write_time_4k is not None:
+            self._write_time_4k = write_time_4k
+        if pending_interval is not None:
+            self._pending_interval = pending_interval
+
+    # rate is the probability of answering a command with FL error code,
+    # cmds limits it to some command ids, hook(cmd_id, payload) returns an error code or None
+    def set_error(self, rate=0.0, cmds=None, code=0x0103, hook=None, seed=None, max_baudrate=0):
+        self._error_rate = rate
+        # frames received above max baudrate fail with checksum error
+        self._max_baudrate = max_baudrate
+        self._error_cmds = cmds
+        self._error_code = code
+        self._error_hook = hook
+        if seed is not None:
+            self._random.seed(seed)
+
+    def set_baudrate(self, baudrate):
+        with self._lock:
+            self._baudrate = baudrate
+            # change rate ack is sent once host switched to the new rate
+            if self._rate_ack is not None and self._rate_ack == baudrate:
+                self._rate_ack = None
+                self._ack_ok()
+
+    def attach(self, output):
+        with self._lock:
+            self._output = output
+            self._rx_buf = bytearray(0)
+
+    def detach(self, output):
+        with self._lock:
+            if self._output == output:
+                self._output = None
+
+    def reset(self):
+        with self._lock:
+            self._mode = "bootrom"
+            self._rx_buf = bytearray(0)
+            self._synced = False
+            self._seg_addr = 0
+            self._seg_left = 0
+            self._xz = None
+            self._xz_addr = 0
+            self._rate_ack = None
+
+    def stats_clear(self):
+        self.stats = {"cmds": 0, "errors": 0, "rx_bytes": 0, "tx_bytes": 0, "erase_bytes": 0}
+
+    def get_mode(self):
+        return self._mode
+
+    def get_flash_data(self, addr, length):
+        return bytes(self._flash[addr:addr + length])
+
+    def set_flash_data(self, addr, data):
+        self._flash[addr:addr + len(data)] = data
+
+    def get_efuse_data(self):
+        return bytes(self._efuse)
+
+    def _wire_time(self, length):
+        if self._baudrate_throttle and self._baudrate > 0:
+            time.sleep(length * 10 / float(self._baudrate))
+
+    def _send(self, data):
+        self._wire_time(len(data))
+        self.stats["tx_bytes"] += len(data)
+        if self._output is not None:
+            self._output(bytes(data))
+
+    # feed bytes received from host, process all complete frames
+    def feed(self, data):
+        with self._lock:
+            self._wire_time(len(data))
+            self.stats["rx_bytes"] += len(data)
+            self._rx_buf += data
+            while True:
+                # 0x55 sync bytes between frames are shake hand
+                i = 0
+                while i < len(self._rx_buf) and self._rx_buf[i] == 0x55:
+                    i += 1
+                if i > 0:
+                    del self._rx_buf[0:i]
+                    if self._synced is False:
+                        self._synced = True
+                        self._send(b"OK")
+                if len(self._rx_buf) < 4:
+                    break
+                data_len = self._rx_buf[2] + (self._rx_buf[3] << 8)
+                if len(self._rx_buf) < 4 + data_len:
+                    break
+                frame = bytes(self._rx_buf[0:4 + data_len])
+                del self._rx_buf[0:4 + data_len]
+                self._synced = False
+                self._process_frame(frame)
+
+    def _process_frame(self, frame):
+        cmd_id = frame[0]
+        payload = frame[4:]
+        self.stats["cmds"] += 1
+        if self._latency > 0:
+            time.sleep(self._latency)
+        # bootrom does not fill in checksum
+        if frame[1] != 0 and frame[1] != (sum(frame[2:]) & 0xff):
+            self._ack_fail(0x0103)
+            return
+        code = None
+        if self._max_baudrate > 0 and self._baudrate > self._max_baudrate:
+            code = 0x0103
+        elif self._error_hook is not None:
+            code = self._error_hook(cmd_id, payload)
+        elif self._error_rate > 0 and (self._error_cmds is None or cmd_id in self._error_cmds):
+            if self._random.random() < self._error_rate:
+                code = self._error_code
+        if code is not None:
+            self._ack_fail(code)
+            return
+        handler = self._cmd_handlers.get(cmd_id)
+        if handler is None:
+            self._ack_fail(0x0101)
+            return
+        try:
+            handler(cmd_id, payload)
+        except Exception as e:
+            bflb_utils.printf("Emulator error: %s" % e)
+            traceback.print_exc(limit=5, file=sys.stdout)
+            self._ack_fail(0xffff)
+
+    def _ack_ok(self, cmd_id=None, payload=None):
+        self._send(b"OK")
+
+    def _ack_pending(self):
+        self._send(b"PD")
+
+    def _ack_fail(self, code):
+        self.stats["errors"] += 1
+        if self._sdio:
+            self._send(b"FL")
+            self._send(bytearray(2) + bflb_utils.int_to_2bytearray_l(code))
+        else:
+            self._send(b"FL" + bflb_utils.int_to_2bytearray_l(code))
+
+    def _response(self, data):
+        if self._sdio:
+            self._send(b"OK")
+            self._send(bytearray(2) + bflb_utils.int_to_2bytearray_l(len(data)))
+            self._send(bytearray(4) + data)
+        else:
+            self._send(b"OK" + bflb_utils.int_to_2bytearray_l(len(data)) + data)
+
+    def _busy(self, busy_time):
+        # long operation, send pending ack so host does not time out
+        while busy_time > self._pending_interval:
+            time.sleep(self._pending_interval)
+            busy_time -= self._pending_interval
+            self._ack_pending()
+        if busy_time > 0:
+            time.sleep(busy_time)
+
+    def _get_addr_len(self, payload):
+        addr = bflb_utils.bytearray_to_int(bflb_utils.bytearray_reverse(payload[0:4]))
+        length = bflb_utils.bytearray_to_int(bflb_utils.bytearray_reverse(payload[4:8]))
+        return addr, length
+
+    def _flash_range_valid(self, addr, length):
+        return addr >= 0 and length >= 0 and addr + length <= len(self._flash)
+
+    # bootrom commands
+    def _get_chip_id(self, cmd_id, payload):
+        self._response(b"CHIPWB03A00_BL\x00\x00")
+
+    def _get_boot_info(self, cmd_id, payload):
+        if self._mode == "eflash_loader":
+            self._response(b"\xff\xff\xff\xff" + bytes(self._bootinfo[4:]))
+        else:
+            self._response(bytes(self._bootinfo))
+
+    def _load_boot_header(self, cmd_id, payload):
+        if payload[0:4] != b"BFNP" and payload[0:4] != b"BFAP":
+            self._ack_fail(0x0203)
+            return
+        self._ram = {}
+        self._seg_left = 0
+        self._ack_ok()
+
+    def _load_seg_header(self, cmd_id, payload):
+        if len(payload) != 16:
+            self._ack_fail(0x020f)
+            return
+        self._seg_addr, self._seg_left = self._get_addr_len(payload)
+        self._ram[self._seg_addr] = bytearray(0)
+        self._response(payload)
+
+    def _load_seg_data(self, cmd_id, payload):
+        if len(payload) > self._seg_left:
+            self._ack_fail(0x0212)
+            return
+        self._ram[self._seg_addr] += payload
+        self._seg_left -= len(payload)
+        self._ack_ok()
+
+    def _check_image(self, cmd_id, payload):
+        if self._seg_left != 0:
+            self._ack_fail(0x0214)
+            return
+        self._ack_ok()
+
+    def _run_image(self, cmd_id, payload):
+        self._ack_ok()
+        self._mode = "eflash_loader"
+
+    def _change_rate(self, cmd_id, payload):
+        old_rate, new_rate = self._get_addr_len(payload)
+        if self._baudrate == new_rate:
+            self._ack_ok()
+        else:
+            self._rate_ack = new_rate
+
+    def _reset(self, cmd_id, payload):
+        self._ack_ok()
+        self.reset()
+
+    def _memory_write(self, cmd_id, payload):
+        addr = bflb_utils.bytearray_to_int(bflb_utils.bytearray_reverse(payload[0:4]))
+        self._ack_ok()
+        # bl702 writes the reset register to run the loaded image
+        if addr == 0x40000018 and payload[4:5] == b"\x02":
+            self._mode = "eflash_loader"
+
+    # eflash_loader commands
+    def _flash_erase(self, cmd_id, payload):
+        start_addr, end_addr = self._get_addr_len(payload)
+        if end_addr < start_addr or not self._flash_range_valid(start_addr,
+                                                                end_addr - start_addr + 1):
+            self._ack_fail(0x0002)
+            return
+        # erase is 4K sector aligned
+        start_addr = start_addr & 0xfffff000
+        end_addr = (end_addr & 0xfffff000) + 0x1000
+        if end_addr > len(self._flash):
+            end_addr = len(self._flash)
+        self._busy(self._erase_time_4k * ((end_addr - start_addr) // 0x1000))
+        self._flash[start_addr:end_addr] = b'\xff' * (end_addr - start_addr)
+        self.stats["erase_bytes"] += end_addr - start_addr
+        self._ack_ok()
+
+    def _flash_chiperase(self, cmd_id, payload):
+        self._busy(self._chip_erase_time)
+        self._flash[:] = b'\xff' * len(self._flash)
+        self.stats["erase_bytes"] += len(self._flash)
+        self._ack_ok()
+
+    def _flash_program(self, addr, data):
+        if not self._flash_range_valid(addr, len(data)):
+            return False
+        if self._write_time_4k > 0:
+            time.sleep(self._write_time_4k * len(data) / 0x1000)
+        # nor flash program only clears bits
+        old = int.from_bytes(self._flash[addr:addr + len(data)], "little")
+        new = int.from_bytes(data, "little")
+        self._flash[addr:addr + len(data)] = (old & new).to_bytes(len(data), "little")
+        return True
+
+    def _flash_write(self, cmd_id, payload):
+        addr = bflb_utils.bytearray_to_int(bflb_utils.bytearray_reverse(payload[0:4]))
+        if self._flash_program(addr, payload[4:]) is False:
+            self._ack_fail(0x0005)
+            return
+        self._ack_ok()
+
+    def _flash_decompress_write(self, cmd_id, payload):
+        addr = bflb_utils.bytearray_to_int(bflb_utils.bytearray_reverse(payload[0:4]))
+        # bit 31 marks the first frame of a new xz stream
+        if addr & 0x80000000:
+            self._xz = lzma.LZMADecompressor(format=lzma.FORMAT_XZ)
+            self._xz_addr = addr & 0x7FFFFFFF
+        if self._xz is None:
+            self._ack_fail(0x000b)
+            return
+        try:
+            data = self._xz.decompress(payload[4:])
+        except lzma.LZMAError:
+            self._xz = None
+            self._ack_fail(0x000c)
+            return
+        if self._flash_program(self._xz_addr, data) is False:
+            self._ack_fail(0x0005)
+            return
+        self._xz_addr += len(data)
+        self._ack_ok()
+
+    def _flash_write_check(self, cmd_id, payload):
+        if self._xz is not None:
+            eof = self._xz.eof
+            self._xz = None
+            if eof is False:
+                self._ack_fail(0x000b)
+                return
+        self._ack_ok()
+
+    def _flash_read(self, cmd_id, payload):
+        addr, length = self._get_addr_len(payload)
+        if not self._flash_range_valid(addr, length):
+            self._ack_fail(0x0004)
+            return
+        self._response(self._flash[addr:addr + length])
+
+    def _flash_read_sha(self, cmd_id, payload):
+        addr, length = self._get_addr_len(payload)
+        if not self._flash_range_valid(addr, length):
+            self._ack_fail(0x0004)
+            return
+        self._response(hashlib.sha256(self._flash[addr:addr + length]).digest())
+
+    def _flash_read_jid(self, cmd_id, payload):
+        # jedec id and valid flag
+        self._response(self._flash_id[0:3] + b"\x80")
+
+    def _flash_read_status_reg(self, cmd_id, payload):
+        reg, length = self._get_addr_len(payload)
+        self._response(bytearray(length))
+
+    def _efuse_write(self, cmd_id, payload):
+        addr = bflb_utils.bytearray_to_int(bflb_utils.bytearray_reverse(payload[0:4]))
+        data = payload[4:]
+        if addr + len(data) > len(self._efuse):
+            self._ack_fail(0x0402)
+            return
+        # efuse bits can only be burned from 0 to 1
+        for i in range(len(data)):
+            self._efuse[addr + i] |= data[i]
+        self._ack_ok()
+
+    def _efuse_read(self, cmd_id, payload):
+        addr, length = self._get_addr_len(payload)
+        if addr + length > len(self._efuse):
+            self._ack_fail(0x0405)
+            return
+        self._response(self._efuse[addr:addr + length])
+
+    def _efuse_read_mac(self, cmd_id, payload):
+        mac_len = 6
+        if self._chiptype == "bl702" or self._chiptype == "bl702l":
+            mac_len = 8
+        mac = self._efuse[0x14:0x14 + mac_len]
+        self._response(mac + bflb_utils.get_crc32_bytearray(mac))
+
+    def _log_read(self, cmd_id, payload):
+        self._response(b"emulator " + self._chiptype.encode("utf-8") + b" " +
+                       self._mode.encode("utf-8") + b"\r\n")
+
+
+# serial.Serial lookalike connected to an emulated chip in this process,
+# BflbUartPort uses it when device name starts with EMULATOR_DEVICE_PREFIX
+class BflbEmulatorSerial(object):
+
+    def __init__(self, device, baudrate, timeout=2.0, chiptype="bl616"):
+        self.port = device
+        self.timeout = timeout
+        self._baudrate = baudrate
+        self._rts = False
+        self._dtr = False
+        self._device = get_emulator_device(device, chiptype)
+        self._rx_buf = bytearray(0)
+        self._rx_cond = threading.Condition()
+        self._tx_queue = Queue()
+        self._device.attach(self._device_output)
+        self._device.set_baudrate(baudrate)
+        self._thread = threading.Thread(target=self._device_run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def baudrate(self):
+        return self._baudrate
+
+    @baudrate.setter
+    def baudrate(self, val):
+        self._baudrate = val
+        self._device.set_baudrate(val)
+
+    @property
+    def in_waiting(self):
+        with self._rx_cond:
+            return len(self._rx_buf)
+
+    def _device_run(self):
+        while True:
+            data = self._tx_queue.get()
+            if data is None:
+                break
+            self._device.feed(data)
+
+    def _device_output(self, data):
+        with self._rx_cond:
+            self._rx_buf += data
+            self._rx_cond.notify_all()
+
+    def write(self, data):
+        self._tx_queue.put(bytes(data))
+        return len(data)
+
+    def _wait_rx(self, size):
+        deadline = None
+        if self.timeout is not None:
+            deadline = time.time() + self.timeout
+        while len(self._rx_buf) < size:
+            if deadline is None:
+                self._rx_cond.wait()
+            else:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._rx_cond.wait(remaining)
+
+    def read(self, size=1):
+        with self._rx_cond:
+            self._wait_rx(size)
+            data = bytes(self._rx_buf[0:size])
+            del self._rx_buf[0:size]
+        return data
+
+    def readinto(self, b):
+        with self._rx_cond:
+            self._wait_rx(len(b))
+            n = min(len(b), len(self._rx_buf))
+            b[0:n] = self._rx_buf[0:n]
+            del self._rx_buf[0:n]
+        return n
+
+    def read_all(self):
+        with self._rx_cond:
+            data = bytes(self._rx_buf)
+            self._rx_buf = bytearray(0)
+        return data
+
+    def flushInput(self):
+        self.read_all()
+
+    def reset_input_buffer(self):
+        self.read_all()
+
+    def set_buffer_size(self, rx_size=4096, tx_size=None):
+        pass
+
+    def setDTR(self, val):
+        self._dtr = bool(val)
+
+    def setRTS(self, val):
+        # any edge on reset line restarts the chip in bootrom
+        if bool(val) != self._rts:
+            self._device.reset()
+        self._rts = bool(val)
+
+    def close(self):
+        self._tx_queue.put(None)
+        self._device.detach(self._device_output)
+
+
+# pseudo terminal served by an emulated chip, the slave name can be used as uart device
+class BflbEmulatorPty(object):
+
+    def __init__(self, device):
+        self._device = device
+        self._master = None
+        self._slave = None
+        self._thread = None
+        self._running = False
+
+    def open(self):
+        if pty_sign is False:
+            bflb_utils.printf("pty is not supported on this platform")
+            return None
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._slave)
+        self._device.attach(self._device_output)
+        self._running = True
+        self._thread = threading.Thread(target=self._device_run)
+        self._thread.daemon = True
+        self._thread.start()
+        return os.ttyname(self._slave)
+
+    def _device_run(self):
+        while self._running:
+            try:
+                data = os.read(self._master, 4096)
+            except OSError:
+                break
+            if len(data) == 0:
+                break
+            self._device.feed(data)
+
+    def _device_output(self, data):
+        os.write(self._master, data)
+
+    def close(self):
+        self._running = False
+        self._device.detach(self._device_output)
+        if self._slave is not None:
+            os.close(self._slave)
+            self._slave = None
+        if self._master is not None:
+            os.close(self._master)
+            self._master = None
+
+
+# udp server served by an emulated chip with sdio framing, for BflbSdioPort
+class BflbEmulatorSdioServer(object):
+
+    def __init__(self, device, port):
+        self._device = device
+        self._port = port
+        self._sock = None
+        self._thread = None
+        self._peer = None
+        self._running = False
+
+    def open(self):
+        self._device._sdio = True
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind((socket.gethostname(), self._port))
+        self._device.attach(self._device_output)
+        self._running = True
+        self._thread = threading.Thread(target=self._device_run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self._port
+
+    def _device_run(self):
+        while self._running:
+            try:
+                data, self._peer = self._sock.recvfrom(65536)
+            except OSError:
+                break
+            self._device.feed(data)
+
+    def _device_output(self, data):
+        # each piece is one datagram, host reads them with exact lengths
+        if self._peer is not None:
+            self._sock.sendto(data, self._peer)
+
+    def close(self):
+        self._running = False
+        self._device.detach(self._device_output)
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+def emulator_parser_init():
+    parser = argparse.ArgumentParser(description='bouffalolab chip emulator')
+    parser.add_argument('--chipname', dest='chipname', default="bl616", help='chip type')
+    parser.add_argument('--sdio', dest='sdio', type=int, default=0, help='serve sdio on udp port')
+    parser.add_argument('--latency', dest='latency', type=float, default=0.0, help='command latency in ms')
+    parser.add_argument('--baudrate', dest='baudrate', type=int, default=2000000, help='uart baudrate')
+    parser.add_argument('--throttle', dest='throttle', action="store_true", help='throttle by baudrate')
+    parser.add_argument('--erase_time', dest='erase_time', type=float, default=0.0, help='4K erase time in ms')
+    parser.add_argument('--error_rate', dest='error_rate', type=float, default=0.0, help='error injection rate')
+    parser.add_argument('--max_baudrate', dest='max_baudrate', type=int, default=0, help='fail frames above this baudrate')
+    return parser
+
+
+bflb_interface_uart.uart_serial_register(EMULATOR_DEVICE_PREFIX, BflbEmulatorSerial)
+
+
+def run():
+    args = emulator_parser_init().parse_args()
+    device = BflbEmulatorDevice(args.chipname)
+    device.set_timing(latency=args.latency / 1000.0,
+                      baudrate_throttle=args.throttle,
+                      erase_time_4k=args.erase_time / 1000.0)
+    device.set_error(rate=args.error_rate, max_baudrate=args.max_baudrate)
+    device.set_baudrate(args.baudrate)
+    if args.sdio:
+        server = BflbEmulatorSdioServer(device, args.sdio)
+        server.open()
+        bflb_utils.printf("emulator serve sdio on udp port ", args.sdio)
+    else:
+        server = BflbEmulatorPty(device)
+        name = server.open()
+        if name is None:
+            return
+        bflb_utils.printf("emulator serve uart on ", name)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    server.close()
+
+
+if __name__ == '__main__':
+    run()
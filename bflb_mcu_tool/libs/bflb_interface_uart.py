@@ -22,6 +22,7 @@
 import os
 import sys
 import time
+import errno
 import binascii
 import serial
 import threading
@@ -36,6 +37,22 @@ try:
 except ImportError:
     raise serial.serialutil.SerialException
 
+UART_RX_BUF_SIZE = 64 * 1024
+
+# serial classes by device name prefix, registered by emulated devices, others use pyserial
+uart_serial_classes = {}
+
+
+def uart_serial_register(prefix, serial_class):
+    uart_serial_classes[prefix.lower()] = serial_class
+
+
+def uart_serial_class(device):
+    for prefix, serial_class in uart_serial_classes.items():
+        if device.lower().startswith(prefix):
+            return serial_class
+    return None
+
 
 class BflbUartPort(object):
 
@@ -47,8 +64,14 @@ class BflbUartPort(object):
         self._shakehand_flag = False
         self._chiptype = "bl602"
         self._chipname = "bl602"
+        # receive buffer, data between _rx_start and _rx_end is not consumed yet
+        self._rx_buf = bytearray(UART_RX_BUF_SIZE)
+        self._rx_view = memoryview(self._rx_buf)
+        self._rx_start = 0
+        self._rx_end = 0
 
     def if_init(self, device, rate, chiptype="bl602", chipname="bl602"):
+        self._if_rx_clear()
         try:
             if self._ser is None:
                 self._baudrate = rate
@@ -59,7 +82,12 @@ class BflbUartPort(object):
                     dev = device
                 self._device = dev.upper()
 
+                serial_class = uart_serial_class(dev)
+                if serial_class is not None:
+                    self._ser = serial_class(dev, rate, 2.0, chiptype)
                 for i in range(5):
+                    if self._ser is not None:
+                        break
                     try:
                         self._ser = serial.Serial(dev,
                                                   rate,
@@ -83,6 +111,7 @@ class BflbUartPort(object):
             bflb_utils.printf("Error: %s" % e)
 
     def if_init_tmall(self, device, rate, chiptype="bl602", chipname="bl602"):
+        self._if_rx_clear()
         try:
             if self._ser is None:
                 self._baudrate = rate
@@ -114,11 +143,13 @@ class BflbUartPort(object):
             bflb_utils.printf("Error: %s" % e)
 
     def flush_buffers(self):
+        self._if_rx_clear()
         if self._ser:
             self._ser.flushInput()
         #self._ser.flushOutput()
 
     def if_clear_buf(self):
+        self._if_rx_clear()
         if self._ser:
             timeout = self._ser.timeout
             self._ser.timeout = 0.1
@@ -131,11 +162,20 @@ class BflbUartPort(object):
 
     def if_set_dtr(self, val):
         if self._ser:
-            self._ser.setDTR(val)
+            try:
+                self._ser.setDTR(val)
+            except IOError as e:
+                # pseudo terminal has no modem lines, ignore like pyserial open does
+                if e.errno not in (errno.EINVAL, errno.ENOTTY):
+                    raise
 
     def if_set_rts(self, val):
         if self._ser:
-            self._ser.setRTS(val)
+            try:
+                self._ser.setRTS(val)
+            except IOError as e:
+                if e.errno not in (errno.EINVAL, errno.ENOTTY):
+                    raise
 
     def if_set_isp_baudrate(self, baudrate):
         bflb_utils.printf("isp mode speed: ", baudrate)
@@ -150,6 +190,10 @@ class BflbUartPort(object):
             self._ser.write(data_send)
 
     def if_raw_read(self):
+        if self._rx_end > self._rx_start:
+            data = bytes(self._rx_view[self._rx_start:self._rx_end])
+            self._if_rx_clear()
+            return data
         if self._ser:
             return self._ser.read(self._ser.in_waiting or 1)
 
@@ -157,26 +201,66 @@ class BflbUartPort(object):
         if self._ser:
             return self._ser.read(self._ser.in_waiting or 200)
 
-    # this function return bytearray or bytes type
-    def if_read(self, data_len):
-        data = bytearray(0)
-        received = 0
+    def _if_rx_clear(self):
+        self._rx_start = 0
+        self._rx_end = 0
+
+    def _if_rx_fill(self, data_len):
+        avail = self._rx_end - self._rx_start
+        if avail >= data_len:
+            return avail
+        if self._rx_start + data_len > len(self._rx_buf):
+            if data_len > len(self._rx_buf):
+                rx_buf = bytearray(max(data_len, len(self._rx_buf) * 2))
+                rx_buf[0:avail] = self._rx_view[self._rx_start:self._rx_end]
+                self._rx_buf = rx_buf
+                self._rx_view = memoryview(rx_buf)
+            else:
+                # move unconsumed data to buffer head
+                self._rx_view[0:avail] = self._rx_view[self._rx_start:self._rx_end]
+            self._rx_start = 0
+            self._rx_end = avail
+        while avail < data_len:
+            want = data_len - avail
+            # take what is already waiting so following reads are served from buffer
+            waiting = self._ser.in_waiting
+            if waiting > want:
+                want = min(waiting, len(self._rx_buf) - self._rx_end)
+            n = self._ser.readinto(self._rx_view[self._rx_end:self._rx_end + want])
+            if not n:
+                break
+            self._rx_end += n
+            avail += n
+        return avail
+
+    # this function return memoryview of receive buffer, it is valid until next read or clear,
+    # next read may move unread data over it, so copy what must be kept longer
+    def if_read_view(self, data_len):
         if self._ser:
             try:
-                while received < data_len:
-                    if self._ser:
-                        tmp = self._ser.read(data_len - received)
-                        if len(tmp) == 0:
-                            break
-                        data += tmp
-                        received += len(tmp)
-                if len(data) != data_len:
+                avail = min(self._if_rx_fill(data_len), data_len)
+                data = self._rx_view[self._rx_start:self._rx_start + avail]
+                self._rx_start += avail
+                if self._rx_start == self._rx_end:
+                    self._if_rx_clear()
+                if avail != data_len:
                     return 0, data
                 return 1, data
             except Exception as e:
                 bflb_utils.printf("Error: %s" % e)
         else:
-            return 0, data
+            return 0, self._rx_view[0:0]
+
+    # this function return bytearray or bytes type
+    def if_read(self, data_len):
+        if self._ser:
+            try:
+                success, data = self.if_read_view(data_len)
+                return success, bytearray(data)
+            except Exception as e:
+                bflb_utils.printf("Error: %s" % e)
+        else:
+            return 0, bytearray(0)
 
     def _if_get_sync_bytes(self, length):
         try:
@@ -279,11 +363,11 @@ class BflbUartPort(object):
 
                     bflb_utils.printf("Please Press Reset Key!")
                     # reset low
-                    self._ser.setRTS(1)
+                    self.if_set_rts(1)
                     # RC delay is 100ms
                     time.sleep(0.2)
                     # reset high
-                    self._ser.setRTS(0)
+                    self.if_set_rts(0)
 
                     time_stamp = time.time()
                     while time.time() - time_stamp < wait_timeout:
@@ -309,10 +393,10 @@ class BflbUartPort(object):
                             if self._chiptype == "bl602" or self._chiptype == "bl702":
                                 self._ser.timeout = 0.5
                                 # read 15 byte key word
-                                ack = self._ser.read(15)
+                                success, ack = self.if_read(15)
                                 # reduce timeout and read 15 byte again, make sure recv all key word
                                 self._ser.timeout = 0.005
-                                ack += self._ser.read(15)
+                                ack += self.if_read(15)[1]
                                 self._ser.timeout = tmp_timeout
                                 bflb_utils.printf("read ready")
                                 if ack.find(b'Boot2 ISP Ready') == -1:
@@ -353,43 +437,43 @@ class BflbUartPort(object):
                             cutoff_time = cutoff_time - 1000
                         # MP_TOOL_V3 generate rising pulse to make D trigger output low
                         # reset low
-                        self._ser.setRTS(1)
+                        self.if_set_rts(1)
                         # RC delay is 100ms
                         time.sleep(0.2)
                         # reset high
-                        self._ser.setRTS(0)
+                        self.if_set_rts(0)
                         time.sleep(0.05)
                         # do power off
                         # reset low
-                        self._ser.setRTS(1)
+                        self.if_set_rts(1)
                         if cutoff_revert:
                             # dtr high, power off
-                            self._ser.setDTR(0)
+                            self.if_set_dtr(0)
                         else:
                             # dtr low, power off
-                            self._ser.setDTR(1)
+                            self.if_set_dtr(1)
                         bflb_utils.printf("tx rx and power off, press the machine!")
                         bflb_utils.printf("cutoff time is ", cutoff_time / 1000.0)
                         time.sleep(cutoff_time / 1000.0)
                         if cutoff_revert:
                             # dtr low, power on
-                            self._ser.setDTR(1)
+                            self.if_set_dtr(1)
                         else:
                             # dtr high, power on
-                            self._ser.setDTR(0)
+                            self.if_set_dtr(0)
                         bflb_utils.printf("power on tx and rx ")
                         time.sleep(0.1)
                     else:
-                        self._ser.setDTR(0)
+                        self.if_set_dtr(0)
                         bflb_utils.printf("default set DTR high ")
                         time.sleep(0.1)
                     if do_reset is True and blusbserialwriteflag is not True:
                         # MP_TOOL_V3 reset high to make boot pin high
-                        self._ser.setRTS(0)
+                        self.if_set_rts(0)
                         time.sleep(0.2)
                         if reset_revert:
                             # reset low for reset revert to make boot pin high when cpu rset
-                            self._ser.setRTS(1)
+                            self.if_set_rts(1)
                             time.sleep(0.001)
                         reset_cnt = 2
                         if reset_hold_time > 1000:
@@ -398,19 +482,19 @@ class BflbUartPort(object):
                         while reset_cnt > 0:
                             if reset_revert:
                                 # reset high
-                                self._ser.setRTS(0)
+                                self.if_set_rts(0)
                             else:
                                 # reset low
-                                self._ser.setRTS(1)
+                                self.if_set_rts(1)
                             # Boot high
                             # self._ser.setDTR(0)
                             time.sleep(reset_hold_time / 1000.0)
                             if reset_revert:
                                 # reset low
-                                self._ser.setRTS(1)
+                                self.if_set_rts(1)
                             else:
                                 # reset high
-                                self._ser.setRTS(0)
+                                self.if_set_rts(0)
                             if shake_hand_delay > 0:
                                 time.sleep(shake_hand_delay / 1000.0)
                             else:
@@ -419,19 +503,19 @@ class BflbUartPort(object):
                             # do reset agian to make sure boot pin is high
                             if reset_revert:
                                 # reset high
-                                self._ser.setRTS(0)
+                                self.if_set_rts(0)
                             else:
                                 # reset low
-                                self._ser.setRTS(1)
+                                self.if_set_rts(1)
                             # Boot high
                             # self._ser.setDTR(0)
                             time.sleep(reset_hold_time / 1000.0)
                             if reset_revert:
                                 # reset low
-                                self._ser.setRTS(1)
+                                self.if_set_rts(1)
                             else:
                                 # reset high
-                                self._ser.setRTS(0)
+                                self.if_set_rts(0)
                             if shake_hand_delay > 0:
                                 time.sleep(shake_hand_delay / 1000.0)
                             else:
@@ -445,6 +529,7 @@ class BflbUartPort(object):
                     # clean buffer before start
                     bflb_utils.printf("clean buf")
                     self._ser.timeout = 0.1
+                    self._if_rx_clear()
                     ack = self._ser.read_all()
                     # change tiemout value when shake hand
                     if self._602a0_dln_fix:
@@ -525,11 +610,11 @@ class BflbUartPort(object):
 
                 bflb_utils.printf("Please Press Reset Key!")
                 # reset low
-                self._ser.setRTS(1)
+                self.if_set_rts(1)
                 # RC delay is 100ms
                 time.sleep(0.2)
                 # reset high
-                self._ser.setRTS(0)
+                self.if_set_rts(0)
 
                 time_stamp = time.time()
                 while time.time() - time_stamp < wait_timeout:
@@ -555,10 +640,10 @@ class BflbUartPort(object):
                         if self._chiptype == "bl602" or self._chiptype == "bl702":
                             self._ser.timeout = 0.5
                             # read 15 byte key word
-                            ack = self._ser.read(15)
+                            success, ack = self.if_read(15)
                             # reduce timeout and read 15 byte again, make sure recv all key word
                             self._ser.timeout = 0.005
-                            ack += self._ser.read(15)
+                            ack += self.if_read(15)[1]
                             self._ser.timeout = tmp_timeout
                             bflb_utils.printf("read ready")
                             if ack.find(b'Boot2 ISP Ready') == -1:
@@ -598,39 +683,39 @@ class BflbUartPort(object):
                     cutoff_time = cutoff_time - 1000
                 # MP_TOOL_V3 generate rising pulse to make D trigger output low
                 # reset low
-                self._ser.setRTS(1)
+                self.if_set_rts(1)
                 # RC delay is 100ms
                 time.sleep(0.2)
                 # reset high
-                self._ser.setRTS(0)
+                self.if_set_rts(0)
                 time.sleep(0.05)
                 # do power off
                 # reset low
-                self._ser.setRTS(1)
+                self.if_set_rts(1)
                 if cutoff_revert:
                     # dtr high, power off
-                    self._ser.setDTR(0)
+                    self.if_set_dtr(0)
                 else:
                     # dtr low, power off
-                    self._ser.setDTR(1)
+                    self.if_set_dtr(1)
                 bflb_utils.printf("tx rx and power off, press the machine!")
                 bflb_utils.printf("cutoff time is ", cutoff_time / 1000.0)
                 time.sleep(cutoff_time / 1000.0)
                 if cutoff_revert:
                     # dtr low, power on
-                    self._ser.setDTR(1)
+                    self.if_set_dtr(1)
                 else:
                     # dtr high, power on
-                    self._ser.setDTR(0)
+                    self.if_set_dtr(0)
                 bflb_utils.printf("power on tx and rx ")
                 time.sleep(0.1)
             if do_reset is True and blusbserialwriteflag is not True:
                 # MP_TOOL_V3 reset high to make boot pin high
-                self._ser.setRTS(0)
+                self.if_set_rts(0)
                 time.sleep(0.2)
                 if reset_revert:
                     # reset low for reset revert to make boot pin high when cpu rset
-                    self._ser.setRTS(1)
+                    self.if_set_rts(1)
                     time.sleep(0.001)
                 reset_cnt = 2
                 if reset_hold_time > 1000:
@@ -639,19 +724,19 @@ class BflbUartPort(object):
                 while reset_cnt > 0:
                     if reset_revert:
                         # reset high
-                        self._ser.setRTS(0)
+                        self.if_set_rts(0)
                     else:
                         # reset low
-                        self._ser.setRTS(1)
+                        self.if_set_rts(1)
                     # Boot high
                     # self._ser.setDTR(0)
                     time.sleep(reset_hold_time / 1000.0)
                     if reset_revert:
                         # reset low
-                        self._ser.setRTS(1)
+                        self.if_set_rts(1)
                     else:
                         # reset high
-                        self._ser.setRTS(0)
+                        self.if_set_rts(0)
                     if shake_hand_delay > 0:
                         time.sleep(shake_hand_delay / 1000.0)
                     else:
@@ -659,19 +744,19 @@ class BflbUartPort(object):
                     # do reset agian to make sure boot pin is high
                     if reset_revert:
                         # reset high
-                        self._ser.setRTS(0)
+                        self.if_set_rts(0)
                     else:
                         # reset low
-                        self._ser.setRTS(1)
+                        self.if_set_rts(1)
                     # Boot high
                     # self._ser.setDTR(0)
                     time.sleep(reset_hold_time / 1000.0)
                     if reset_revert:
                         # reset low
-                        self._ser.setRTS(1)
+                        self.if_set_rts(1)
                     else:
                         # reset high
-                        self._ser.setRTS(0)
+                        self.if_set_rts(0)
                     if shake_hand_delay > 0:
                         time.sleep(shake_hand_delay / 1000.0)
                     else:
@@ -685,6 +770,7 @@ class BflbUartPort(object):
             # clean buffer before start
             bflb_utils.printf("clean buf")
             self._ser.timeout = 0.1
+            self._if_rx_clear()
             self._ser.read_all()
             self._ser.timeout = timeout
             return "OK"
@@ -692,9 +778,10 @@ class BflbUartPort(object):
             bflb_utils.printf("Error: %s" % e)
 
     def if_close(self):
+        self._if_rx_clear()
         if self._ser:
             try:
-                self._ser.setDTR(1)
+                self.if_set_dtr(1)
                 self._ser.close()
                 self._ser = None
             except Exception as e:
@@ -703,23 +790,24 @@ class BflbUartPort(object):
     # this function return str type
     def if_deal_ack(self, dmy_data=True):
         try:
-            success, ack = self.if_read(2)
+            # ack and err code are checked in place, no copy of receive buffer
+            success, ack = self.if_read_view(2)
             if success == 0:
                 bflb_utils.printf("ack is ", str(binascii.hexlify(ack)))
-                return ack.decode("utf-8")
-            if ack.find(b'\x4F') != -1 or ack.find(b'\x4B') != -1:
+                return bytes(ack).decode("utf-8")
+            if 0x4F in ack or 0x4B in ack:
                 # if dmy_data:
                 #    success, ack = self.if_read(14)
                 #    if success == 0:
                 #        return "FL"
                 return "OK"
-            elif ack.find(b'\x50') != -1 or ack.find(b'\x44') != -1:
+            elif 0x50 in ack or 0x44 in ack:
                 return "PD"
-            success, err_code = self.if_read(2)
+            success, err_code = self.if_read_view(2)
             if success == 0:
                 bflb_utils.printf("err code is ", str(binascii.hexlify(err_code)))
                 return "FL"
-            err_code_str = str(binascii.hexlify(err_code[1:2] + err_code[0:1]).decode('utf-8'))
+            err_code_str = "%02x%02x" % (err_code[1], err_code[0])
             ack = "FL"
             try:
                 ret = ack + err_code_str + \
@@ -731,19 +819,19 @@ class BflbUartPort(object):
         except Exception as e:
             bflb_utils.printf("Error: %s" % e)
 
-    # this function return bytearray or bytes type
+    # this function return memoryview of receive buffer, it is valid until next read or clear,
+    # same as if_read_view
     def if_deal_response(self):
         try:
             ack = self.if_deal_ack()
             if ack == "OK":
-                success, len_bytes = self.if_read(2)
+                success, len_bytes = self.if_read_view(2)
                 if success == 0:
                     bflb_utils.printf("Get length error")
                     bflb_utils.printf("len error is ", binascii.hexlify(len_bytes))
                     return "Get length error", len_bytes
-                tmp = bflb_utils.bytearray_reverse(len_bytes)
-                data_len = bflb_utils.bytearray_to_int(tmp)
-                success, data_bytes = self.if_read(data_len)
+                data_len = len_bytes[0] + (len_bytes[1] << 8)
+                success, data_bytes = self.if_read_view(data_len)
                 if success == 0 or len(data_bytes) != data_len:
                     bflb_utils.printf("Read data error,maybe not get excepted length")
                     # bflb_utils.printf("ack is ", str(binascii.hexlify(data_bytes)))
@@ -33,6 +33,8 @@ import datetime
 import hashlib
 import argparse
 import traceback
+import multiprocessing
+import concurrent.futures
 import platform
 import codecs
 from glob import glob
@@ -690,15 +692,43 @@ def img_create_sha256_data(data_bytearray):
     return hexstr_to_bytearray(hashfun.hexdigest())
 
 
+def aes_ctr_crypt_chunk(key, counter_value, data_view, output_view):
+    counter = Counter.new(128, initial_value=counter_value & ((1 << 128) - 1))
+    AES.new(bytes(key), AES.MODE_CTR, counter=counter).encrypt(data_view, output=output_view)
+
+
+def aes_ctr_crypt_data(data, key_bytearray, iv_bytearray, workers=None, chunk_size=0x400000):
+    # ctr encrypt and decrypt are the same, chunk at offset n starts from counter iv + n / 16,
+    # aes calls release the gil so chunks run on threads into one preallocated buffer
+    counter_value = int.from_bytes(iv_bytearray, "big")
+    data_view = memoryview(data).cast("B")
+    output = bytearray(len(data_view))
+    output_view = memoryview(output)
+    if len(data_view) <= chunk_size:
+        aes_ctr_crypt_chunk(key_bytearray, counter_value, data_view, output_view)
+        return output
+    chunk_size -= chunk_size % 16
+    if workers is None:
+        workers = os.cpu_count() or 1
+    with concurrent.futures.ThreadPoolExecutor(max(workers, 1)) as executor:
+        tasks = []
+        for offset in range(0, len(data_view), chunk_size):
+            tasks.append(
+                executor.submit(aes_ctr_crypt_chunk, key_bytearray, counter_value + offset // 16,
+                                data_view[offset:offset + chunk_size],
+                                output_view[offset:offset + chunk_size]))
+        for task in tasks:
+            task.result()
+    return output
+
+
 # encrypt image, mainly segdata
 def img_create_encrypt_data(data_bytearray, key_bytearray, iv_bytearray, flash_img):
     if flash_img == 0:
         cryptor = AES.new(key_bytearray, AES.MODE_CBC, iv_bytearray)
         ciphertext = cryptor.encrypt(data_bytearray)
     else:
-        iv = Counter.new(128, initial_value=int(binascii.hexlify(iv_bytearray), 16))
-        cryptor = AES.new(key_bytearray, AES.MODE_CTR, counter=iv)
-        ciphertext = cryptor.encrypt(data_bytearray)
+        ciphertext = aes_ctr_crypt_data(data_bytearray, key_bytearray, iv_bytearray)
     return ciphertext
 
 
@@ -707,12 +737,66 @@ def aes_decrypt_data(data, key_bytearray, iv_bytearray, flash_img):
         cryptor = AES.new(key_bytearray, AES.MODE_CBC, iv_bytearray)
         plaintext = cryptor.decrypt(data)
     else:
-        iv = Counter.new(128, initial_value=int(binascii.hexlify(iv_bytearray), 16))
-        cryptor = AES.new(key_bytearray, AES.MODE_CTR, counter=iv)
-        plaintext = cryptor.decrypt(data)
+        plaintext = aes_ctr_crypt_data(data, key_bytearray, iv_bytearray)
     return plaintext
 
 
+def aes_xts_encrypt_units(data, key1, key2, tweak_iv, unit_start=0):
+    # aes xts over 32 bytes data units, tweak is le32 unit number + 12 bytes iv,
+    # a trailing half unit of 16 bytes or more is encrypted as one block
+    units = len(data) // 32
+    blocks = units * 2
+    if len(data) % 32 >= 16:
+        units += 1
+        blocks += 1
+    if blocks == 0:
+        return bytes(0)
+    # all tweaks at once, byte j of every tweak is filled by one strided copy
+    unit_number = struct.pack("<%dI" % units, *range(unit_start, unit_start + units))
+    tweaks = bytearray(units * 16)
+    for j in range(4):
+        tweaks[j::16] = unit_number[j::4]
+    for j in range(12):
+        tweaks[4 + j::16] = bytes([tweak_iv[j]]) * units
+    t0 = AES.new(bytes(key2), AES.MODE_ECB).encrypt(bytes(tweaks))
+    # second block of each unit uses t0 * alpha in GF(2^128), done on all lanes as one integer
+    t0_int = int.from_bytes(t0, "little")
+    high_bits = t0_int & int.from_bytes((b"\x00" * 15 + b"\x80") * units, "little")
+    t1 = (((t0_int ^ high_bits) << 1) ^ ((high_bits >> 127) * 0x87)).to_bytes(units * 16, "little")
+    tweak_stream = bytearray(blocks * 16)
+    for j in range(16):
+        tweak_stream[j::32] = t0[j::16]
+        tweak_stream[16 + j::32] = t1[j:(blocks // 2) * 16:16]
+    tweak_int = int.from_bytes(tweak_stream, "little")
+    length = blocks * 16
+    plain = (int.from_bytes(data[:length], "little") ^ tweak_int).to_bytes(length, "little")
+    cipher = AES.new(bytes(key1), AES.MODE_ECB).encrypt(plain)
+    return (int.from_bytes(cipher, "little") ^ tweak_int).to_bytes(length, "little")
+
+
+def aes_xts_encrypt_data(data, key1, key2, tweak_iv, workers=1):
+    # big images are split by data unit index over worker processes
+    units = len(data) // 32
+    if workers <= 1 or units < workers * 0x4000:
+        return aes_xts_encrypt_units(data, key1, key2, tweak_iv)
+    step = (units + workers - 1) // workers
+    tasks = []
+    for unit_start in range(0, units, step):
+        unit_end = unit_start + step
+        if unit_end >= units:
+            unit_end = len(data)
+        else:
+            unit_end *= 32
+        tasks.append((bytes(data[unit_start * 32:unit_end]), bytes(key1), bytes(key2),
+                      bytes(tweak_iv), unit_start))
+    pool = multiprocessing.Pool(min(workers, len(tasks)))
+    try:
+        return b"".join(pool.starmap(aes_xts_encrypt_units, tasks))
+    finally:
+        pool.close()
+        pool.join()
+
+
 def open_file(file, mode='rb'):
     fp = open(os.path.join(app_path, file), mode)
     return fp
@@ -826,6 +910,24 @@ def serial_enumerate():
     return ports
 
 
+def get_serial_adapter_id(port):
+    # usb-serial adapter identity as vid:pid plus serial number, empty if unknown
+    try:
+        for p, d, h in comports():
+            if p != port:
+                continue
+            vidpid = re.search(r"VID:PID=([0-9A-Fa-f]{4}:[0-9A-Fa-f]{4})", h)
+            if vidpid is None:
+                return ""
+            ser = re.search(r"SER=(\S+)", h)
+            if ser is None:
+                return vidpid.group(1).upper()
+            return vidpid.group(1).upper() + "_" + ser.group(1)
+    except Exception:
+        pass
+    return ""
+
+
 def pylink_enumerate():
     try:
         if sys.platform == 'win32':
@@ -926,6 +1028,10 @@ def eflash_loader_parser_init():
     parser.add_argument("--mac", dest="mac", help="mac address to write")
     parser.add_argument("--file", dest="file", help="file to store read data or file to write")
     parser.add_argument("--skip", dest="skip", help="skip write file to flash")
+    parser.add_argument("--sparse",
+                        dest="sparse",
+                        action="store_true",
+                        help="read flash to sparse file without erased blocks")
     parser.add_argument("--packet", dest="packet", help=" import packet to replace burn file")
     parser.add_argument("--efusefile", dest="efusefile", help="efuse file to write efuse")
     parser.add_argument("--data", dest="data", help="data to write")
@@ -1,11 +1,11 @@
 # -*- coding:utf-8 -*-
 
-import hashlib
 import binascii
-import ecdsa
 from libs import bflb_utils
+from libs import bflb_ecdsa_sign
 from libs.bflb_utils import open_file, img_create_sha256_data, img_create_encrypt_data
 from libs.bflb_configobj import BFConfigParser
+from libs.bflb_flash_layout import FlashLayout
 from libs.bl602.bootheader_cfg_keys import bootheader_len as header_len
 
 keyslot0 = 28
@@ -209,16 +209,13 @@ def img_create_update_segheader(segheader, segdatalen, segdatacrc):
 
 # sign image(hash code)
 def img_create_sign_data(data_bytearray, privatekey_file_uecc, publickey_file):
-    sk = ecdsa.SigningKey.from_pem(open(privatekey_file_uecc).read())
-    vk = ecdsa.VerifyingKey.from_pem(open(publickey_file).read())
-    pk_data = vk.to_string()
-    bflb_utils.printf("Private key: ", binascii.hexlify(sk.to_string()))
+    signer = bflb_ecdsa_sign.get_ecdsa_signer(privatekey_file_uecc, publickey_file)
+    pk_data = signer.pk_data
+    bflb_utils.printf("Private key: ", binascii.hexlify(signer.sk.to_string()))
     bflb_utils.printf("Public key: ", binascii.hexlify(pk_data))
-    pk_hash = img_create_sha256_data(pk_data)
+    pk_hash = signer.pk_hash
     bflb_utils.printf("Public key hash=", binascii.hexlify(pk_hash))
-    signature = sk.sign(data_bytearray,
-                        hashfunc=hashlib.sha256,
-                        sigencode=ecdsa.util.sigencode_string)
+    signature = signer.sign(data_bytearray)
     bflb_utils.printf("Signature=", binascii.hexlify(signature))
     len_array = bflb_utils.int_to_4bytearray_l(len(signature))
     sig_field = len_array + signature
@@ -375,11 +372,10 @@ def create_encryptandsign_flash_data(data, offset, key, iv, publickey, privateke
     # write whole image
     bflb_utils.printf("Write flash img")
     bootinfo = bootheader_data + pk_data + signature + aesiv_data
-    output_data = bytearray(data_len)
-    for i in range(data_len):
-        output_data[i] = 0xff
-    output_data[0:len(bootinfo)] = bootinfo
-    output_data[offset:offset + seg_cnt] = fw_data
+    output_img = FlashLayout(data_len)
+    output_img.add(0, bootinfo, "bootinfo")
+    output_img.add(offset, fw_data, "fw")
+    output_data = output_img.to_bytearray()
     # update efuse
     if encrypt != 0:
         if encrypt_type == 1:
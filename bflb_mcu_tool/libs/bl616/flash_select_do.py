@@ -6,28 +6,15 @@ from re import I
 
 import config as gol
 from libs import bflb_utils
+from libs import bflb_flash_select
+from libs import bflb_cfg_layout
 from libs.bflb_utils import app_path, conf_sign
 from libs.bflb_configobj import BFConfigParser
 from libs.bl616.bootheader_cfg_keys import bootheader_cfg_keys as flash_cfg_keys
 
 
 def get_suitable_file_name(cfg_dir, flash_id):
-    conf_files = []
-    for home, dirs, files in os.walk(cfg_dir):
-        for filename in files:
-            if filename.split('_')[-1] == flash_id + '.conf':
-                conf_files.append(filename)
-
-    if len(conf_files) > 1:
-        bflb_utils.printf("Flash id duplicate and alternative is:")
-        for i in range(len(conf_files)):
-            tmp = conf_files[i].split('.')[0]
-            bflb_utils.printf("%d:%s" % (i + 1, tmp))
-        return conf_files[i]
-    elif len(conf_files) == 1:
-        return conf_files[0]
-    else:
-        return ""
+    return bflb_flash_select.get_suitable_conf_name(cfg_dir, flash_id)
 
 
 def update_flash_cfg_do(chipname, chiptype, flash_id, file=None, create=False, section=None):
@@ -67,39 +54,13 @@ def get_supported_flash_do():
     return flash_type
 
 
-def get_int_mask(pos, length):
-    ones = "1" * 32
-    zeros = "0" * 32
-    mask = ones[0:32 - pos - length] + zeros[0:length] + ones[0:pos]
-    return int(mask, 2)
-
-
 def create_flashcfg_data_from_cfg(cfg_len, cfgfile):
     section = "FLASH_CFG"
     cfg = BFConfigParser()
     cfg.read(cfgfile)
-    data = bytearray(cfg_len)
-    minOffset = int(flash_cfg_keys.get("io_mode")["offset"], 10)
-
-    for key in cfg.options(section):
-        if flash_cfg_keys.get(key) == None:
-            bflb_utils.printf(key + " not exist")
-            continue
-        # bflb_utils.printf(key)
-        val = cfg.get(section, key)
-        if val.startswith("0x"):
-            val = int(val, 16)
-        else:
-            val = int(val, 10)
-        # bflb_utils.printf(val)
-        offset = int(flash_cfg_keys.get(key)["offset"], 10) - minOffset
-        pos = int(flash_cfg_keys.get(key)["pos"], 10)
-        bitlen = int(flash_cfg_keys.get(key)["bitlen"], 10)
-
-        oldval = bflb_utils.bytearray_to_int(bflb_utils.bytearray_reverse(data[offset:offset + 4]))
-        newval = (oldval & get_int_mask(pos, bitlen)) + (val << pos)
-        # bflb_utils.printf(newval,binascii.hexlify(bflb_utils.int_to_4bytearray_l(newval)))
-        data[offset:offset + 4] = bflb_utils.int_to_4bytearray_l(newval)
+    layout = bflb_cfg_layout.get_cfg_layout(flash_cfg_keys)
+    minOffset = layout.fields["io_mode"][0]
+    data, data_mask = layout.pack(layout.cfg_values(cfg, section), cfg_len, minOffset)
     crcarray = bflb_utils.get_crc32_bytearray(data)
     data = bflb_utils.int_to_4bytearray_l(0x47464346) + data + crcarray
     return data
@@ -6,13 +6,14 @@ import hashlib
 import binascii
 import codecs
 
-import ecdsa
 
 from CryptoPlus.Cipher import AES as AES_XTS
 
 from libs import bflb_utils
+from libs import bflb_ecdsa_sign
 from libs.bflb_utils import img_create_sha256_data, img_create_encrypt_data
 from libs.bflb_configobj import BFConfigParser
+from libs.bflb_flash_layout import FlashLayout
 from libs.bl616.flash_select_do import create_flashcfg_table
 from libs.bl616.bootheader_cfg_keys import flashcfg_table_start_pos as flashcfg_table_start
 from libs.bl616.bootheader_cfg_keys import bootcpucfg_start_pos as bootcpucfg_start
@@ -300,13 +301,6 @@ def img_create_get_img_start_addr(bootheader_data):
 
 
 # get whole group img data
-def img_create_flash_default_data(length):
-    datas = bytearray(length)
-    for i in range(length):
-        datas[i] = 0xff
-    return datas
-
-
 def img_get_file_data(files):
     datas = []
     for file in files:
@@ -343,8 +337,7 @@ def img_get_one_group_img(d_addrs, d_files):
     whole_img_len, min = img_get_largest_addr(d_addrs, d_files)
     whole_img_len &= 0x3FFFFFF
     #bflb_utils.printf(whole_img_len)
-    whole_img_data = img_create_flash_default_data(whole_img_len)
-    filedatas = img_get_file_data(d_files)
+    whole_img = FlashLayout(whole_img_len)
     #create_whole_image_flash
     for i in range(len(d_addrs)):
         if d_files[i] == "UNUSED":
@@ -352,8 +345,8 @@ def img_get_one_group_img(d_addrs, d_files):
         start_addr = d_addrs[i]
         start_addr &= 0x3FFFFFF
         start_addr -= min
-        whole_img_data[start_addr:start_addr + len(filedatas[i])] = filedatas[i]
-    return whole_img_data
+        whole_img.add_file(start_addr, d_files[i])
+    return whole_img.to_bytearray()
 
 
 # get hash ignore ignore
@@ -461,58 +454,33 @@ def reverse_iv(need_reverse_iv_bytearray):
     return reverse_iv_bytearray
 
 
-def img_create_encrypt_data_xts(data_bytearray, key_bytearray, iv_bytearray, encrypt):
-    counter = binascii.hexlify(iv_bytearray[4:16]).decode()
-    # data unit number default value is 0
-    data_unit_number = 0
-
+def img_create_encrypt_data_xts(data_bytearray, key_bytearray, iv_bytearray, encrypt, workers=1):
     key = (key_bytearray[0:16], key_bytearray[16:32])
     if encrypt == 2 or encrypt == 3:
         key = (key_bytearray, key_bytearray)
-    # bflb_utils.printf(key)
-    cipher = AES_XTS.new(key, AES_XTS.MODE_XTS)
-    total_len = len(data_bytearray)
-    ciphertext = bytearray(0)
-    deal_len = 0
-
-    while deal_len < total_len:
-        data_unit_number = str(hex(data_unit_number)).replace("0x", "")
-        data_unit_number_to_str = str(data_unit_number)
-        right_justify_str = data_unit_number_to_str.rjust(8, '0')
-        reverse_data_unit_number_str = reverse_str_data_unit_number(right_justify_str)
-        tweak = reverse_data_unit_number_str + counter
-        tweak = bflb_utils.hexstr_to_bytearray("0" * (32 - len(tweak)) + tweak)
-        # bflb_utils.printf(tweak)
-        if 32 + deal_len <= total_len:
-            cur_block = data_bytearray[0 + deal_len:32 + deal_len]
-            # bflb_utils.printf(binascii.hexlify(cur_block))
-            ciphertext += cipher.encrypt(cur_block, tweak)
-        else:
-            cur_block = data_bytearray[0 + deal_len:16 + deal_len] + bytearray(16)
-            # bflb_utils.printf(binascii.hexlify(cur_block))
-            ciphertext += (cipher.encrypt(cur_block, tweak)[0:16])
-        deal_len += 32
-        data_unit_number = (int(data_unit_number, 16))
-        data_unit_number += 1
-
-    # bflb_utils.printf("Result:")
-    # bflb_utils.printf(binascii.hexlify(ciphertext))
-
+    # data unit number starts from 0, tweak is data unit number + iv[4:16]
+    ciphertext = bytearray(
+        bflb_utils.aes_xts_encrypt_data(data_bytearray, key[0], key[1], iv_bytearray[4:16],
+                                        workers))
+    deal_len = len(data_bytearray) // 32 * 32
+    if 0 < len(data_bytearray) - deal_len < 16:
+        # tail shorter than one block keeps xts ciphertext stealing
+        cipher = AES_XTS.new(key, AES_XTS.MODE_XTS)
+        tweak = bflb_utils.int_to_4bytearray_l(deal_len // 32) + iv_bytearray[4:16]
+        cur_block = data_bytearray[deal_len:deal_len + 16] + bytearray(16)
+        ciphertext += (cipher.encrypt(bytes(cur_block), bytes(tweak))[0:16])
     return ciphertext
 
 
 # sign image(hash code)
 def img_create_sign_data(data_bytearray, privatekey_file_uecc, publickey_file):
-    sk = ecdsa.SigningKey.from_pem(open(privatekey_file_uecc).read())
-    vk = ecdsa.VerifyingKey.from_pem(open(publickey_file).read())
-    pk_data = vk.to_string()
-    bflb_utils.printf("Private key: ", binascii.hexlify(sk.to_string()))
+    signer = bflb_ecdsa_sign.get_ecdsa_signer(privatekey_file_uecc, publickey_file)
+    pk_data = signer.pk_data
+    bflb_utils.printf("Private key: ", binascii.hexlify(signer.sk.to_string()))
     bflb_utils.printf("Public key: ", binascii.hexlify(pk_data))
-    pk_hash = img_create_sha256_data(pk_data)
+    pk_hash = signer.pk_hash
     bflb_utils.printf("Public key hash=", binascii.hexlify(pk_hash))
-    signature = sk.sign(data_bytearray,
-                        hashfunc=hashlib.sha256,
-                        sigencode=ecdsa.util.sigencode_string)
+    signature = signer.sign(data_bytearray)
     bflb_utils.printf("Signature=", binascii.hexlify(signature))
     # return len+signature+crc
     len_array = bflb_utils.int_to_4bytearray_l(len(signature))
@@ -4,27 +4,13 @@ import os
 
 import config as gol
 from libs import bflb_utils
+from libs import bflb_flash_select
 from libs.bflb_utils import app_path, conf_sign
 from libs.bflb_configobj import BFConfigParser
 
 
 def get_suitable_file_name(cfg_dir, flash_id):
-    conf_files = []
-    for home, dirs, files in os.walk(cfg_dir):
-        for filename in files:
-            if filename.split('_')[-1] == flash_id + '.conf':
-                conf_files.append(filename)
-
-    if len(conf_files) > 1:
-        bflb_utils.printf("Flash id duplicate and alternative is:")
-        for i in range(len(conf_files)):
-            tmp = conf_files[i].split('.')[0]
-            bflb_utils.printf("%d:%s" % (i + 1, tmp))
-        return conf_files[i]
-    elif len(conf_files) == 1:
-        return conf_files[0]
-    else:
-        return ""
+    return bflb_flash_select.get_suitable_conf_name(cfg_dir, flash_id)
 
 
 def update_flash_cfg_do(chipname, chiptype, flash_id, file=None, create=False, section=None):
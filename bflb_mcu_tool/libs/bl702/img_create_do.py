@@ -3,9 +3,9 @@
 import hashlib
 import binascii
 
-import ecdsa
 
 from libs import bflb_utils
+from libs import bflb_ecdsa_sign
 from libs.bflb_utils import img_create_sha256_data, img_create_encrypt_data
 from libs.bflb_configobj import BFConfigParser
 from libs.bl702.bootheader_cfg_keys import bootheader_len as header_len
@@ -207,16 +207,13 @@ def img_create_update_segheader(segheader, segdatalen, segdatacrc):
 
 # sign image(hash code)
 def img_create_sign_data(data_bytearray, privatekey_file_uecc, publickey_file):
-    sk = ecdsa.SigningKey.from_pem(open(privatekey_file_uecc).read())
-    vk = ecdsa.VerifyingKey.from_pem(open(publickey_file).read())
-    pk_data = vk.to_string()
-    bflb_utils.printf("Private key: ", binascii.hexlify(sk.to_string()))
+    signer = bflb_ecdsa_sign.get_ecdsa_signer(privatekey_file_uecc, publickey_file)
+    pk_data = signer.pk_data
+    bflb_utils.printf("Private key: ", binascii.hexlify(signer.sk.to_string()))
     bflb_utils.printf("Public key: ", binascii.hexlify(pk_data))
-    pk_hash = img_create_sha256_data(pk_data)
+    pk_hash = signer.pk_hash
     bflb_utils.printf("Public key hash=", binascii.hexlify(pk_hash))
-    signature = sk.sign(data_bytearray,
-                        hashfunc=hashlib.sha256,
-                        sigencode=ecdsa.util.sigencode_string)
+    signature = signer.sign(data_bytearray)
     bflb_utils.printf("Signature=", binascii.hexlify(signature))
     # return len+signature+crc
     len_array = bflb_utils.int_to_4bytearray_l(len(signature))
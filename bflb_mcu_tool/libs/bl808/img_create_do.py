@@ -5,14 +5,16 @@ import sys
 import hashlib
 import binascii
 import codecs
+import multiprocessing
 
-import ecdsa
 
 from CryptoPlus.Cipher import AES as AES_XTS
 
 from libs import bflb_utils
+from libs import bflb_ecdsa_sign
 from libs.bflb_utils import img_create_sha256_data, img_create_encrypt_data
 from libs.bflb_configobj import BFConfigParser
+from libs.bflb_flash_layout import FlashLayout
 from libs.bl808.flash_select_do import create_flashcfg_table
 from libs.bl808.bootheader_cfg_keys import flashcfg_table_start_pos as flashcfg_table_start
 from libs.bl808.bootheader_cfg_keys import bootcpucfg_start_pos as bootcpucfg_start
@@ -23,6 +25,9 @@ from libs.bl808.bootheader_cfg_keys import bootcpucfg_lp_index as bootcpucfg_lp_
 from libs.bl808.bootheader_cfg_keys import bootcfg_start_pos as bootcfg_start
 from libs.bl808.bootheader_cfg_keys import bootheader_len as header_len
 
+# groups are created in parallel when their segdata adds up to this
+img_create_parallel_len = 0x200000
+
 keyslot0 = 28
 keyslot1 = keyslot0 + 16
 keyslot2 = keyslot1 + 16
@@ -513,13 +518,6 @@ def img_create_get_img_start_addr(bootheader_data):
 
 
 # get whole group img data
-def img_create_flash_default_data(length):
-    datas = bytearray(length)
-    for i in range(length):
-        datas[i] = 0xff
-    return datas
-
-
 def img_get_file_data(files):
     datas = []
     for file in files:
@@ -556,8 +554,7 @@ def img_get_one_group_img(d_addrs, d_files):
     whole_img_len, min = img_get_largest_addr(d_addrs, d_files)
     whole_img_len &= 0x3FFFFFF
     #bflb_utils.printf(whole_img_len)
-    whole_img_data = img_create_flash_default_data(whole_img_len)
-    filedatas = img_get_file_data(d_files)
+    whole_img = FlashLayout(whole_img_len)
     #create_whole_image_flash
     for i in range(len(d_addrs)):
         if d_files[i] == "UNUSED":
@@ -565,8 +562,8 @@ def img_get_one_group_img(d_addrs, d_files):
         start_addr = d_addrs[i]
         start_addr &= 0x3FFFFFF
         start_addr -= min
-        whole_img_data[start_addr:start_addr + len(filedatas[i])] = filedatas[i]
-    return whole_img_data
+        whole_img.add_file(start_addr, d_files[i])
+    return whole_img.to_bytearray()
 
 
 # get hash ignore ignore
@@ -674,58 +671,33 @@ def reverse_iv(need_reverse_iv_bytearray):
     return reverse_iv_bytearray
 
 
-def img_create_encrypt_data_xts(data_bytearray, key_bytearray, iv_bytearray, encrypt):
-    counter = binascii.hexlify(iv_bytearray[4:16]).decode()
-    # data unit number default value is 0
-    data_unit_number = 0
-
+def img_create_encrypt_data_xts(data_bytearray, key_bytearray, iv_bytearray, encrypt, workers=1):
     key = (key_bytearray[0:16], key_bytearray[16:32])
     if encrypt == 2 or encrypt == 3:
         key = (key_bytearray, key_bytearray)
-    # bflb_utils.printf(key)
-    cipher = AES_XTS.new(key, AES_XTS.MODE_XTS)
-    total_len = len(data_bytearray)
-    ciphertext = bytearray(0)
-    deal_len = 0
-
-    while deal_len < total_len:
-        data_unit_number = str(hex(data_unit_number)).replace("0x", "")
-        data_unit_number_to_str = str(data_unit_number)
-        right_justify_str = data_unit_number_to_str.rjust(8, '0')
-        reverse_data_unit_number_str = reverse_str_data_unit_number(right_justify_str)
-        tweak = reverse_data_unit_number_str + counter
-        tweak = bflb_utils.hexstr_to_bytearray("0" * (32 - len(tweak)) + tweak)
-        # bflb_utils.printf(tweak)
-        if 32 + deal_len <= total_len:
-            cur_block = data_bytearray[0 + deal_len:32 + deal_len]
-            # bflb_utils.printf(binascii.hexlify(cur_block))
-            ciphertext += cipher.encrypt(cur_block, tweak)
-        else:
-            cur_block = data_bytearray[0 + deal_len:16 + deal_len] + bytearray(16)
-            # bflb_utils.printf(binascii.hexlify(cur_block))
-            ciphertext += (cipher.encrypt(cur_block, tweak)[0:16])
-        deal_len += 32
-        data_unit_number = (int(data_unit_number, 16))
-        data_unit_number += 1
-
-    # bflb_utils.printf("Result:")
-    # bflb_utils.printf(binascii.hexlify(ciphertext))
-
+    # data unit number starts from 0, tweak is data unit number + iv[4:16]
+    ciphertext = bytearray(
+        bflb_utils.aes_xts_encrypt_data(data_bytearray, key[0], key[1], iv_bytearray[4:16],
+                                        workers))
+    deal_len = len(data_bytearray) // 32 * 32
+    if 0 < len(data_bytearray) - deal_len < 16:
+        # tail shorter than one block keeps xts ciphertext stealing
+        cipher = AES_XTS.new(key, AES_XTS.MODE_XTS)
+        tweak = bflb_utils.int_to_4bytearray_l(deal_len // 32) + iv_bytearray[4:16]
+        cur_block = data_bytearray[deal_len:deal_len + 16] + bytearray(16)
+        ciphertext += (cipher.encrypt(bytes(cur_block), bytes(tweak))[0:16])
     return ciphertext
 
 
 # sign image(hash code)
 def img_create_sign_data(data_bytearray, privatekey_file_uecc, publickey_file):
-    sk = ecdsa.SigningKey.from_pem(open(privatekey_file_uecc).read())
-    vk = ecdsa.VerifyingKey.from_pem(open(publickey_file).read())
-    pk_data = vk.to_string()
-    bflb_utils.printf("Private key: ", binascii.hexlify(sk.to_string()))
+    signer = bflb_ecdsa_sign.get_ecdsa_signer(privatekey_file_uecc, publickey_file)
+    pk_data = signer.pk_data
+    bflb_utils.printf("Private key: ", binascii.hexlify(signer.sk.to_string()))
     bflb_utils.printf("Public key: ", binascii.hexlify(pk_data))
-    pk_hash = img_create_sha256_data(pk_data)
+    pk_hash = signer.pk_hash
     bflb_utils.printf("Public key hash=", binascii.hexlify(pk_hash))
-    signature = sk.sign(data_bytearray,
-                        hashfunc=hashlib.sha256,
-                        sigencode=ecdsa.util.sigencode_string)
+    signature = signer.sign(data_bytearray)
     bflb_utils.printf("Signature=", binascii.hexlify(signature))
     # return len+signature+crc
     len_array = bflb_utils.int_to_4bytearray_l(len(signature))
@@ -816,19 +788,59 @@ def encrypt_loader_bin_do(file, sign, encrypt, createcfg):
 
 
 def img_creat_process(group_type, flash_img, cfg, security=False):
+    ret, data_tohash, efuse_para = img_creat_process_data(group_type, flash_img, cfg)
+    if ret == "OK":
+        img_creat_process_efuse(group_type, cfg, efuse_para, security)
+    return ret, data_tohash
+
+
+def img_creat_process_efuse(group_type, cfg, efuse_para, security=False):
+    # groups share the efuse file, so efuse is updated in group order after data is created
+    if group_type == "group0":
+        img_update_efuse_group0(cfg, *efuse_para, security)
+    else:
+        img_update_efuse_group1(cfg, *efuse_para, security)
+
+
+def img_creat_process_worker(group_type, flash_img, config_file):
+    cfg = BFConfigParser()
+    cfg.read(config_file)
+    return img_creat_process_data(group_type, flash_img, cfg)
+
+
+def img_creat_process_groups(group_types, flash_img, cfg, config_file):
+    # groups are created in a process pool when there is enough data to pay for it
+    data_len = 0
+    for group_type in group_types:
+        cfg_section = "Img_" + group_type.capitalize() + "_Cfg"
+        if cfg.has_option(cfg_section, "segdata_file"):
+            for file in cfg.get(cfg_section, "segdata_file").split("|"):
+                if file and os.path.isfile(file):
+                    data_len += os.path.getsize(file)
+    if len(group_types) < 2 or (os.cpu_count() or 1) < 2 or data_len < img_create_parallel_len:
+        return [img_creat_process_data(group_type, flash_img, cfg) for group_type in group_types]
+    bflb_utils.printf("Create %s in parallel" % ", ".join(group_types))
+    pool = multiprocessing.Pool(len(group_types))
+    try:
+        return pool.starmap(img_creat_process_worker,
+                            [(group_type, flash_img, config_file) for group_type in group_types])
+    finally:
+        pool.close()
+        pool.join()
+
+
+def img_creat_process_data(group_type, flash_img, cfg):
     encrypt_blk_size = 16
     padding = bytearray(encrypt_blk_size)
     data_tohash = bytearray(0)
     cfg_section = ""
     if group_type == "group0":
-        img_update_efuse_fun = img_update_efuse_group0
         cfg_section = "Img_Group0_Cfg"
     elif group_type == "group1":
-        img_update_efuse_fun = img_update_efuse_group1
         cfg_section = "Img_Group1_Cfg"
     else:
         bflb_utils.printf("group type wrong")
-        return "FAIL", data_tohash
+        return "FAIL", data_tohash, None
     # get segdata to deal with
     segheader_file = []
     if flash_img == 0:
@@ -886,7 +898,7 @@ def img_creat_process(group_type, flash_img, cfg, security=False):
     segdata_cnt = len(segdata_file)
     if flash_img == 0 and seg_cnt != segdata_cnt:
         bflb_utils.printf("Segheader count and segdata count not match")
-        return "FAIL", data_tohash
+        return "FAIL", data_tohash, None
     data_toencrypt = bytearray(0)
     if flash_img == 0:
         i = 0
@@ -1008,12 +1020,10 @@ def img_creat_process(group_type, flash_img, cfg, security=False):
             if xts_mode == 1:
                 # AES XTS mode
                 flash_encrypt_type += 3
-            img_update_efuse_fun(cfg, sign, pk_hash, flash_encrypt_type, \
-                                 encrypt_key + bytearray(32 - len(encrypt_key)), \
-                                 key_sel, None, security)
+            efuse_para = (sign, pk_hash, flash_encrypt_type,
+                          encrypt_key + bytearray(32 - len(encrypt_key)), key_sel, None)
         else:
-            img_update_efuse_fun(cfg, sign, pk_hash, encrypt, None, \
-                                 key_sel, None, security)
+            efuse_para = (sign, pk_hash, encrypt, None, key_sel, None)
     else:
         bflb_utils.printf("Write if img")
         whole_img_file_name = cfg.get(cfg_section, "whole_img_file")
@@ -1036,13 +1046,11 @@ def img_creat_process(group_type, flash_img, cfg, security=False):
             if xts_mode == 1:
                 # AES XTS mode
                 if_encrypt_type += 3
-            img_update_efuse_fun(cfg, sign, pk_hash, if_encrypt_type, None, \
-                                 key_sel, \
-                                 encrypt_key + bytearray(32 - len(encrypt_key)), security)
+            efuse_para = (sign, pk_hash, if_encrypt_type, None, key_sel,
+                          encrypt_key + bytearray(32 - len(encrypt_key)))
         else:
-            img_update_efuse_fun(cfg, sign, pk_hash, 0, None, \
-                                 key_sel, bytearray(32), security)
-    return "OK", data_tohash
+            efuse_para = (sign, pk_hash, 0, None, key_sel, bytearray(32))
+    return "OK", data_tohash, efuse_para
 
 
 def img_create_do(args, img_dir_path=None, config_file=None):
@@ -1082,8 +1090,12 @@ def img_create_do(args, img_dir_path=None, config_file=None):
     elif group_type == "group1":
         ret1, data_tohash1 = img_creat_process("group1", flash_img, cfg, security)
     elif group_type == "all":
-        ret0, data_tohash0 = img_creat_process("group0", flash_img, cfg, False)
-        ret1, data_tohash1 = img_creat_process("group1", flash_img, cfg, security)
+        (ret0, data_tohash0, efuse_para0), (ret1, data_tohash1, efuse_para1) = \
+            img_creat_process_groups(["group0", "group1"], flash_img, cfg, config_file)
+        if ret0 == "OK":
+            img_creat_process_efuse("group0", cfg, efuse_para0, False)
+        if ret1 == "OK":
+            img_creat_process_efuse("group1", cfg, efuse_para1, security)
     else:
         img_creat_process("", flash_img, cfg, security)
 
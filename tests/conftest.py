@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+# modules import each other as "libs.xxx" and "core.xxx", like the tool does when run
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "bflb_mcu_tool"))
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+from libs import bflb_build_cache
+
+
+def stage_run(tmp_path, values, input_files, runs):
+    out_dir = str(tmp_path / "out")
+
+    def build():
+        runs.append(1)
+        if not os.path.isdir(out_dir):
+            os.makedirs(out_dir)
+        with open(os.path.join(out_dir, "img.bin"), "wb") as fp:
+            fp.write(b"img")
+        return True
+
+    return bflb_build_cache.build_stage_run(str(tmp_path / "manifest.json"), "create_img", values,
+                                            {}, input_files, [out_dir], build)
+
+
+def test_skip_until_output_changes(tmp_path, capsys):
+    runs = []
+    assert stage_run(tmp_path, {"a": "1"}, [], runs) is True
+    assert "up to date" not in capsys.readouterr().out
+    assert stage_run(tmp_path, {"a": "1"}, [], runs) is True
+    assert "create_img is up to date, skip" in capsys.readouterr().out
+    assert len(runs) == 1
+    os.remove(str(tmp_path / "out" / "img.bin"))
+    assert stage_run(tmp_path, {"a": "1"}, [], runs) is True
+    assert "up to date" not in capsys.readouterr().out
+    assert len(runs) == 2
+
+
+def test_rewrite_with_same_stat_is_recorded(tmp_path):
+    out_dir = str(tmp_path / "out")
+    os.makedirs(out_dir)
+    for name in ("img.bin", "other.bin"):
+        with open(os.path.join(out_dir, name), "wb") as fp:
+            fp.write(b"img")
+    # other.bin is left from long ago by someone else
+    os.utime(os.path.join(out_dir, "other.bin"), (1000000000, 1000000000))
+    img_stat = os.stat(os.path.join(out_dir, "img.bin"))
+
+    def build():
+        # same size and mtime, as a coarse mtime shows a quick rewrite
+        with open(os.path.join(out_dir, "img.bin"), "wb") as fp:
+            fp.write(b"img")
+        os.utime(os.path.join(out_dir, "img.bin"), ns=(img_stat.st_atime_ns, img_stat.st_mtime_ns))
+        return True
+
+    assert bflb_build_cache.build_stage_run(str(tmp_path / "manifest.json"), "create_img", {}, {},
+                                            [], [out_dir], build) is True
+    manifest = bflb_build_cache.build_manifest_load(str(tmp_path / "manifest.json"))
+    outputs = manifest["create_img"]["outputs"]
+    assert list(outputs) == [bflb_build_cache.build_path(os.path.join(out_dir, "img.bin"))]
+
+
+def test_relative_value_paths_depend_on_cwd(tmp_path, monkeypatch):
+    runs = []
+    for name in ("a", "b"):
+        os.makedirs(str(tmp_path / name))
+    # an output path given by values is not an input file
+    monkeypatch.chdir(str(tmp_path / "a"))
+    assert stage_run(tmp_path, {"img_file": "img/fw.bin"}, [], runs) is True
+    assert stage_run(tmp_path, {"img_file": "img/fw.bin"}, [], runs) is True
+    assert len(runs) == 1
+    monkeypatch.chdir(str(tmp_path / "b"))
+    assert stage_run(tmp_path, {"img_file": "img/fw.bin"}, [], runs) is True
+    assert len(runs) == 2
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+import random
+
+from libs.bflb_cfg_layout import CfgLayout, get_cfg_layout
+from libs.bl616.bootheader_cfg_keys import bootheader_cfg_keys
+from libs.bl616.efuse_cfg_keys import efuse_cfg_keys
+
+
+def field_value(data, field):
+    offset = int(field["offset"], 10)
+    pos = int(field["pos"], 10)
+    bitlen = int(field["bitlen"], 10)
+    word = int.from_bytes(data[offset:offset + 4], "little")
+    return (word >> pos) & ((1 << bitlen) - 1)
+
+
+def test_unpack_matches_fields():
+    rand = random.Random(1)
+    layout = CfgLayout(bootheader_cfg_keys)
+    data = bytearray(rand.getrandbits(8) for i in range(layout.length))
+    fields = layout.unpack(data)
+    for key, field in bootheader_cfg_keys.items():
+        assert fields[key] == field_value(data, field)
+
+
+def test_pack_unpack_round_trip():
+    rand = random.Random(2)
+    for config_keys in (bootheader_cfg_keys, efuse_cfg_keys):
+        layout = get_cfg_layout(config_keys)
+        assert get_cfg_layout(config_keys) is layout
+        data = bytearray(rand.getrandbits(8) for i in range(layout.length))
+        fields = layout.unpack(data)
+        packed, mask = layout.pack(list(fields.items()))
+        assert layout.unpack(packed) == fields
+        for i in range(len(packed)):
+            assert packed[i] & mask[i] == data[i] & mask[i]
+
+
+def test_pack_with_base():
+    layout = CfgLayout(bootheader_cfg_keys)
+    key, field = list(bootheader_cfg_keys.items())[-1]
+    offset = int(field["offset"], 10)
+    data, mask = layout.pack([(key, 1)], length=4, base=offset)
+    assert layout.unpack(data, offset)[key] == 1
+    assert int.from_bytes(mask, "little") & (1 << int(field["pos"], 10))
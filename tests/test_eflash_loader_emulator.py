@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+import os
+import random
+import shutil
+
+import pytest
+
+from libs import bflb_utils
+from libs import bflb_eflash_loader
+from libs import bflb_flash_select
+from libs import bflb_interface_emulator
+from libs.bflb_configobj import BFConfigParser
+from libs.bflb_utils import app_path
+
+chip_cfg = os.path.join(app_path, "chips", "bl616", "eflash_loader", "eflash_loader_cfg.conf")
+
+
+def firmware_data(length, seed=1):
+    # half random, half repeated text, so both write and decompress write are used
+    rand = random.Random(seed)
+    data = bytearray(rand.getrandbits(8) for i in range(length // 2))
+    text = b"bouffalolab flash image "
+    data += (text * (length // len(text) + 1))[:length - len(data)]
+    return data
+
+
+@pytest.fixture
+def emulator(tmp_path, monkeypatch, request):
+    # emulated bl616 on a uart port of its own, chip files are copied to tmp_path
+    monkeypatch.setattr(bflb_eflash_loader, "chip_path", str(tmp_path))
+    monkeypatch.setattr(bflb_eflash_loader, "flash_xz_cache_dir", str(tmp_path / "xz_cache"))
+    monkeypatch.setattr(bflb_flash_select, "flash_conf_index_file",
+                        str(tmp_path / "flash_conf_index.json"))
+    shutil.copytree(os.path.join(app_path, "chips", "bl616"), os.path.join(str(tmp_path), "bl616"))
+    name = "emulator_" + request.node.name
+    device = bflb_interface_emulator.add_emulator_device(
+        name, bflb_interface_emulator.BflbEmulatorDevice("bl616"))
+    yield name, device
+    bflb_interface_emulator.emulator_devices.pop(name.lower(), None)
+
+
+def program(tmp_path, port, files, options={}):
+    cfg = BFConfigParser()
+    cfg.read(chip_cfg)
+    cfg.set("LOAD_CFG", "device", port)
+    cfg.set("LOAD_CFG", "clock_para", str(tmp_path / "clock_para.bin"))
+    cfg.set("FLASH_CFG", "flash_para", str(tmp_path / "flash_para.bin"))
+    cfg.set("FLASH_CFG", "decompress_write", "false")
+    cfg.set("LOAD_CFG", "verify_repair", "0")
+    cfg.set("FLASH_CFG", "file", " ".join(file for file, addr in files))
+    cfg.set("FLASH_CFG", "address", " ".join("%08X" % addr for file, addr in files))
+    for (section, option), value in options.items():
+        cfg.set(section, option, value)
+    cfg_file = str(tmp_path / "eflash_loader_cfg.ini")
+    cfg.write(cfg_file, "w+")
+    args = bflb_utils.eflash_loader_parser_init().parse_args(["--write", "--flash", "-c", cfg_file])
+    eflash_loader_t = bflb_eflash_loader.BflbEflashLoader("bl616", "bl616")
+    return eflash_loader_t.efuse_flash_loader(args, None, None)
+
+
+def write_file(tmp_path, name, data):
+    file = str(tmp_path / name)
+    with open(file, "wb") as fp:
+        fp.write(data)
+    return file
+
+
+def test_program(tmp_path, emulator):
+    port, device = emulator
+    data = firmware_data(0x30000)
+    file = write_file(tmp_path, "fw.bin", data)
+    assert program(tmp_path, port, [(file, 0x10000)]) is True
+    assert device.get_flash_data(0x10000, len(data)) == data
+    assert device.get_flash_data(0x10000 + len(data), 0x100) == b"\xff" * 0x100
+
+
+def test_program_decompress_write(tmp_path, emulator):
+    port, device = emulator
+    data = firmware_data(0x30000)
+    file = write_file(tmp_path, "fw.bin", data)
+    assert program(tmp_path, port, [(file, 0x10000)],
+                   {("FLASH_CFG", "decompress_write"): "true"}) is True
+    assert device.get_flash_data(0x10000, len(data)) == data
+
+
+def test_window_write_with_errors(tmp_path, emulator):
+    port, device = emulator
+    device.set_error(rate=0.05, cmds=[0x31], seed=1)
+    data = firmware_data(0x40000, 2)
+    file = write_file(tmp_path, "fw.bin", data)
+    assert program(tmp_path, port, [(file, 0x20000)], {
+        ("LOAD_CFG", "flash_write_window"): "4",
+        ("LOAD_CFG", "flash_burn_retry"): "3"
+    }) is True
+    assert device.stats["errors"] > 0
+    assert device.get_flash_data(0x20000, len(data)) == data
+
+
+def test_delta_write(tmp_path, emulator):
+    port, device = emulator
+    data = firmware_data(0x40000, 3)
+    file = write_file(tmp_path, "fw.bin", data)
+    options = {("FLASH_CFG", "delta_write"): "true"}
+    assert program(tmp_path, port, [(file, 0)], options) is True
+    data[0x12345:0x12355] = b"0123456789abcdef"
+    data[0x30000:0x31000] = bytes(0x1000)
+    write_file(tmp_path, "fw.bin", data)
+    device.stats_clear()
+    assert program(tmp_path, port, [(file, 0)], options) is True
+    assert device.get_flash_data(0, len(data)) == data
+    # only the two changed sectors are erased again
+    assert device.stats["erase_bytes"] == 0x2000
+
+
+def test_session_resume(tmp_path, emulator):
+    port, device = emulator
+    fail = [True]
+
+    def hook(cmd_id, payload):
+        # writes of one sector fail in the first session
+        addr = int.from_bytes(bytes(payload[0:4]), "little")
+        if cmd_id == 0x31 and 0x32000 <= addr < 0x33000 and fail[0]:
+            return 0x0103
+        return None
+
+    device.set_error(hook=hook)
+    data = firmware_data(0x40000, 4)
+    file = write_file(tmp_path, "fw.bin", data)
+    options = {("FLASH_CFG", "session_resume"): "true"}
+    assert program(tmp_path, port, [(file, 0)], options) is not True
+    fail[0] = False
+    device.stats_clear()
+    assert program(tmp_path, port, [(file, 0)], options) is True
+    assert device.get_flash_data(0, len(data)) == data
+    # second session starts at last checkpoint instead of flash start
+    assert device.stats["rx_bytes"] < len(data) // 2
+
+
+def test_verify_repair(tmp_path, emulator):
+    port, device = emulator
+    done = [False]
+
+    def hook(cmd_id, payload):
+        # corrupt one byte silently once the image is written
+        if cmd_id == 0x3A and not done[0] and device.get_flash_data(0x2000, 4) != b"\xff" * 4:
+            done[0] = True
+            device._flash[0x20123] ^= 0x5A
+        return None
+
+    device.set_error(hook=hook)
+    data = firmware_data(0x30000, 5)
+    file = write_file(tmp_path, "fw.bin", data)
+    assert program(tmp_path, port, [(file, 0x2000)], {
+        ("LOAD_CFG", "verify"): "1",
+        ("LOAD_CFG", "verify_repair"): "2"
+    }) is True
+    assert done[0]
+    assert device.get_flash_data(0x2000, len(data)) == data
+
+
+def test_rf_para_short_image(tmp_path, emulator):
+    # rf para in flash replaces 0x1000-0x1FFF of an image shorter than 0x2000
+    port, device = emulator
+    rf_para = b"BLRF" + bytes(range(256)) * 15 + bytes(0x100 - 4)
+    device.set_flash_data(0x1000, rf_para)
+    data = firmware_data(0x1800, 6)
+    file = write_file(tmp_path, "fw.bin", data)
+    assert program(tmp_path, port, [(file, 0)]) is True
+    assert device.get_flash_data(0, 0x1000) == data[:0x1000]
+    assert device.get_flash_data(0x1000, 0x1000) == rf_para
+
+
+def test_delta_write_decides_xz_once(tmp_path, emulator, monkeypatch):
+    port, device = emulator
+    checks = []
+    xz_check = bflb_eflash_loader.BflbEflashLoader.flash_load_xz_check
+
+    def counted(self, data):
+        checks.append(len(data))
+        return xz_check(self, data)
+
+    monkeypatch.setattr(bflb_eflash_loader.BflbEflashLoader, "flash_load_xz_check", counted)
+    data = firmware_data(0x40000, 7)
+    file = write_file(tmp_path, "fw.bin", data)
+    options = {("FLASH_CFG", "delta_write"): "true", ("FLASH_CFG", "decompress_write"): "true"}
+    assert program(tmp_path, port, [(file, 0)], options) is True
+    data[0x1000:0x3000] = bytes(0x2000)
+    data[0x30000:0x38000] = b"\x5a" * 0x8000
+    write_file(tmp_path, "fw.bin", data)
+    del checks[:]
+    assert program(tmp_path, port, [(file, 0)], options) is True
+    assert device.get_flash_data(0, len(data)) == data
+    # one trial compress of whole image, none for its delta runs
+    assert checks == [len(data)]
+    # xz cache dir holds whole images of both runs, not delta runs
+    assert len(os.listdir(str(tmp_path / "xz_cache"))) == 2
+
+
+def test_window_write_log(tmp_path, emulator, capsys):
+    port, device = emulator
+    data = firmware_data(0x2800, 8)
+    file = write_file(tmp_path, "fw.bin", data)
+    assert program(tmp_path, port, [(file, 0x20000)], {("LOAD_CFG", "flash_write_window"): "4"})
+    out = capsys.readouterr().out
+    # one line per frame, last one once
+    loads = [line.split(" - ")[-1] for line in out.splitlines() if " - Load " in line]
+    assert loads == ["Load 2048/10240 {\"progress\":20}", "Load 4096/10240 {\"progress\":40}",
+                     "Load 6144/10240 {\"progress\":60}", "Load 8192/10240 {\"progress\":80}",
+                     "Load 10240/10240 {\"progress\":100}"]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from libs import bflb_eflash_loader
+
+
+@pytest.fixture
+def loader():
+    return bflb_eflash_loader.BflbEflashLoader("bl616", "bl616")
+
+
+def test_plan_merges_sectors(loader):
+    ranges = [(0x10000, 0x1800), (0x11800, 0x100), (0x20000, 0x10)]
+    assert loader.flash_erase_plan(ranges, 1) == [[0x10000, 0x12000], [0x20000, 0x21000]]
+
+
+@pytest.mark.parametrize("name, value", [("_delta_write", True),
+                                         ("_session_journal_file", "journal.ini"),
+                                         ("_flash2_en", True), ("_skip_len", 1),
+                                         ("_isp_en", True)])
+def test_plan_excluded_modes(loader, name, value):
+    ranges = [(0x10000, 0x1000), (0x20000, 0x1000)]
+    setattr(loader, name, value)
+    assert loader.flash_erase_plan(ranges, 1) == []
+
+
+def test_plan_excluded_erase_and_rf_para(loader):
+    ranges = [(0x10000, 0x1000), (0x20000, 0x1000)]
+    assert loader.flash_erase_plan(ranges, 2) == []
+    assert loader.flash_erase_plan(ranges[:1], 1) == []
+    assert loader.flash_erase_plan([(0, 0x2000), (0x20000, 0x1000)], 1) == []
+    loader._chip_type = "bl602"
+    assert loader.flash_erase_plan([(0, 0x2000), (0x20000, 0x1000)], 1) == [[0, 0x2000],
+                                                                            [0x20000, 0x21000]]
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+from libs.bflb_flash_image import FlashImage
+
+
+def test_slice_shares_buffer():
+    data = bytearray(range(256)) * 16
+    image = FlashImage(0x2000, data, "img")
+    piece = image.slice(0x2100, 0x2200)
+    assert piece.addr == 0x2100
+    assert bytes(piece.data) == bytes(data[0x100:0x200])
+    data[0x100] = 0x55
+    assert piece.data[0] == 0x55
+
+
+def test_split_and_skip():
+    image = FlashImage(0x1000, bytes(0x3000))
+    head, tail = image.split(0x2000)
+    assert (head.addr, len(head)) == (0x1000, 0x1000)
+    assert (tail.addr, len(tail)) == (0x2000, 0x2000)
+    pieces = image.skip([(0x1800, 0x800), (0x3000, 0x100)])
+    assert [(piece.addr, len(piece)) for piece in pieces] == [(0x1000, 0x800), (0x2000, 0x1000),
+                                                              (0x3100, 0xF00)]
+
+
+def test_patch_copies_source():
+    data = bytes(0x3000)
+    image = FlashImage(0, data)
+    image.patch(0x1000, b"\x11" * 0x1000)
+    assert bytes(image.data[0x1000:0x2000]) == b"\x11" * 0x1000
+    assert data == bytes(0x3000)
+
+
+def test_patch_short_image_grows():
+    # rf para patch of an image shorter than 0x2000
+    image = FlashImage(0, b"\x22" * 0x1800)
+    image.patch(0x1000, b"\x33" * 0x1000)
+    assert len(image) == 0x2000
+    assert image.end == 0x2000
+    assert bytes(image.data) == b"\x22" * 0x1000 + b"\x33" * 0x1000
+
+
+def test_patch_past_end_fills_erased():
+    image = FlashImage(0x1000, b"\x44" * 0x10)
+    image.patch(0x1020, b"\x55" * 0x10)
+    assert bytes(image.data) == b"\x44" * 0x10 + b"\xff" * 0x10 + b"\x55" * 0x10
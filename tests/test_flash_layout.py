@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+import io
+
+from libs.bflb_flash_layout import FlashLayout
+
+
+def test_layout_fills_gaps():
+    layout = FlashLayout()
+    layout.add(0x1000, b"\x11" * 0x100, "a")
+    layout.add(0x3000, b"\x22" * 0x10, "b")
+    data = layout.to_bytearray()
+    assert len(data) == 0x3010
+    assert data[0:0x1000] == b"\xff" * 0x1000
+    assert data[0x1000:0x1100] == b"\x11" * 0x100
+    assert data[0x1100:0x3000] == b"\xff" * 0x1F00
+    fp = io.BytesIO()
+    layout.write(fp)
+    assert fp.getvalue() == data
+
+
+def test_layout_later_extent_wins():
+    layout = FlashLayout(0x4000)
+    layout.add(0, b"\x11" * 0x2000, "a")
+    layout.add(0x1000, b"\x22" * 0x800, "b")
+    data = layout.to_bytearray()
+    assert len(data) == 0x4000
+    assert data[0:0x1000] == b"\x11" * 0x1000
+    assert data[0x1000:0x1800] == b"\x22" * 0x800
+    assert data[0x1800:0x2000] == b"\x11" * 0x800
+    assert data[0x2000:] == b"\xff" * 0x2000
+
+
+def test_layout_map_file(tmp_path):
+    file = str(tmp_path / "img.bin")
+    with open(file, "wb") as fp:
+        fp.write(bytes(range(256)) * 4)
+    layout = FlashLayout()
+    layout.add(0x100, layout.map_file(file), "img")
+    out_file = str(tmp_path / "out.bin")
+    layout.save(out_file)
+    layout.close()
+    with open(out_file, "rb") as fp:
+        assert fp.read() == b"\xff" * 0x100 + bytes(range(256)) * 4
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+import os
+import glob
+import shutil
+
+import pytest
+
+from libs import bflb_flash_select
+from libs.bflb_utils import app_path
+from libs.bl616.bootheader_cfg_keys import bootheader_cfg_keys
+
+flash_cfg_dir = os.path.join(app_path, "utils", "flash", "bl616")
+
+
+@pytest.fixture
+def conf_dir(tmp_path, monkeypatch):
+    # copy of bl616 flash confs, index kept in tmp_path instead of user cache dir
+    monkeypatch.setattr(bflb_flash_select, "flash_conf_index", {})
+    monkeypatch.setattr(bflb_flash_select, "flash_conf_index_file",
+                        str(tmp_path / "cache" / "flash_conf_index.json"))
+    cfg_dir = str(tmp_path / "bl616")
+    shutil.copytree(flash_cfg_dir, cfg_dir)
+    return cfg_dir
+
+
+def test_index_in_cache_dir(conf_dir, tmp_path):
+    assert bflb_flash_select.get_suitable_conf_name(conf_dir, "ef4016").endswith("_ef4016.conf")
+    assert os.path.isfile(str(tmp_path / "cache" / "flash_conf_index.json"))
+    assert not os.path.exists(os.path.join(app_path, "utils", "flash", "flash_conf_index.json"))
+    # a new process reads names back from index file
+    bflb_flash_select.flash_conf_index.clear()
+    assert bflb_flash_select.get_suitable_conf_name(conf_dir, "ef4016").endswith("_ef4016.conf")
+    assert bflb_flash_select.get_suitable_conf_name(conf_dir, "123456") == ""
+
+
+def test_index_in_memory_when_cache_not_writable(conf_dir, tmp_path, monkeypatch):
+    with open(str(tmp_path / "file"), "w") as fp:
+        fp.write("")
+    monkeypatch.setattr(bflb_flash_select, "flash_conf_index_file",
+                        str(tmp_path / "file" / "flash_conf_index.json"))
+    assert bflb_flash_select.get_suitable_conf_name(conf_dir, "ef4016").endswith("_ef4016.conf")
+    assert bflb_flash_select.flash_conf_index_file == ""
+    assert bflb_flash_select.get_suitable_conf_name(conf_dir, "ef4016").endswith("_ef4016.conf")
+
+
+def test_duplicate_flash_id_uses_last_in_dir_order(conf_dir):
+    conf_file = glob.glob(os.path.join(conf_dir, "*_ef4016.conf"))[0]
+    shutil.copy(conf_file, os.path.join(conf_dir, "AAA_ef4016.conf"))
+    names = [name for name in os.listdir(conf_dir) if name.endswith("_ef4016.conf")]
+    assert bflb_flash_select.get_suitable_conf_name(conf_dir, "ef4016") == names[-1]
+
+
+def test_para_follows_conf_edit(conf_dir):
+    conf_file = glob.glob(os.path.join(conf_dir, "*_ef4016.conf"))[0]
+    para = bflb_flash_select.update_flash_para_from_cfg(bootheader_cfg_keys, conf_file)
+    assert bflb_flash_select.update_flash_para_from_cfg(bootheader_cfg_keys,
+                                                        conf_file)[2] == para[2]
+    # edit in place, dir mtime does not change
+    dir_stat = os.stat(conf_dir)
+    conf_stat = os.stat(conf_file)
+    with open(conf_file, "r") as fp:
+        conf = fp.read()
+    with open(conf_file, "w") as fp:
+        fp.write(conf.replace("write_enable_cmd = 0x06", "write_enable_cmd = 0x07"))
+    os.utime(conf_file, ns=(conf_stat.st_atime_ns, conf_stat.st_mtime_ns + 1000000000))
+    os.utime(conf_dir, ns=(dir_stat.st_atime_ns, dir_stat.st_mtime_ns))
+    new_para = bflb_flash_select.update_flash_para_from_cfg(bootheader_cfg_keys, conf_file)
+    assert new_para[2] != para[2]
+    assert new_para[2] == bflb_flash_select.create_flash_para_from_cfg(bootheader_cfg_keys,
+                                                                       conf_file)[2]
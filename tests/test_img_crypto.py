@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+import binascii
+import random
+
+import pytest
+from Crypto.Cipher import AES
+from Crypto.Util import Counter
+
+from libs import bflb_utils
+from libs.bl616 import img_create_do as bl616_img_create_do
+from libs.bl808 import img_create_do as bl808_img_create_do
+
+AES_XTS = pytest.importorskip("CryptoPlus.Cipher.AES")
+
+
+def random_bytes(length, seed):
+    rand = random.Random(seed)
+    return bytearray(rand.getrandbits(length * 8).to_bytes(length, "little"))
+
+
+def xts_reference(data, key_bytearray, iv_bytearray, encrypt):
+    # one CryptoPlus call per 32 bytes data unit, as images were encrypted before
+    counter = binascii.hexlify(iv_bytearray[4:16]).decode()
+    key = (key_bytearray[0:16], key_bytearray[16:32])
+    if encrypt == 2 or encrypt == 3:
+        key = (key_bytearray, key_bytearray)
+    cipher = AES_XTS.new(key, AES_XTS.MODE_XTS)
+    ciphertext = bytearray(0)
+    for unit, deal_len in enumerate(range(0, len(data), 32)):
+        unit_str = "%08x" % unit
+        tweak = unit_str[6:8] + unit_str[4:6] + unit_str[2:4] + unit_str[0:2] + counter
+        tweak = bflb_utils.hexstr_to_bytearray("0" * (32 - len(tweak)) + tweak)
+        if 32 + deal_len <= len(data):
+            ciphertext += cipher.encrypt(data[deal_len:deal_len + 32], tweak)
+        else:
+            cur_block = data[deal_len:deal_len + 16] + bytearray(16)
+            ciphertext += cipher.encrypt(cur_block, tweak)[0:16]
+    return ciphertext
+
+
+@pytest.mark.parametrize("length", [32, 48, 0x1000, 0x1010])
+@pytest.mark.parametrize("encrypt", [1, 2])
+def test_xts_matches_reference(length, encrypt):
+    data = random_bytes(length, length)
+    key = random_bytes(32 if encrypt == 1 else 16, 1)
+    iv = random_bytes(16, 2)
+    expected = xts_reference(data, key, iv, encrypt)
+    for img_create_do in (bl616_img_create_do, bl808_img_create_do):
+        assert img_create_do.img_create_encrypt_data_xts(data, key, iv, encrypt) == expected
+
+
+def test_xts_workers_match_single():
+    data = random_bytes(0x100010, 3)
+    key = random_bytes(32, 4)
+    iv = random_bytes(16, 5)
+    single = bflb_utils.aes_xts_encrypt_data(data, key[0:16], key[16:32], iv[4:16])
+    assert bflb_utils.aes_xts_encrypt_data(data, key[0:16], key[16:32], iv[4:16],
+                                           workers=2) == single
+
+
+@pytest.mark.parametrize("length", [16, 0x1000, 0x10010])
+def test_ctr_matches_reference(length):
+    data = random_bytes(length, 6)
+    key = random_bytes(16, 7)
+    # counter near 2^64 so chunks carry into the high half
+    iv = bytearray(8) + bytearray(b"\xff" * 7) + bytearray(b"\xf0")
+    counter = Counter.new(128, initial_value=int(binascii.hexlify(iv), 16))
+    expected = AES.new(bytes(key), AES.MODE_CTR, counter=counter).encrypt(bytes(data))
+    assert bytes(bflb_utils.img_create_encrypt_data(data, key, iv, 1)) == expected
+    assert bytes(bflb_utils.aes_ctr_crypt_data(data, key, iv, workers=4,
+                                               chunk_size=0x1000)) == expected
+    assert bytes(bflb_utils.aes_decrypt_data(expected, key, iv, 1)) == bytes(data)